@@ -7,6 +7,8 @@ import os.path
 import tempfile
 
 import grizzly.adapters
+from .common.compress import CODECS
+from .common.sharding import CorpusShard
 from .target import available as available_targets
 
 # ref: https://stackoverflow.com/questions/12268602/sort-argparse-help-alphabetically
@@ -140,9 +142,30 @@ class GrizzlyArgs(CommonArgs):
         self.parser.add_argument(
             "--accepted-extensions", nargs="+",
             help="Space separated list of supported file extensions. ie: html svg (default: all)")
+        self.parser.add_argument(
+            "--adaptive-relaunch", action="store_true",
+            help="Relaunch the browser when it is cheaper than continuing based on measured launch"
+                 " and iteration times. --relaunch is used as the upper limit")
+        self.parser.add_argument(
+            "--adaptive-rotation", action="store_true",
+            help="Adjust the number of test cases generated from each input file based on"
+                 " previous results. Requires '--scheduler weighted'")
+        self.parser.add_argument(
+            "--adaptive-timeout", action="store_true",
+            help="Calculate the test case time limit from the durations of previous test cases."
+                 " The iteration timeout is only reduced when timeouts are ignored. --timeout is"
+                 " used as the upper limit")
         self.parser.add_argument(
             "-c", "--cache", type=int, default=0,
             help="Maximum number of additional test cases to include in report (default: %(default)s)")
+        self.parser.add_argument(
+            "--cache-limit", type=int, default=0,
+            help="Maximum size (MBs) of test cases kept in memory. Older test cases are compressed"
+                 " and moved to disk, use with --cache to keep a deeper history (default: %(default)s"
+                 " - no limit)")
+        self.parser.add_argument(
+            "--checkpoint",
+            help="Save progress to this file and resume from it when it exists")
         self.parser.add_argument(
             "--coverage", action="store_true",
             help="Enable coverage collection")
@@ -152,12 +175,63 @@ class GrizzlyArgs(CommonArgs):
         self.parser.add_argument(
             "--mime",
             help="Specify a mime type")
+        self.parser.add_argument(
+            "--min-crashes", type=int, default=1,
+            help="Results required to consider an input file reproduced when replaying"
+                 " (SINGLE PASS mode) (default: %(default)s)")
+        self.parser.add_argument(
+            "--outbox",
+            help="Stage FuzzManager submissions in this directory and submit them in the background,"
+                 " failed submissions are retried. Pending submissions are resumed by the next run"
+                 " using the same directory")
+        self.parser.add_argument(
+            "--repeat", type=int, default=1,
+            help="Number of times each input file is used when replaying (SINGLE PASS mode)"
+                 " (default: %(default)s)")
+        self.parser.add_argument(
+            "--replay-summary",
+            help="Write the outcome of each input file (runs, crashes, signatures, mean duration)"
+                 " to a JSON file when replaying (SINGLE PASS mode)")
+        self.parser.add_argument(
+            "--report-queue", type=int, default=0,
+            help="Submit results in the background. Maximum number of reports waiting to be"
+                 " submitted before fuzzing is paused (default: %(default)s - disabled)")
+        self.parser.add_argument(
+            "--resume", action="store_true",
+            help="Save progress and resume from the checkpoint saved by a previous run using the"
+                 " same adapter, input, binary and shard. Instances running at the same time use"
+                 " separate checkpoints")
         self.parser.add_argument(
             "--rr", action="store_true",
             help="Use RR (Linux only)")
+        self.parser.add_argument(
+            "--rr-codec", choices=tuple(CODECS), default="bz2",
+            help="Compression used for RR trace archives, archives are compressed in parallel"
+                 " using all available cores (default: %(default)s)")
         self.parser.add_argument(
             "--s3-fuzzmanager", action="store_true",
             help="Report large attachments (if any) to S3 and then the crash & S3 link to FuzzManager")
+        self.parser.add_argument(
+            "--scheduler", choices=("random", "weighted"), default="random",
+            help="Input file selection. 'weighted' prefers input files that have produced results,"
+                 " statistics are kept with the corpus index (default: %(default)s)")
+        self.parser.add_argument(
+            "--shard",
+            help="Only use the input files assigned to this instance when several instances"
+                 " share a corpus. Format: INDEX/COUNT, for example 2/4 (default: use all)")
+        self.parser.add_argument(
+            "--shard-queue",
+            help="Directory shared by instances replaying the same corpus (SINGLE PASS mode)."
+                 " Input files are claimed before use so each file is replayed by one instance."
+                 " Use a new directory for each pass")
+        self.parser.add_argument(
+            "--standby", action="store_true",
+            help="Launch the next browser in the background before it is needed to hide launch time."
+                 " Requires resources to run two browsers")
+        self.parser.add_argument(
+            "--workers", type=int, default=1,
+            help="Number of targets used in parallel when replaying (SINGLE PASS mode). Each"
+                 " worker runs in a separate process (default: %(default)s)")
 
     def sanity_check(self, args):
         super(GrizzlyArgs, self).sanity_check(args)
@@ -170,8 +244,44 @@ class GrizzlyArgs(CommonArgs):
                 msg.append("No adapters available.")
             self.parser.error(" ".join(msg))
 
+        if args.cache_limit < 0:
+            self.parser.error("--cache-limit must be >= 0")
+
+        if args.report_queue < 0:
+            self.parser.error("--report-queue must be >= 0")
+
+        if args.repeat < 1:
+            self.parser.error("--repeat must be >= 1")
+
+        if not 0 < args.min_crashes <= args.repeat:
+            self.parser.error("--min-crashes must be >= 1 and <= --repeat")
+
+        if args.workers < 1:
+            self.parser.error("--workers must be >= 1")
+
+        if args.resume and (args.shard_queue is not None or args.workers > 1):
+            self.parser.error("--resume cannot be used with --shard-queue or --workers")
+
+        if args.checkpoint is not None and (args.shard_queue is not None or args.workers > 1):
+            self.parser.error("--checkpoint cannot be used with --shard-queue or --workers")
+
+        if args.shard is not None:
+            try:
+                CorpusShard.parse(args.shard)
+            except ValueError as exc:
+                self.parser.error(str(exc))
+
+        if args.adaptive_rotation and args.scheduler != "weighted":
+            self.parser.error("--adaptive-rotation requires '--scheduler weighted'")
+
+        if args.rr_codec != "bz2" and not args.rr:
+            self.parser.error("--rr-codec can only be given with --rr")
+
         if args.fuzzmanager and args.s3_fuzzmanager:
             self.parser.error("--fuzzmanager and --s3-fuzzmanager are mutually exclusive")
 
+        if args.outbox is not None and not (args.fuzzmanager or args.s3_fuzzmanager):
+            self.parser.error("--outbox can only be given with --fuzzmanager/--s3-fuzzmanager")
+
         if args.tool is not None and not (args.fuzzmanager or args.s3_fuzzmanager):
             self.parser.error("--tool can only be given with --fuzzmanager/--s3-fuzzmanager")
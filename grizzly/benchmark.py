@@ -0,0 +1,248 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Measure the overhead of Grizzly by running Session.run() with the NoOpAdapter
+and a SimulatedTarget in place of a browser. Crashes and timeouts can be injected
+at configurable rates to include the cost of detecting and reporting results.
+"""
+import argparse
+from functools import wraps
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import grizzly.adapters
+from .common import ContentStore, FilesystemReporter, IOManager, Status, TestFile
+from .session import Session
+from .target.simulated_target import SimulatedTarget
+
+__all__ = ("PhaseTimer", "run_benchmark")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+log = logging.getLogger("grizzly")  # pylint: disable=invalid-name
+
+
+class PhaseTimer(object):
+    """PhaseTimer records the number of calls and the total time spent in
+    wrapped callables grouped by phase name.
+    """
+    def __init__(self):
+        self.calls = dict()
+        self.totals = dict()
+
+    def summary(self, duration):
+        """Create a summary of the time spent in each phase.
+
+        Args:
+            duration (float): Total run time used to calculate the percentage of time
+                              spent in each phase.
+
+        Returns:
+            list: Lines of text, one per phase.
+        """
+        lines = ["%-16s %8s %10s %10s %6s" % ("phase", "calls", "total(s)", "mean(ms)", "%")]
+        for phase in sorted(self.totals, key=self.totals.get, reverse=True):
+            if not self.calls[phase]:
+                continue
+            total = self.totals[phase]
+            lines.append("%-16s %8d %10.3f %10.3f %6.1f" % (
+                phase,
+                self.calls[phase],
+                total,
+                total / self.calls[phase] * 1000,
+                total / duration * 100 if duration > 0 else 0))
+        return lines
+
+    def wrap(self, phase, func):
+        """Wrap a callable to record time spent calling it.
+
+        Args:
+            phase (str): Name of phase.
+            func (callable): Function to wrap.
+
+        Returns:
+            callable: Wrapped function.
+        """
+        self.calls.setdefault(phase, 0)
+        self.totals.setdefault(phase, 0.0)
+
+        @wraps(func)
+        def _timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.calls[phase] += 1
+                self.totals[phase] += time.time() - start
+        return _timed
+
+
+def run_benchmark(iterations, batch=1, crash_rate=0.0, relaunch=1000, seed=None, test_delay=0.0,
+                  timeout=5, timeout_rate=0.0, working_path=None):
+    """Run Session.run() with the NoOpAdapter and a SimulatedTarget.
+
+    Args:
+        iterations (int): Number of iterations (test cases) to perform.
+        batch (int): Number of test cases served per call to Sapphire.
+        crash_rate (float): Chance a test case crashes the target.
+        relaunch (int): Number of iterations between target relaunches.
+        seed (int): Seed used to make the injected failures reproducible.
+        test_delay (float): Simulated time spent running each test case.
+        timeout (int): Iteration timeout in seconds.
+        timeout_rate (float): Chance a test case hangs the target.
+        working_path (str): Directory to use for temporary files.
+
+    Returns:
+        dict: Results including the total duration, iterations per second and
+              a PhaseTimer.
+    """
+    if not grizzly.adapters.names():
+        grizzly.adapters.load()
+    bench_path = tempfile.mkdtemp(prefix="grz_bench_", dir=working_path)
+    adapter = None
+    iomanager = None
+    session = None
+    target = None
+    timer = PhaseTimer()
+    try:
+        TestFile.STORE = ContentStore(os.path.join(bench_path, "store"))
+        iomanager = IOManager(working_path=bench_path)
+        adapter = grizzly.adapters.get("no-op")()
+        adapter.BATCH_SIZE = batch
+        # the simulated browser is run by the current interpreter
+        target = SimulatedTarget(
+            sys.executable, None, 300, 0, 0, None, relaunch,
+            crash_rate=crash_rate,
+            seed=seed,
+            test_delay=test_delay,
+            timeout_rate=timeout_rate)
+        adapter.monitor = target.monitor
+        adapter.setup(iomanager.server_map)
+        iomanager.harness = adapter.get_harness()
+        reporter = FilesystemReporter(report_path=os.path.join(bench_path, "results"))
+        session = Session(adapter, False, [], iomanager, reporter, target)
+        session.config_server(timeout)
+        target.reverse(session.server.get_port(), session.server.get_port())
+        # record time spent in each phase of an iteration
+        session.generate_testcase = timer.wrap("generate", session.generate_testcase)
+        session.server.serve_testcase = timer.wrap("serve", session.server.serve_testcase)
+        session.serve_batch = timer.wrap("serve", session.serve_batch)
+        session.check_results = timer.wrap("check_results", session.check_results)
+        session.report_result = timer.wrap("report", session.report_result)
+        session.launch_target = timer.wrap("launch", session.launch_target)
+        target.check_relaunch = timer.wrap("check_relaunch", target.check_relaunch)
+        start_time = time.time()
+        session.run(iteration_limit=iterations)
+        duration = time.time() - start_time
+        return {
+            "duration": duration,
+            "ignored": session.status.ignored,
+            "iterations": session.status.iteration,
+            "launches": target.monitor.launches,
+            "rate": session.status.iteration / duration if duration > 0 else 0,
+            "results": session.status.results,
+            "timer": timer}
+    finally:
+        if session is not None:
+            session.close()
+        if target is not None:
+            target.cleanup()
+        if adapter is not None:
+            adapter.cleanup()
+        if iomanager is not None:
+            iomanager.cleanup()
+        if TestFile.STORE is not None:
+            TestFile.STORE.cleanup()
+            TestFile.STORE = None
+        shutil.rmtree(bench_path, ignore_errors=True)
+
+
+def main(args=None):
+    """Run the Grizzly benchmark (main entrypoint).
+
+    Args:
+        args (list/None): Argument list to parse instead of sys.argv (for testing).
+
+    Returns:
+        int: 0 on success
+    """
+    log_level = logging.INFO
+    log_fmt = "[%(asctime)s] %(message)s"
+    if bool(os.getenv("DEBUG")):
+        log_level = logging.DEBUG
+        log_fmt = "%(levelname).1s %(name)s [%(asctime)s] %(message)s"
+    logging.basicConfig(format=log_fmt, datefmt="%Y-%m-%d %H:%M:%S", level=log_level)
+
+    parser = argparse.ArgumentParser(description="Grizzly iteration throughput benchmark")
+    parser.add_argument(
+        "--batch", type=int, default=1,
+        help="Number of test cases served per iteration (default: %(default)s)")
+    parser.add_argument(
+        "--crash-rate", type=float, default=0.0,
+        help="Chance a test case crashes the simulated browser (default: %(default)s)")
+    parser.add_argument(
+        "-n", "--iterations", type=int, default=1000,
+        help="Number of iterations to perform (default: %(default)s)")
+    parser.add_argument(
+        "--relaunch", type=int, default=1000,
+        help="Number of iterations performed before relaunching the simulated browser"
+             " (default: %(default)s)")
+    parser.add_argument(
+        "--seed", type=int,
+        help="Seed used when injecting failures")
+    parser.add_argument(
+        "--test-delay", type=float, default=0.0,
+        help="Seconds the simulated browser spends running each test case (default: %(default)s)")
+    parser.add_argument(
+        "--timeout", type=int, default=5,
+        help="Iteration timeout in seconds (default: %(default)s)")
+    parser.add_argument(
+        "--timeout-rate", type=float, default=0.0,
+        help="Chance a test case hangs the simulated browser (default: %(default)s)")
+    parser.add_argument(
+        "-w", "--working-path",
+        help="Working directory. Intended to be used with ram-drives. (default: %r)" % tempfile.gettempdir())
+    args = parser.parse_args(args)
+    if args.batch < 1:
+        parser.error("--batch must be > 0")
+    if args.iterations < 1:
+        parser.error("--iterations must be > 0")
+    if args.working_path is not None and not os.path.isdir(args.working_path):
+        parser.error("%r is not a directory" % (args.working_path,))
+    for rate in (args.crash_rate, args.timeout_rate):
+        if not 0 <= rate <= 1:
+            parser.error("--crash-rate and --timeout-rate must be between 0 and 1")
+
+    # keep the status report away from active sessions
+    status_path = Status.PATH
+    Status.PATH = tempfile.mkdtemp(prefix="grz_bench_status_")
+    try:
+        results = run_benchmark(
+            args.iterations,
+            batch=args.batch,
+            crash_rate=args.crash_rate,
+            relaunch=args.relaunch,
+            seed=args.seed,
+            test_delay=args.test_delay,
+            timeout=args.timeout,
+            timeout_rate=args.timeout_rate,
+            working_path=args.working_path)
+    finally:
+        shutil.rmtree(Status.PATH, ignore_errors=True)
+        Status.PATH = status_path
+    log.info("Iterations: %d, Launches: %d, Results: %d, Ignored: %d",
+             results["iterations"], results["launches"], results["results"], results["ignored"])
+    log.info("Duration: %0.2fs, Rate: %0.2f iterations/sec", results["duration"], results["rate"])
+    for line in results["timer"].summary(results["duration"]):
+        log.info(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
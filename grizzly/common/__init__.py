@@ -4,15 +4,22 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from .adapter import Adapter, AdapterError
+from .content_store import ContentStore
+from .corpus import CorpusIndex
 from .iomanager import IOManager, ServerMap
-from .reporter import FilesystemReporter, FuzzManagerReporter, Report, Reporter, S3FuzzManagerReporter
+from .outbox import Outbox
+from .reporter import (FilesystemReporter, FuzzManagerReporter, Report, Reporter, ReportQueue,
+                       S3FuzzManagerReporter)
+from .scheduler import InputScheduler, RandomScheduler, WeightedScheduler
+from .sharding import CorpusShard, WorkQueue
 from .status import ReducerStats, Status
 from .storage import InputFile, TestCase, TestFile
 
 
 __all__ = (
-    "Adapter", "AdapterError", "FilesystemReporter", "FuzzManagerReporter", "IOManager", "InputFile",
-    "ReducerStats", "Report", "Reporter", "S3FuzzManagerReporter", "ServerMap", "Status", "TestCase",
-    "TestFile")
+    "Adapter", "AdapterError", "ContentStore", "CorpusIndex", "CorpusShard", "FilesystemReporter",
+    "FuzzManagerReporter", "IOManager", "InputFile", "InputScheduler", "Outbox", "RandomScheduler",
+    "ReducerStats", "Report", "Reporter", "ReportQueue", "S3FuzzManagerReporter", "ServerMap", "Status",
+    "TestCase", "TestFile", "WeightedScheduler", "WorkQueue")
 __author__ = "Jesse Schwartzentruber"
 __credits__ = ["Jesse Schwartzentruber", "Tyson Smith"]
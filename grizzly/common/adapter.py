@@ -20,8 +20,13 @@ class AdapterError(RuntimeError):
 
 @six.add_metaclass(abc.ABCMeta)
 class Adapter(object):
+    # test cases served per iteration (>1 requires the default harness), test cases in a
+    # batch share a directory so test cases containing files with the same name (other
+    # than the harness) are served separately
+    BATCH_SIZE = 1
     HARNESS_FILE = os.path.join(os.path.dirname(__file__), "harness.html")
     IGNORE_UNSERVED = True  # Only report test cases with served content
+    MIN_TEST_DURATION = 1  # minimum execution time per test (used by adaptive timeout)
     NAME = None  # must be set to a unique 'str' by subclass
     RELAUNCH = 0  # maximum iterations between Target relaunches (<1 use default)
     ROTATION_PERIOD = 10  # iterations per input file before switching
@@ -64,9 +69,10 @@ class Adapter(object):
         """
         if self._harness is not None:
             self._harness.close()
+        # the harness is shared (not copied) by every test case
         self._harness = TestFile.from_file(
             self.HARNESS_FILE if file_path is None else file_path,
-            "grizzly_fuzz_harness.html")
+            "grizzly_fuzz_harness.html").freeze()
 
     def get_harness(self):
         """Get the harness. Used internally by Grizzly.
@@ -0,0 +1,161 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import bz2
+import collections
+import multiprocessing
+import multiprocessing.pool
+import zlib
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    # not available in Python 2
+    lzma = None  # pylint: disable=invalid-name
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # pylint: disable=invalid-name
+
+__all__ = ("CODECS", "ParallelCompressor")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+
+def _compress_bz2(data, fast):
+    return bz2.compress(data, 1 if fast else 9)
+
+
+def _compress_gz(data, fast):
+    # level 0 stores the data, wbits 31 creates a gzip member
+    comp = zlib.compressobj(0 if fast else 6, zlib.DEFLATED, 31)
+    return comp.compress(data) + comp.flush()
+
+
+def _compress_xz(data, fast):
+    return lzma.compress(data, preset=0 if fast else 6)
+
+
+def _compress_zst(data, fast):
+    # incompressible blocks are stored by the compressor
+    return zstandard.ZstdCompressor(level=1 if fast else 10).compress(data)
+
+
+# compressed streams of each of these formats can be concatenated and
+# the result is decompressed by the standard tools as a single stream
+CODECS = collections.OrderedDict((("bz2", _compress_bz2), ("gz", _compress_gz)))
+if lzma is not None:
+    CODECS["xz"] = _compress_xz
+if zstandard is not None:
+    CODECS["zst"] = _compress_zst
+
+
+def _compress_chunk(codec, data):
+    # check a sample to avoid spending time compressing data that is already compressed
+    sample = data[:ParallelCompressor.SAMPLE_SIZE]
+    fast = len(zlib.compress(sample, 1)) > len(sample) * ParallelCompressor.INCOMPRESSIBLE_RATIO
+    return CODECS[codec](data, fast)
+
+
+class ParallelCompressor(object):
+    """ParallelCompressor is a write only file-like object that splits the data
+    written to it into chunks and compresses the chunks in parallel using a pool
+    of threads (the compression modules release the GIL). Each chunk is written
+    to fileobj as an independent compressed stream, in order. Chunks that appear
+    to be compressed already are stored (gz) or compressed using the fastest
+    setting available for the codec.
+    """
+    CHUNK_SIZE = 0x800000  # 8MB
+    INCOMPRESSIBLE_RATIO = 0.9
+    SAMPLE_SIZE = 0x10000  # 64KB
+
+    def __init__(self, fileobj, codec="bz2", workers=None, chunk_size=CHUNK_SIZE):
+        assert chunk_size > 0
+        if codec not in CODECS:
+            raise ValueError("Unsupported codec %r" % (codec,))
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        assert workers > 0
+        self._buffer = list()
+        self._buffer_size = 0
+        self._chunk_size = chunk_size
+        # limit the number of chunks held in memory
+        self._max_pending = workers * 2
+        self._pending = collections.deque()
+        self._pool = multiprocessing.pool.ThreadPool(workers)
+        self.codec = codec
+        self.fileobj = fileobj
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _submit(self, data):
+        self._pending.append(self._pool.apply_async(_compress_chunk, (self.codec, data)))
+        while len(self._pending) > self._max_pending:
+            self.fileobj.write(self._pending.popleft().get())
+
+    def abort(self):
+        """Stop the workers without writing the remaining data.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._buffer = list()
+        self._buffer_size = 0
+        self._pending.clear()
+
+    def close(self):
+        """Compress the remaining data, write it to fileobj and stop the workers.
+        fileobj is not closed.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._pool is None:
+            return
+        try:
+            if self._buffer_size:
+                self._submit(b"".join(self._buffer))
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().get())
+        finally:
+            self.abort()
+
+    def write(self, data):
+        """Add data to the compressed stream.
+
+        Args:
+            data (bytes): Data to add.
+
+        Returns:
+            None
+        """
+        assert self._pool is not None, "ParallelCompressor is closed"
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        if self._buffer_size < self._chunk_size:
+            return
+        data = b"".join(self._buffer)
+        offset = 0
+        while len(data) - offset >= self._chunk_size:
+            self._submit(data[offset:offset + self._chunk_size])
+            offset += self._chunk_size
+        self._buffer = [data[offset:]]
+        self._buffer_size = len(data) - offset
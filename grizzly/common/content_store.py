@@ -0,0 +1,167 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # pylint: disable=invalid-name
+
+__all__ = ("ContentStore",)
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = logging.getLogger("content_store")
+
+
+class ContentStore(object):
+    """ContentStore keeps a single copy of data in a directory, named by the SHA1
+    of the content. Entries are reference counted and removed when released by all
+    owners. Entries can be placed at a destination by reflink (copy-on-write clone,
+    on supporting filesystems) or hardlink instead of copying the data. Entries are
+    read-only (POSIX) so hardlinked copies can not be used to modify the store.
+    """
+    FICLONE = 0x40049409  # Linux ioctl used to create a reflink
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self._hardlink = True  # hardlinks are supported
+        self._lock = threading.Lock()
+        self._reflink = fcntl is not None  # reflinks are supported
+        self._refs = dict()  # digest -> reference count
+
+    def __contains__(self, digest):
+        return digest in self._refs
+
+    def __len__(self):
+        return len(self._refs)
+
+    def acquire(self, digest):
+        """Add a reference to an existing entry.
+
+        Args:
+            digest (str): Entry to reference.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._refs[digest] += 1
+
+    def add(self, chunks):
+        """Add data to the store. If an entry with identical content exists a new
+        reference is added to the existing entry instead.
+
+        Args:
+            chunks (iterable): Data (bytes-like objects) to add.
+
+        Returns:
+            str: Digest of the entry.
+        """
+        sha1 = hashlib.sha1()
+        fd, tmp_file = tempfile.mkstemp(prefix="tmp_", dir=self.path)
+        try:
+            with os.fdopen(fd, "wb") as out_fp:
+                for data in chunks:
+                    sha1.update(data)
+                    out_fp.write(data)
+            digest = sha1.hexdigest()
+            with self._lock:
+                if digest in self._refs:
+                    self._refs[digest] += 1
+                    return digest
+                entry = os.path.join(self.path, digest)
+                if os.name == "posix":
+                    os.chmod(tmp_file, 0o444)
+                os.rename(tmp_file, entry)
+                tmp_file = None
+                self._refs[digest] = 1
+            return digest
+        finally:
+            if tmp_file is not None:
+                os.remove(tmp_file)
+
+    def cleanup(self):
+        """Remove all entries and the store directory.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._refs.clear()
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def link(self, digest, dst, hardlink=True):
+        """Place an entry at dst without copying the data if possible. A reflink is
+        attempted first, then a hardlink. Methods that fail with an unsupported
+        or cross device error are not attempted again.
+
+        Args:
+            digest (str): Entry to place.
+            dst (str): Destination path. Must not exist.
+            hardlink (bool): Allow hardlinks. Hardlinks share the (read-only) entry
+                             so they should only be used for short lived files.
+
+        Returns:
+            bool: True if dst was created otherwise False (caller should copy).
+        """
+        entry = os.path.join(self.path, digest)
+        if digest not in self._refs:
+            return False
+        if self._reflink:
+            try:
+                with open(entry, "rb") as src_fp, open(dst, "wb") as dst_fp:
+                    fcntl.ioctl(dst_fp.fileno(), self.FICLONE, src_fp.fileno())
+                return True
+            except (IOError, OSError) as exc:
+                LOG.debug("reflink failed: %s", exc)
+                if os.path.isfile(dst):
+                    os.remove(dst)
+                if exc.errno in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY):
+                    self._reflink = False
+        if hardlink and self._hardlink:
+            try:
+                os.link(entry, dst)
+                return True
+            except (AttributeError, OSError) as exc:
+                LOG.debug("hardlink failed: %s", exc)
+                if isinstance(exc, AttributeError) or exc.errno in (errno.EPERM, errno.EXDEV):
+                    self._hardlink = False
+        return False
+
+    def release(self, digest):
+        """Remove a reference to an entry. The entry is removed when it is no longer
+        referenced.
+
+        Args:
+            digest (str): Entry to release.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            refs = self._refs.get(digest)
+            if refs is None:
+                # store was cleaned up
+                return
+            if refs > 1:
+                self._refs[digest] = refs - 1
+                return
+            del self._refs[digest]
+            try:
+                os.remove(os.path.join(self.path, digest))
+            except OSError:  # pragma: no cover
+                pass
@@ -0,0 +1,224 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from collections import namedtuple
+import hashlib
+import json
+import logging
+import os
+
+__all__ = ("CorpusEntry", "CorpusIndex")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = logging.getLogger("corpus")
+
+CorpusEntry = namedtuple("CorpusEntry", "size mtime hash")
+
+
+class CorpusIndex(object):
+    """CorpusIndex tracks the files in a corpus directory (size, modification time and
+    content hash). The index can be saved and loaded to avoid rescanning the corpus.
+    Updates are incremental, the contents of a directory are only rescanned if the
+    modification time of the directory has changed (files have been added, removed or
+    renamed). Modifying an existing file in place is not detected.
+    """
+    IGNORED = ("desktop.ini", "thumbs.db")  # usually auto generated OS files
+    VERSION = 1
+
+    def __init__(self, root, index_file=None):
+        assert os.path.isdir(root)
+        self.index_file = index_file
+        self.root = os.path.abspath(root)
+        self._dirs = dict()  # relative directory path -> {"mtime", "dirs", "files"}
+        self._modified = False  # index has changed since it was loaded
+
+    def __iter__(self):
+        """Iterate over entries in the index.
+
+        Args:
+            None
+
+        Yields:
+            tuple: Absolute file path (str) and CorpusEntry.
+        """
+        for rel_dir, info in self._dirs.items():
+            abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+            for f_name, entry in info["files"].items():
+                yield os.path.join(abs_dir, f_name), CorpusEntry(*entry)
+
+    def __len__(self):
+        return sum(len(x["files"]) for x in self._dirs.values())
+
+    def files(self, accepted_extensions=None, paths=None):
+        """Get the paths of non-empty files in the index.
+
+        Args:
+            accepted_extensions (iterable): File extensions to include (default: all).
+            paths (iterable): Only check these absolute paths (default: all files).
+
+        Yields:
+            str: Absolute path to file.
+        """
+        if accepted_extensions:
+            accepted_extensions = set(ext.lstrip(".").lower() for ext in accepted_extensions)
+        if paths is None:
+            entries = iter(self)
+        else:
+            entries = ((x, self.get(x)) for x in paths)
+        for file_path, entry in entries:
+            if entry is None or not entry.size:
+                continue
+            if accepted_extensions:
+                if os.path.splitext(file_path)[1].lstrip(".").lower() not in accepted_extensions:
+                    continue
+            yield file_path
+
+    def get(self, file_path):
+        """Look up the entry of a file in the index.
+
+        Args:
+            file_path (str): Absolute path to file.
+
+        Returns:
+            CorpusEntry: Entry for the file or None if the file is not in the index.
+        """
+        rel_dir, f_name = os.path.split(os.path.relpath(file_path, self.root))
+        entry = self._dirs.get(rel_dir, {}).get("files", {}).get(f_name)
+        return CorpusEntry(*entry) if entry is not None else None
+
+    @staticmethod
+    def hash_file(file_path):
+        """Calculate the SHA1 hash of a file.
+
+        Args:
+            file_path (str): File to hash.
+
+        Returns:
+            str: Hex digest of the file content.
+        """
+        digest = hashlib.sha1()
+        with open(file_path, "rb") as in_fp:
+            while True:
+                data = in_fp.read(0x10000)  # 64KB
+                if not data:
+                    break
+                digest.update(data)
+        return digest.hexdigest()
+
+    def load(self):
+        """Load the index from index_file. A missing or invalid index is ignored and
+        will be rebuilt by the next call to update().
+
+        Args:
+            None
+
+        Returns:
+            bool: True if the index was loaded otherwise False.
+        """
+        if self.index_file is None or not os.path.isfile(self.index_file):
+            return False
+        try:
+            with open(self.index_file, "r") as in_fp:
+                data = json.load(in_fp)
+        except ValueError:
+            LOG.warning("Corpus index %r is invalid", self.index_file)
+            return False
+        if data.get("version") != self.VERSION or data.get("root") != self.root:
+            LOG.debug("corpus index %r does not match", self.index_file)
+            return False
+        self._dirs = data["dirs"]
+        self._modified = False
+        return True
+
+    def save(self):
+        """Write the index to index_file if it has been modified.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if the index was written otherwise False.
+        """
+        if self.index_file is None or not self._modified:
+            return False
+        # write to a temporary file and rename to avoid leaving a partial index
+        tmp_file = "%s.%d.tmp" % (self.index_file, os.getpid())
+        with open(tmp_file, "w") as out_fp:
+            json.dump({"dirs": self._dirs, "root": self.root, "version": self.VERSION}, out_fp)
+        os.rename(tmp_file, self.index_file)
+        self._modified = False
+        return True
+
+    def _scan_dir(self, rel_dir, abs_dir, mtime):
+        # rescan the content of a directory, unchanged entries are reused
+        old_files = self._dirs.get(rel_dir, {}).get("files", {})
+        files = dict()
+        dirs = list()
+        for entry in os.listdir(abs_dir):
+            entry_path = os.path.join(abs_dir, entry)
+            if os.path.isdir(entry_path):
+                # symlinked directories are not followed (like os.walk()) to avoid loops
+                if not os.path.islink(entry_path):
+                    dirs.append(entry)
+                continue
+            # check for unwanted files
+            if entry.startswith(".") or entry.lower() in self.IGNORED:
+                continue
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                # file was removed
+                continue
+            known = old_files.get(entry)
+            if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime:
+                files[entry] = known
+                continue
+            try:
+                files[entry] = [stat.st_size, stat.st_mtime, self.hash_file(entry_path)]
+            except (IOError, OSError):
+                continue
+        self._dirs[rel_dir] = {"dirs": dirs, "files": files, "mtime": mtime}
+        added = [os.path.join(abs_dir, x) for x in set(files) - set(old_files)]
+        removed = [os.path.join(abs_dir, x) for x in set(old_files) - set(files)]
+        return added, removed
+
+    def update(self):
+        """Update the index to match the content of the corpus directory.
+
+        Args:
+            None
+
+        Returns:
+            tuple: Absolute paths of files added (list) and removed (list).
+        """
+        added = list()
+        removed = list()
+        seen = set()
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+            try:
+                mtime = os.stat(abs_dir).st_mtime
+            except OSError:
+                # directory was removed
+                continue
+            seen.add(rel_dir)
+            info = self._dirs.get(rel_dir)
+            if info is None or info["mtime"] != mtime:
+                d_added, d_removed = self._scan_dir(rel_dir, abs_dir, mtime)
+                added.extend(d_added)
+                removed.extend(d_removed)
+                self._modified = True
+                info = self._dirs[rel_dir]
+            pending.extend(os.path.join(rel_dir, x) for x in info["dirs"])
+        # remove directories that no longer exist
+        for rel_dir in set(self._dirs) - seen:
+            abs_dir = os.path.join(self.root, rel_dir)
+            removed.extend(os.path.join(abs_dir, x) for x in self._dirs.pop(rel_dir)["files"])
+            self._modified = True
+        if added or removed:
+            LOG.debug("corpus index updated: %d added, %d removed", len(added), len(removed))
+        return added, removed
@@ -4,20 +4,28 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from collections import deque
+import logging
 import os
-import random
 import re
+import tempfile
+import threading
+import time
 
 from sapphire.server_map import ServerMap
-from .storage import InputFile, TestCase, TestFile
+from .corpus import CorpusIndex
+from .scheduler import RandomScheduler
+from .storage import InputFile, TestCase, TestCaseLoadFailure, TestFile
 
 
 __all__ = ("IOManager",)
 __author__ = "Tyson Smith"
 __credits__ = ["Tyson Smith"]
 
+log = logging.getLogger("grizzly")  # pylint: disable=invalid-name
+
 
 class IOManager(object):
+    REFRESH_FREQ = 60  # minimum number of seconds between corpus rescans
     TRACKED_ENVVARS = (
         "ASAN_OPTIONS",
         "LSAN_OPTIONS",
@@ -25,22 +33,58 @@ class IOManager(object):
         "GRZ_FORCED_CLOSE",
         "MOZ_CHAOSMODE")
 
-    def __init__(self, report_size=1, mime_type=None, working_path=None):
+    def __init__(self, report_size=1, mime_type=None, working_path=None, scheduler=None, memory_limit=0,
+                 shard=None, work_queue=None, repeat=1):
         assert report_size > 0
+        assert repeat > 0
+        assert memory_limit >= 0
         self.active_input = None  # current active input file
+        self.corpus = None  # CorpusIndex of the input directory
         self.harness = None
         self.input_files = list()  # paths to files to use as a corpus
+        self.memory_limit = memory_limit  # max size (bytes) of test cases kept in memory (0 = no limit)
+        self.repeat = repeat  # number of test cases generated using each input file (single pass mode)
+        self.scheduler = scheduler or RandomScheduler()  # select active input files
         self.server_map = ServerMap()  # manage redirects, include directories and dynamic responses
+        self.shard = shard  # CorpusShard, only use input files assigned to this instance
         self.tests = deque()
+        self.work_queue = work_queue  # WorkQueue, claim input files before use (single pass mode)
         self.working_path = working_path
+        self._accepted_extensions = None
+        self._claims = set()  # input files claimed from work_queue that have not been used
         self._environ_files = list()  # collection of files that should be added to the testcase
         self._generated = 0  # number of test cases generated
+        self._input_hashes = dict()  # content hash -> path, used to skip duplicate input files
+        self._input_generated = 0  # number of test cases generated using the active input
+        self._input_period = None  # rotation period selected by the scheduler for the active input
         self._mime = mime_type
+        self._prefetch = None  # next input file loaded in the background
+        self._refresh = None  # background corpus rescan
+        self._refresh_time = 0  # time of last corpus rescan
         self._report_size = report_size
+        self._sort_input = False  # keep input_files sorted (single pass mode)
+        # archives of older test cases (see memory_limit) and the details that are not
+        # restored by TestCase.load() as (archive, input file, redirect page)
+        self._spilled = deque()
         # used to record environment variable that directly impact the browser
         self._tracked_env = self.tracked_environ()
         self._add_suppressions()
 
+    def _add_inputs(self, paths):
+        # add files from the corpus index to input_files skipping files with
+        # content that is identical to an existing input file
+        duplicates = 0
+        for path in paths:
+            digest = self.corpus.get(path).hash
+            if self.shard is not None and digest not in self.shard:
+                continue
+            if digest in self._input_hashes:
+                duplicates += 1
+                continue
+            self._input_hashes[digest] = path
+            self.input_files.append(path)
+        return duplicates
+
     def _add_suppressions(self):
         # Add suppression files to environment files
         for opt_var in (e_var for e_var in os.environ if "SAN_OPTIONS" in e_var):
@@ -53,10 +97,34 @@ class IOManager(object):
                 supp_file = opt.split("=")[-1].strip("'\"")
                 if os.path.isfile(supp_file):
                     fname = "%s.supp" % (opt_var.split("_")[0].lower(),)
-                    self._environ_files.append(TestFile.from_file(supp_file, fname))
+                    self._environ_files.append(TestFile.from_file(supp_file, fname).freeze())
                     break
 
+    def _claim_next(self):
+        # make sure the next input file (single pass mode) has been claimed by
+        # this instance, skip input files claimed by other instances
+        while self.input_files and self.input_files[-1] not in self._claims:
+            if self.work_queue.claim(self.input_files[-1]):
+                self._claims.add(self.input_files[-1])
+            else:
+                self.input_files.pop()
+
     def cleanup(self):
+        if self._prefetch is not None:
+            self._prefetch.join()
+            if self._prefetch.input_file is not None:
+                self._prefetch.input_file.close()
+            self._prefetch = None
+        if self._refresh is not None:
+            self._refresh.join()
+            self._refresh = None
+        if self.corpus is not None:
+            self.corpus.save()
+        self.scheduler.close()
+        # allow other instances to process input files that have not been used
+        for file_name in self._claims:
+            self.work_queue.release(file_name)
+        self._claims.clear()
         if self.active_input is not None:
             self.active_input.close()
         if self.harness is not None:
@@ -65,18 +133,23 @@ class IOManager(object):
             e_file.close()
         self.purge_tests()
 
-    def create_testcase(self, adapter_name, rotation_period=10):
+    def create_testcase(self, adapter_name, rotation_period=10, batch_index=0):
+        # pick up changes made to the corpus directory
+        self.refresh_input()
+        if self.work_queue is not None and rotation_period < 1:
+            self._claim_next()
         # check if we should choose a new active input file
         if self._rotation_required(rotation_period):
             assert self.input_files
             # close previous input if needed
             if self.active_input is not None:
                 self.active_input.close()
+            self.active_input = self._next_input(single_pass=rotation_period < 1)
             if rotation_period > 0:
-                self.active_input = InputFile(random.choice(self.input_files))
-            else:
-                # single pass mode
-                self.active_input = InputFile(self.input_files.pop())
+                self._input_period = self.scheduler.rotation_period(
+                    self.active_input.file_name,
+                    rotation_period)
+            self._input_generated = 0
         # create testcase object and landing page names
         test = TestCase(
             self.page_name(),
@@ -89,26 +162,105 @@ class IOManager(object):
         # add environment files to the test case
         for e_file in self._environ_files:
             test.add_meta(e_file.clone())
-        # reset redirect map
-        self.server_map.redirect.clear()
+        # reset redirect map (test cases in a batch share the redirect map)
+        if not batch_index:
+            self.server_map.redirect.clear()
         if self.harness is not None:
             # setup redirects for harness
-            self.server_map.set_redirect("first_test", self.page_name(), required=False)
+            if batch_index:
+                self.server_map.set_redirect(
+                    "batch_test_%d" % (batch_index,), self.page_name(), required=False)
+            else:
+                self.server_map.set_redirect("first_test", self.page_name(), required=False)
             self.server_map.set_redirect("next_test", self.page_name(offset=1))
             # add harness to testcase
             test.add_file(self.harness.clone(), required=False)
         self._generated += 1
+        self._input_generated += 1
+        # move older test cases to disk when the memory limit is exceeded
+        if self.memory_limit:
+            self._spill_tests(batch_index)
         self.tests.append(test)
-        # manage testcase cache size
-        if len(self.tests) > self._report_size:
-            self.tests.popleft().cleanup()
+        # manage testcase cache size (always keep the current batch)
+        while len(self.tests) + len(self._spilled) > max(self._report_size, batch_index + 1):
+            if self._spilled:
+                os.remove(self._spilled.popleft()[0])
+            else:
+                self.tests.popleft().cleanup()
         return test
 
+    def end_batch(self, batch_size):
+        # the harness is only aware of the full batch size so after the last test case
+        # of a short batch it requests 'batch_test_<batch_size>' instead of 'next_test'
+        if self.harness is not None and batch_size:
+            next_test = self.server_map.redirect.pop("next_test")
+            self.server_map.set_redirect("batch_test_%d" % (batch_size,), next_test.target)
+
+    def inputs_exhausted(self):
+        # check if every input file has been used (single pass mode)
+        if self.input_files:
+            return False
+        return self.active_input is None or self._input_generated >= self.repeat
+
     def landing_page(self):
         if self.harness is None:
             return self.page_name()
         return self.harness.file_name
 
+    def load_state(self, state, rotation_period=10):
+        # restore the corpus position recorded by save_state()
+        last_input = state.get("active_input")
+        if last_input is None:
+            return
+        if not rotation_period:
+            # single pass mode (sorted in reverse), skip inputs that have been processed
+            resume = last_input in self.input_files
+            self.input_files = [x for x in self.input_files if x > last_input]
+            # the remaining repeats of the last input have not been run
+            input_generated = state.get("input_generated", self.repeat)
+            if resume and input_generated < self.repeat:
+                if self.active_input is not None:
+                    self.active_input.close()
+                self.active_input = InputFile(last_input)
+                self._input_generated = input_generated
+        elif last_input in self.input_files:
+            # continue the rotation of the previously active input
+            if self.active_input is not None:
+                self.active_input.close()
+            self.active_input = InputFile(last_input)
+            self._generated = state.get("generated", 0)
+            self._input_generated = state.get("input_generated", 0)
+
+    def _next_input(self, single_pass=False):
+        # get the next input file (prefetched if possible) and start loading
+        # the following input file in the background
+        prefetched = None
+        if self._prefetch is not None:
+            self._prefetch.join()
+            prefetched = self._prefetch.input_file
+            self._prefetch = None
+        file_name = None
+        if single_pass:
+            file_name = self.input_files.pop()
+            if self.work_queue is not None:
+                self._claims.discard(file_name)
+                self._claim_next()
+        if prefetched is not None and file_name in (None, prefetched.file_name):
+            next_input = prefetched
+        else:
+            if prefetched is not None:
+                # the corpus has changed
+                prefetched.close()
+            next_input = InputFile(file_name or self.scheduler.choose(self.input_files))
+        if single_pass:
+            upcoming = self.input_files[-1] if self.input_files else None
+        else:
+            upcoming = self.scheduler.choose(self.input_files) if len(self.input_files) > 1 else None
+        if upcoming is not None:
+            self._prefetch = _InputPrefetch(upcoming)
+            self._prefetch.start()
+        return next_input
+
     def page_name(self, offset=0):
         return "test_%04d.html" % (self._generated + offset,)
 
@@ -116,10 +268,76 @@ class IOManager(object):
         for testcase in self.tests:
             testcase.cleanup()
         self.tests.clear()
+        while self._spilled:
+            os.remove(self._spilled.popleft()[0])
+
+    def record_result(self, input_fname, duration=None, failure=False, ignored=False, timeout=False):
+        # pass the outcome of a test case to the scheduler
+        if input_fname is None:
+            return
+        self.scheduler.record(
+            input_fname,
+            duration=duration,
+            failure=failure,
+            ignored=ignored,
+            timeout=timeout)
 
     def redirect_page(self):
         return self.page_name(offset=1)
 
+    def refresh_input(self, wait=False):
+        # rescan the corpus directory in the background and update input_files
+        # with the files that have been added and removed since the last scan
+        if self.corpus is None:
+            return
+        if self._refresh is None:
+            if time.time() - self._refresh_time < self.REFRESH_FREQ:
+                return
+            self._refresh = _CorpusRefresh(self.corpus)
+            self._refresh.start()
+        if wait:
+            self._refresh.join()
+        elif self._refresh.is_alive():
+            return
+        added, removed = self._refresh.result
+        self._refresh = None
+        self._refresh_time = time.time()
+        if removed:
+            removed = set(removed)
+            for file_name in self._claims & removed:
+                self.work_queue.release(file_name)
+            self._claims -= removed
+            self.input_files = [x for x in self.input_files if x not in removed]
+            self._input_hashes = dict((k, v) for k, v in self._input_hashes.items() if v not in removed)
+        duplicates = 0
+        if added:
+            # ignore files that do not match the filters used by scan_input()
+            added = sorted(self.corpus.files(accepted_extensions=self._accepted_extensions, paths=added))
+            count = len(self.input_files)
+            duplicates = self._add_inputs(added)
+            added = self.input_files[count:]
+            if self._sort_input:
+                self.input_files.sort(reverse=True)
+        if added or removed:
+            log.info("Corpus updated: %d added, %d removed, %d duplicates (%d input files)",
+                     len(added), len(removed), duplicates, len(self.input_files))
+
+    def restore_tests(self):
+        # load test cases that were moved to disk by _spill_tests()
+        # this is required before reporting the contents of tests
+        while self._spilled:
+            archive, input_fname, redirect_page = self._spilled.pop()
+            try:
+                test = TestCase.load(archive)
+            except TestCaseLoadFailure as exc:
+                log.warning("Failed to restore test case: %s", exc)
+            else:
+                test.input_fname = input_fname
+                test.redirect_page = redirect_page
+                self.tests.appendleft(test)
+            finally:
+                os.remove(archive)
+
     def _rotation_required(self, rotation_period):
         if not self.input_files:
             # only rotate if we have input files
@@ -129,38 +347,53 @@ class IOManager(object):
             return True
         if not rotation_period:
             # single pass mode
-            return True
+            return self._input_generated >= self.repeat
         if len(self.input_files) < 2:
             # single pass mode
             return False
-        if not self._generated % rotation_period:
-            return True
-        return False
+        # the rotation period can be adapted per input by the scheduler
+        return self._input_generated >= (self._input_period or rotation_period)
+
+    def _spill_tests(self, batch_index):
+        # keep the newest test cases that fit within the memory limit and save
+        # older test cases to compressed archives (the current batch is not spilled)
+        in_memory = 0
+        for count, test in enumerate(reversed(self.tests)):
+            in_memory += test.data_size
+            if in_memory > self.memory_limit and count >= batch_index:
+                break
+        else:
+            return
+        for _ in range(len(self.tests) - count):
+            test = self.tests.popleft()
+            fd, archive = tempfile.mkstemp(prefix="grz_spill_", suffix=".zip", dir=self.working_path)
+            os.close(fd)
+            test.save(archive, compress=True)
+            test.cleanup()
+            self._spilled.append((archive, test.input_fname, test.redirect_page))
 
-    def scan_input(self, scan_path, accepted_extensions=None, sort=False):
+    def save_state(self):
+        return {
+            "active_input": self.active_input.file_name if self.active_input else None,
+            "generated": self._generated,
+            "input_generated": self._input_generated}
+
+    def scan_input(self, scan_path, accepted_extensions=None, sort=False, index_file=None):
         assert scan_path is not None, "scan_path should be a valid path"
         if os.path.isdir(scan_path):
-            # create a set of normalized file extensions to look in
-            if accepted_extensions is not None:
-                normalized_exts = set(ext.lstrip(".").lower() for ext in accepted_extensions)
-            else:
-                normalized_exts = set()
-
-            # ignored_list is a list of ignored files (usually auto generated OS files)
-            ignored_list = ("desktop.ini", "thumbs.db")
-            for d_name, _, filenames in os.walk(scan_path):
-                for f_name in filenames:
-                    # check for unwanted files
-                    if f_name.startswith(".") or f_name.lower() in ignored_list:
-                        continue
-                    if normalized_exts:
-                        ext = os.path.splitext(f_name)[1].lstrip(".").lower()
-                        if ext not in normalized_exts:
-                            continue
-                    input_file = os.path.abspath(os.path.join(d_name, f_name))
-                    # skip empty files
-                    if os.path.getsize(input_file) > 0:
-                        self.input_files.append(input_file)
+            # use the corpus index to avoid rescanning unchanged directories
+            self.corpus = CorpusIndex(scan_path, index_file=index_file)
+            self._input_hashes.clear()
+            self.corpus.load()
+            self.corpus.update()
+            self.corpus.save()
+            # sorted so the same file is kept when duplicates are found
+            duplicates = self._add_inputs(sorted(self.corpus.files(accepted_extensions=accepted_extensions)))
+            if duplicates:
+                log.info("Ignored %d duplicate input file(s)", duplicates)
+            self._accepted_extensions = accepted_extensions
+            self._refresh_time = time.time()
+            self._sort_input = sort
         elif os.path.isfile(scan_path) and os.path.getsize(scan_path) > 0:
             self.input_files.append(os.path.abspath(scan_path))
 
@@ -189,3 +422,40 @@ class IOManager(object):
             else:
                 env[e_var] = os.environ[e_var]
         return env
+
+
+class _CorpusRefresh(threading.Thread):
+    # update a CorpusIndex without blocking the caller
+    def __init__(self, corpus):
+        super(_CorpusRefresh, self).__init__()
+        self.daemon = True
+        self.corpus = corpus
+        self.result = ([], [])
+
+    def run(self):
+        try:
+            self.result = self.corpus.update()
+            self.corpus.save()
+        except (IOError, OSError) as exc:
+            log.warning("Failed to refresh corpus: %s", exc)
+
+
+class _InputPrefetch(threading.Thread):
+    # load an input file without blocking the caller
+    def __init__(self, file_name):
+        super(_InputPrefetch, self).__init__()
+        self.daemon = True
+        self.file_name = file_name
+        self.input_file = None
+
+    def run(self):
+        input_file = None
+        try:
+            input_file = InputFile(self.file_name)
+            input_file.prefetch()
+        except (IOError, OSError) as exc:
+            log.debug("failed to prefetch %r: %s", self.file_name, exc)
+            if input_file is not None:
+                input_file.close()
+            return
+        self.input_file = input_file
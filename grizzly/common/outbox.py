@@ -0,0 +1,218 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import heapq
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+import fasteners
+
+__all__ = ("Outbox", "OutboxLocked")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = logging.getLogger("outbox")
+
+
+class OutboxLocked(Exception):
+    """The outbox is in use by another process"""
+
+
+class Outbox(object):
+    """Outbox is a persistent on-disk queue of submissions. Each entry is a directory
+    containing the files added to the entry and the entry data (entry.json). Entries
+    are staged and then renamed into the outbox so a partial entry is never processed.
+    Worker threads pass entries to handler, entries that fail are retried using
+    exponential backoff. Entries are only removed once handler succeeds so pending
+    entries are resumed when the outbox is opened again, for example after a restart.
+    Entries that fail MAX_ATTEMPTS times are kept (renamed 'failed_*') for inspection.
+    The outbox directory can only be used by one process at a time.
+    """
+    BACKOFF_MAX = 3600  # maximum number of seconds to wait before retrying
+    BACKOFF_MIN = 30  # number of seconds to wait after the first failure
+    ENTRY_DATA = "entry.json"
+    MAX_ATTEMPTS = 10
+
+    def __init__(self, path, handler, workers=2):
+        assert workers > 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._lock = fasteners.InterProcessLock(os.path.join(path, ".lock"))
+        if not self._lock.acquire(blocking=False):
+            raise OutboxLocked("Outbox %r is in use" % (path,))
+        self._closing = False
+        self._cond = threading.Condition()
+        self._exc_info = None  # unexpected exception raised in a worker thread
+        self._active = 0  # number of entries being processed
+        self._queue = list()  # heap of (time, entry name)
+        self._workers = list()
+        self.handler = handler  # called with (entry path, entry data)
+        self.path = path
+        self._load()
+        for _ in range(workers):
+            worker = threading.Thread(target=self._run)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def add(self, data, files=None):
+        """Add an entry to the outbox.
+
+        Args:
+            data (dict): Entry data, must be JSON serializable.
+            files (iterable): Files to move into the entry.
+
+        Returns:
+            str: Name of the entry.
+        """
+        staging = tempfile.mkdtemp(prefix="tmp_", dir=self.path)
+        try:
+            for src in files or ():
+                shutil.move(src, os.path.join(staging, os.path.basename(src)))
+            self._write_data(staging, {"attempts": 0, "data": data, "next_attempt": 0})
+            # entry names sort in the order entries were added
+            name = "entry_%017.6f_%s" % (time.time(), uuid.uuid4().hex[:8])
+            os.rename(staging, os.path.join(self.path, name))
+            staging = None
+        finally:
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+        with self._cond:
+            heapq.heappush(self._queue, (0, name))
+            self._cond.notify()
+        return name
+
+    def close(self, timeout=None):
+        """Wait for pending entries to be processed and stop the workers. Entries
+        that are not processed remain in the outbox.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for pending entries.
+                             None waits until all entries have been processed.
+
+        Returns:
+            int: Number of entries remaining in the outbox.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._queue or self._active:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                if not self._active and deadline is not None and self._queue[0][0] > deadline:
+                    # remaining entries are not retried before the deadline
+                    break
+                self._cond.wait(remaining)
+            self._closing = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self._workers = list()
+        self._lock.release()
+        if self._queue:
+            LOG.warning("%d submission(s) remain in %r", len(self._queue), self.path)
+        if self._exc_info is not None:
+            exc_type, exc_obj, exc_tb = self._exc_info
+            LOG.error(
+                "Outbox worker exception:\n%s",
+                "".join(traceback.format_exception(exc_type, exc_obj, exc_tb)))
+        return len(self._queue)
+
+    def _load(self):
+        # resume pending entries and remove incomplete (staged) entries
+        for name in sorted(os.listdir(self.path)):
+            entry = os.path.join(self.path, name)
+            if name.startswith("tmp_"):
+                shutil.rmtree(entry, ignore_errors=True)
+            elif name.startswith("entry_"):
+                try:
+                    next_attempt = self._read_data(entry)["next_attempt"]
+                except (IOError, OSError, ValueError):
+                    LOG.warning("Outbox entry %r is invalid", name)
+                    continue
+                heapq.heappush(self._queue, (next_attempt, name))
+        if self._queue:
+            LOG.info("Resuming %d submission(s) from %r", len(self._queue), self.path)
+
+    @property
+    def pending(self):
+        """Number of entries waiting to be processed.
+
+        Args:
+            None
+
+        Returns:
+            int: Number of pending entries.
+        """
+        with self._cond:
+            return len(self._queue) + self._active
+
+    def _process(self, name):
+        entry = os.path.join(self.path, name)
+        info = self._read_data(entry)
+        try:
+            self.handler(entry, info["data"])
+        except Exception as exc:  # pylint: disable=broad-except
+            info["attempts"] += 1
+            if info["attempts"] >= self.MAX_ATTEMPTS:
+                LOG.error("Submission failed %d times (%s), giving up", info["attempts"], exc)
+                os.rename(entry, os.path.join(self.path, "failed_%s" % (name[6:],)))
+                return None
+            delay = min(self.BACKOFF_MIN * 2 ** (info["attempts"] - 1), self.BACKOFF_MAX)
+            LOG.warning("Submission failed (%s), retrying in %ds", exc, delay)
+            info["next_attempt"] = time.time() + delay
+            self._write_data(entry, info)
+            return info["next_attempt"]
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+
+    @classmethod
+    def _read_data(cls, entry):
+        with open(os.path.join(entry, cls.ENTRY_DATA), "r") as in_fp:
+            return json.load(in_fp)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closing:
+                    if self._queue:
+                        delay = self._queue[0][0] - time.time()
+                        if delay <= 0:
+                            break
+                    else:
+                        delay = None
+                    self._cond.wait(delay)
+                if self._closing:
+                    break
+                _, name = heapq.heappop(self._queue)
+                self._active += 1
+            retry = None
+            try:
+                retry = self._process(name)
+            except Exception:  # pylint: disable=broad-except
+                # the entry is left in the outbox
+                if self._exc_info is None:
+                    self._exc_info = sys.exc_info()
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    if retry is not None:
+                        heapq.heappush(self._queue, (retry, name))
+                    self._cond.notify_all()
+
+    @classmethod
+    def _write_data(cls, entry, info):
+        # write to a temporary file and rename to avoid leaving a partial file
+        tmp_file = os.path.join(entry, "%s.tmp" % (cls.ENTRY_DATA,))
+        with open(tmp_file, "w") as out_fp:
+            json.dump(info, out_fp)
+        os.rename(tmp_file, os.path.join(entry, cls.ENTRY_DATA))
@@ -7,11 +7,18 @@ import abc
 import json
 import logging
 import os
+try:  # py 2-3 compatibility
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 import re
 import shutil
+import sys
 import tarfile
 import tempfile
+import threading
 import time
+import traceback
 import zipfile
 
 import fasteners
@@ -38,9 +45,12 @@ try:
 except ImportError as err:
     _boto_import_error = err  # pylint: disable=invalid-name
 
+from .compress import ParallelCompressor
+from .outbox import Outbox
 from .stack_hasher import Stack
+from .storage import archive_compression
 
-__all__ = ("FilesystemReporter", "FuzzManagerReporter", "S3FuzzManagerReporter")
+__all__ = ("FilesystemReporter", "FuzzManagerReporter", "ReportQueue", "S3FuzzManagerReporter")
 __author__ = "Tyson Smith"
 __credits__ = ["Tyson Smith"]
 
@@ -228,11 +238,15 @@ class Reporter(object):
     def _reset(self):
         pass
 
+    def _skip(self, report):  # pylint: disable=no-self-use,unused-argument
+        # check if the report can be skipped before any processing is done
+        return False
+
     @abc.abstractmethod
     def _submit(self, report, test_cases):
         pass
 
-    def submit(self, log_path, test_cases):
+    def submit(self, log_path, test_cases, callback=None):
         """
         Submit report containing results.
 
@@ -244,34 +258,167 @@ class Reporter(object):
                            the newest being the mostly likely to trigger
                            the result (crash, assert... etc)
 
+        @type callback: callable
+        @param callback: Called with the major stack hash of the report once
+                         it has been submitted.
+
         @rtype: None
         @return: None
         """
         if not os.path.isdir(log_path):
             raise IOError("No such directory %r" % log_path)
         report = Report.from_path(log_path)
-        self._pre_submit(report)
-        self._submit(report, test_cases)
+        if not self._skip(report):
+            self._pre_submit(report)
+            self._submit(report, test_cases)
+        major = report.major
         if report is not None:
             report.cleanup()
         self._reset()
+        if callback is not None:
+            callback(major)
+
+
+class ReportQueue(object):
+    """ReportQueue submits reports using a background worker thread. Logs are moved
+    to a staging directory and test cases are cloned when a report is queued so
+    the caller is free to modify or discard the originals. When the queue is full
+    submit() blocks until space is available. Exceptions raised by the worker are
+    re-raised by the next call to submit() and logged by close().
+    """
+    def __init__(self, reporter, max_size=10, working_path=None):
+        assert max_size > 0
+        self._exc_info = None  # exception raised in the worker thread
+        self._queue = Queue(maxsize=max_size)
+        self._worker = threading.Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+        self.reporter = reporter
+        self.working_path = working_path
+
+    def _check_worker(self):
+        if self._exc_info is not None:
+            exc_type, exc_obj, exc_tb = self._exc_info
+            self._exc_info = None
+            log.error(
+                "Report worker exception:\n%s",
+                "".join(traceback.format_exception(exc_type, exc_obj, exc_tb)))
+            raise exc_obj  # re-raise exception from worker
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    break
+                staging, test_cases, callback = job
+                try:
+                    self.reporter.submit(os.path.join(staging, "logs"), test_cases, callback=callback)
+                except Exception:  # pylint: disable=broad-except
+                    if self._exc_info is None:
+                        self._exc_info = sys.exc_info()
+                finally:
+                    for test_case in test_cases:
+                        test_case.cleanup()
+                    shutil.rmtree(staging, ignore_errors=True)
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        """Wait for all queued reports to be submitted and stop the worker.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._worker.is_alive():
+            pending = self._queue.qsize()
+            if pending:
+                log.info("Waiting for %d pending report(s)...", pending)
+            self._queue.put(None)
+            self._worker.join()
+        if self._exc_info is not None:
+            # do not raise, close() is called during shutdown
+            exc_type, exc_obj, exc_tb = self._exc_info
+            self._exc_info = None
+            log.error(
+                "Report worker exception:\n%s",
+                "".join(traceback.format_exception(exc_type, exc_obj, exc_tb)))
+
+    @property
+    def pending(self):
+        """Number of reports waiting to be submitted.
+
+        Args:
+            None
+
+        Returns:
+            int: Number of queued reports.
+        """
+        return self._queue.qsize()
+
+    def submit(self, log_path, test_cases, callback=None):
+        """Queue a report for submission. See Reporter.submit().
+
+        Args:
+            log_path (str): Path to logs from the Target. Ownership is taken.
+            test_cases (iterable): TestCases, ordered newest to oldest. Copies are made.
+            callback (callable): Called by the worker thread with the major stack
+                                 hash of the report once it has been submitted.
+
+        Returns:
+            None
+        """
+        self._check_worker()
+        if not os.path.isdir(log_path):
+            raise IOError("No such directory %r" % log_path)
+        assert self._worker.is_alive(), "ReportQueue is closed"
+        staging = tempfile.mkdtemp(prefix="grz_report_", dir=self.working_path)
+        shutil.move(log_path, os.path.join(staging, "logs"))
+        test_cases = [test_case.clone() for test_case in test_cases]
+        if self._queue.full():
+            log.info("Report queue is full, waiting...")
+        self._queue.put((staging, test_cases, callback))
 
 
 class FilesystemReporter(Reporter):
     DISK_SPACE_ABORT = 512 * 1024 * 1024  # 512 MB
+    RR_CODEC = "bz2"  # compression used for rr trace archives (see CODECS)
 
     def __init__(self, report_path=None):
         self.report_path = os.path.join(os.getcwd(), "results") if report_path is None else report_path
 
-    @staticmethod
-    def compress_rr_trace(src, dest):
+    @classmethod
+    def compress_rr_trace(cls, src, dest, codec=None, workers=None):
+        """Create a tar archive containing the latest rr trace and remove the traces.
+
+        Args:
+            src (str): Path containing rr traces (including 'latest-trace').
+            dest (str): Directory to create the archive in.
+            codec (str): Compression codec (see CODECS), None uses RR_CODEC.
+            workers (int): Number of compression threads, None uses all available cores.
+
+        Returns:
+            str: Path to archive.
+        """
+        codec = cls.RR_CODEC if codec is None else codec
         # resolve symlink to latest trace available
         latest_trace = os.path.realpath(os.path.join(src, "latest-trace"))
         assert os.path.isdir(latest_trace), "missing latest-trace directory"
-        rr_arc = os.path.join(dest, "rr.tar.bz2")
+        rr_arc = os.path.join(dest, "rr.tar.%s" % (codec,))
         log.debug("creating %r from %r", rr_arc, latest_trace)
-        with tarfile.open(rr_arc, "w:bz2") as arc_fp:
-            arc_fp.add(latest_trace, arcname=os.path.basename(latest_trace))
+        try:
+            with open(rr_arc, "wb") as out_fp:
+                with ParallelCompressor(out_fp, codec=codec, workers=workers) as comp_fp:
+                    with tarfile.open(fileobj=comp_fp, mode="w|") as arc_fp:
+                        arc_fp.add(latest_trace, arcname=os.path.basename(latest_trace))
+        except Exception:
+            # do not leave a partial archive
+            if os.path.isfile(rr_arc):
+                os.remove(rr_arc)
+            raise
         # remove path containing uncompressed traces
         shutil.rmtree(src)
         return rr_arc
@@ -295,7 +442,8 @@ class FilesystemReporter(Reporter):
             dump_path = os.path.join(major_dir, "%s-%d" % (report.prefix, test_number))
             if not os.path.isdir(dump_path):
                 os.mkdir(dump_path)
-            test_case.dump(dump_path, include_details=True)
+            # results are kept, avoid read-only hardlinks
+            test_case.dump(dump_path, include_details=True, hardlink=False)
 
         # move logs into bucket directory
         target_dir = os.path.join(major_dir, "%s_%s" % (report.prefix, "logs"))
@@ -312,6 +460,11 @@ class FilesystemReporter(Reporter):
 class FuzzManagerReporter(Reporter):
     # this is where Collector looks for the '.fuzzmanagerconf' (see Collector.py)
     FM_CONFIG = os.path.join(os.path.expanduser("~"), ".fuzzmanagerconf")
+    # stack hashes of results that matched frequent signatures (shared by all instances)
+    # markers are invalidated when the signature file they were created from changes
+    FREQUENT_STACKS = os.path.join(tempfile.gettempdir(), "grz_frequent_stacks")
+    # max size of files (other than logs) added to the archive submitted to FuzzManager
+    MAX_FILE_SIZE = 0x3200000  # 50MB
     # max number of times to report a non-frequent signature to FuzzManager
     MAX_REPORTS = 10
 
@@ -326,12 +479,14 @@ class FuzzManagerReporter(Reporter):
     QUAL_REDUCER_ERROR = 9  # reducer error
     QUAL_NOT_REPRODUCIBLE = 10  # could not reproduce the testcase
 
-    def __init__(self, target_binary, tool=None):
+    def __init__(self, target_binary, tool=None, outbox=None, working_path=None):
         self._extra_metadata = {}
         self.force_report = False
+        self.outbox = outbox  # submit in the background (see create_outbox())
         self.quality = self.QUAL_UNREDUCED
         self.target_binary = target_binary
         self.tool = tool  # optional tool name
+        self.working_path = working_path  # location of temporary files (archives)
 
     @staticmethod
     def create_crash_info(report, target_binary):
@@ -349,9 +504,97 @@ class FuzzManagerReporter(Reporter):
                 ProgramConfiguration.fromBinary(target_binary),
                 auxCrashData=aux_data)
 
+    def _create_archive(self, zip_name, report, test_cases):
+        # write the logs and test cases to a zip archive
+        # files that are already compressed are stored, oversized logs are tailed
+        # while they are added and other oversized files are skipped
+        with zipfile.ZipFile(zip_name, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_fp:
+            for dir_name, _, dir_files in os.walk(report.path):
+                arc_path = os.path.relpath(dir_name, report.path)
+                for file_name in dir_files:
+                    src = os.path.join(dir_name, file_name)
+                    arc_name = os.path.normpath(os.path.join(arc_path, file_name))
+                    size = os.stat(src).st_size
+                    if size > Report.MAX_LOG_SIZE and file_name.endswith((".log", ".txt")):
+                        with open(src, "rb") as in_fp:
+                            in_fp.seek(size - Report.MAX_LOG_SIZE)
+                            zip_fp.writestr(arc_name, b"[LOG TAILED]\n" + in_fp.read())
+                    elif size > self.MAX_FILE_SIZE:
+                        log.warning("Skipped %r (%d bytes), file is too large", arc_name, size)
+                    else:
+                        zip_fp.write(src, arcname=arc_name, compress_type=archive_compression(file_name))
+            # add test cases (written directly, not dumped to the filesystem first)
+            for test_number, test_case in enumerate(test_cases):
+                test_case.write_archive(zip_fp, prefix="%s-%d" % (report.prefix, test_number))
+
+    @classmethod
+    def create_outbox(cls, path, workers=2):
+        """Create an Outbox used to submit results to FuzzManager in the background.
+        Pending submissions left by a previous run using path are resumed.
+
+        Args:
+            path (str): Outbox directory.
+            workers (int): Maximum number of concurrent submissions.
+
+        Returns:
+            Outbox: Outbox to pass to FuzzManagerReporter.
+        """
+        return Outbox(path, cls.submit_entry, workers=workers)
+
     def _reset(self):
         self._extra_metadata = {}
 
+    @classmethod
+    def _frequent_stack(cls, report):
+        # check if the stack of the report is known to belong to a frequent signature
+        # markers are only valid while the signature file they were created from is
+        # unchanged, refreshing the signature cache replaces the signature files
+        if report.stack is None:
+            return False
+        stack_file = os.path.join(cls.FREQUENT_STACKS, "%s_%s.json" % (report.major, report.minor))
+        try:
+            with open(stack_file, "r") as in_fp:
+                marker = json.load(in_fp)
+            valid = os.stat(marker["signature"]).st_mtime == marker["mtime"]
+        except (IOError, OSError, KeyError, TypeError, ValueError):
+            valid = False
+        if not valid:
+            try:
+                os.remove(stack_file)
+            except OSError:
+                pass
+            return False
+        marker["count"] += 1
+        cls._write_marker(stack_file, marker)
+        log.info("Frequent crash matched known stack %s (%d)", report.minor[:8], marker["count"])
+        return True
+
+    @classmethod
+    def _mark_frequent(cls, report, sig_file):
+        # record the stack of a report that matched a frequent signature so future
+        # matches can be skipped without creating CrashInfo or searching the cache
+        if report.stack is None or sig_file is None:
+            return
+        if not os.path.isdir(cls.FREQUENT_STACKS):
+            try:
+                os.makedirs(cls.FREQUENT_STACKS)
+            except OSError:
+                # created by another instance
+                if not os.path.isdir(cls.FREQUENT_STACKS):
+                    raise
+        cls._write_marker(
+            os.path.join(cls.FREQUENT_STACKS, "%s_%s.json" % (report.major, report.minor)),
+            {"count": 0, "mtime": os.stat(sig_file).st_mtime, "signature": os.path.abspath(sig_file)})
+
+    @staticmethod
+    def _write_marker(stack_file, marker):
+        # write to a temporary file and rename, markers are shared by all instances
+        # NOTE: concurrent updates may lose a count, it is only used for logging
+        tmp_file = "%s.%d.tmp" % (stack_file, os.getpid())
+        with open(tmp_file, "w") as out_fp:
+            json.dump(marker, out_fp)
+        os.rename(tmp_file, stack_file)
+
     @classmethod
     def sanity_check(cls, bin_file):
         if _fm_import_error is not None:
@@ -369,6 +612,30 @@ class FuzzManagerReporter(Reporter):
                 return name
         return "unknown quality (%r)" % (value,)
 
+    @staticmethod
+    def submit_entry(entry_path, data):
+        # submit a result staged in an Outbox entry by _submit()
+        if "configuration" in data:
+            # use the configuration of the build that produced the result
+            configuration = ProgramConfiguration(**data["configuration"])
+        else:
+            # staged by an older version
+            configuration = ProgramConfiguration.fromBinary(data["binary"])
+        crash_info = CrashInfo.fromRawCrashData(
+            data["stdout"],
+            data["stderr"],
+            configuration,
+            auxCrashData=data["aux"] or None)
+        crash_info.configuration.addMetadata(data["metadata"])
+        collector = Collector()
+        if data["tool"] is not None:
+            collector.tool = data["tool"]
+        new_entry = collector.submit(
+            crash_info,
+            testCase=os.path.join(entry_path, data["test_case"]),
+            testCaseQuality=data["quality"])
+        log.info("Logged %d with quality %d", new_entry["id"], data["quality"])
+
     @staticmethod
     def signature_max_frames(crash_info, suggested_frames=8):
         if set(crash_info.backtrace) & {
@@ -410,6 +677,11 @@ class FuzzManagerReporter(Reporter):
             return True
         return False
 
+    def _skip(self, report):
+        # skip known frequent crashes before doing any expensive processing
+        # (including processing rr traces in _pre_submit())
+        return not self.force_report and self._frequent_stack(report)
+
     def _submit(self, report, test_cases):
         # prepare data for submission as CrashInfo
         crash_info = self.create_crash_info(report, self.target_binary)
@@ -423,6 +695,7 @@ class FuzzManagerReporter(Reporter):
                 if cache_metadata["frequent"]:
                     log.info("Frequent crash matched existing signature: %s",
                              cache_metadata["shortDescription"])
+                    self._mark_frequent(report, cache_sig_file)
                     if not self.force_report:
                         return
                 elif "bug__id" in cache_metadata:
@@ -456,15 +729,12 @@ class FuzzManagerReporter(Reporter):
             metadata_file = cache_sig_file.replace(".signature", ".metadata")
             with open(metadata_file, "w") as meta_fp:
                 json.dump(cache_metadata, meta_fp)
+            if cache_metadata["frequent"]:
+                self._mark_frequent(report, cache_sig_file)
 
-        # dump test cases and the contained files to working directory
         test_case_meta = []
-        for test_number, test_case in enumerate(test_cases):
+        for test_case in test_cases:
             test_case_meta.append([test_case.adapter_name, test_case.input_fname])
-            dump_path = os.path.join(report.path, "%s-%d" % (report.prefix, test_number))
-            if not os.path.isdir(dump_path):
-                os.mkdir(dump_path)
-            test_case.dump(dump_path, include_details=True)
         crash_info.configuration.addMetadata({"grizzly_input": repr(test_case_meta)})
         if test_cases:
             crash_info.configuration.addMetadata(
@@ -482,30 +752,45 @@ class FuzzManagerReporter(Reporter):
                 Report.tail(target_log, 10240)  # limit to last 10K
 
         # add results to a zip file
-        zip_name = "%s.zip" % (report.prefix,)
-        with zipfile.ZipFile(zip_name, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_fp:
-            # add test files
-            for dir_name, _, dir_files in os.walk(report.path):
-                arc_path = os.path.relpath(dir_name, report.path)
-                for file_name in dir_files:
-                    zip_fp.write(
-                        os.path.join(dir_name, file_name),
-                        arcname=os.path.join(arc_path, file_name))
-
-        # override tool name if specified
-        if self.tool is not None:
-            collector.tool = self.tool
-
-        # announce shortDescription if crash is not in a bucket
-        if cache_metadata["_grizzly_seen_count"] == 1 and not cache_metadata["frequent"]:
-            log.info("Submitting new crash %r", cache_metadata["shortDescription"])
-        # submit results to the FuzzManager server
-        new_entry = collector.submit(crash_info, testCase=zip_name, testCaseQuality=self.quality)
-        log.info("Logged %d with quality %d", new_entry["id"], self.quality)
-
-        # remove zipfile
-        if os.path.isfile(zip_name):
-            os.remove(zip_name)
+        zip_path = tempfile.mkdtemp(prefix="grz_fm_", dir=self.working_path)
+        zip_name = os.path.join(zip_path, "%s.zip" % (report.prefix,))
+        try:
+            self._create_archive(zip_name, report, test_cases)
+
+            # announce shortDescription if crash is not in a bucket
+            if cache_metadata["_grizzly_seen_count"] == 1 and not cache_metadata["frequent"]:
+                log.info("Submitting new crash %r", cache_metadata["shortDescription"])
+
+            if self.outbox is not None:
+                # stage the submission, it is submitted by the outbox in the background
+                # the build may be updated before then so the configuration is included
+                config = crash_info.configuration
+                self.outbox.add({
+                    "aux": crash_info.rawCrashData,
+                    "binary": self.target_binary,
+                    "configuration": {
+                        "args": config.args,
+                        "env": config.env,
+                        "os": config.os,
+                        "platform": config.platform,
+                        "product": config.product,
+                        "version": config.version},
+                    "metadata": config.metadata,
+                    "quality": self.quality,
+                    "stderr": crash_info.rawStderr,
+                    "stdout": crash_info.rawStdout,
+                    "test_case": os.path.basename(zip_name),
+                    "tool": self.tool}, files=(zip_name,))
+                return
+
+            # override tool name if specified
+            if self.tool is not None:
+                collector.tool = self.tool
+            # submit results to the FuzzManager server
+            new_entry = collector.submit(crash_info, testCase=zip_name, testCaseQuality=self.quality)
+            log.info("Logged %d with quality %d", new_entry["id"], self.quality)
+        finally:
+            shutil.rmtree(zip_path, ignore_errors=True)
 
 
 class S3FuzzManagerReporter(FuzzManagerReporter):
@@ -520,7 +805,7 @@ class S3FuzzManagerReporter(FuzzManagerReporter):
         assert s3_bucket is not None
         # check for existing minor hash in S3
         s3 = boto3.resource("s3")
-        s3_key = "rr-%s.tar.bz2" % (report.minor,)
+        s3_key = "rr-%s.tar.%s" % (report.minor, FilesystemReporter.RR_CODEC)
         s3_url = "http://%s.s3.amazonaws.com/%s" % (s3_bucket, s3_key)
         try:
             s3.Object(s3_bucket, s3_key).load()  # HEAD, doesn't fetch the whole object
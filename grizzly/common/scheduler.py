@@ -0,0 +1,219 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import abc
+import json
+import logging
+import os
+import random
+import time
+
+import six
+
+__all__ = ("InputScheduler", "InputStats", "RandomScheduler", "WeightedScheduler")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = logging.getLogger("scheduler")
+
+
+@six.add_metaclass(abc.ABCMeta)
+class InputScheduler(object):
+    """InputScheduler selects the input file used by IOManager when the active input
+    is rotated and is notified of the outcome of each test case.
+    """
+    @abc.abstractmethod
+    def choose(self, input_files):
+        """Select the next input file.
+
+        Args:
+            input_files (list): Paths to available input files.
+
+        Returns:
+            str: Path to selected input file.
+        """
+
+    def close(self):
+        """Automatically called once at shutdown.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+    def record(self, file_name, duration=None, failure=False, ignored=False, timeout=False):
+        """Record the outcome of a test case generated from an input file.
+
+        Args:
+            file_name (str): Path to input file.
+            duration (float): Time spent running the test case.
+            failure (bool): A result was detected.
+            ignored (bool): An ignored result was detected.
+            timeout (bool): The test case timed out.
+
+        Returns:
+            None
+        """
+
+    def rotation_period(self, file_name, default):  # pylint: disable=no-self-use,unused-argument
+        """Number of test cases to generate from an input file before rotating.
+
+        Args:
+            file_name (str): Path to input file.
+            default (int): Rotation period requested by the adapter.
+
+        Returns:
+            int: Rotation period.
+        """
+        return default
+
+
+class RandomScheduler(InputScheduler):
+    """Select input files uniformly at random (default)."""
+    def choose(self, input_files):
+        return random.choice(input_files)
+
+
+class InputStats(object):
+    """Statistics collected for an input file."""
+    __slots__ = ("duration", "ignored", "iterations", "results", "timeouts")
+
+    def __init__(self, iterations=0, results=0, ignored=0, timeouts=0, duration=0.0):
+        self.duration = duration  # total (not mean)
+        self.ignored = ignored
+        self.iterations = iterations
+        self.results = results
+        self.timeouts = timeouts
+
+    @property
+    def mean_duration(self):
+        return self.duration / self.iterations if self.iterations else 0.0
+
+    def to_list(self):
+        return [self.iterations, self.results, self.ignored, self.timeouts, self.duration]
+
+
+class WeightedScheduler(InputScheduler):
+    """Select input files using weights (energy) calculated from previous results.
+    Inputs that have produced results are selected more often, inputs that have been
+    used without producing results and inputs that time out are selected less often.
+    Untested inputs are preferred to encourage exploration. Statistics are saved to
+    stats_file so they carry over between runs.
+    """
+    MAX_ROTATION = 4  # maximum rotation period multiplier (adaptive rotation)
+    NEW_ENERGY = 2.0  # energy of untested inputs
+    RESULT_ENERGY = 10.0  # energy added per result
+    SAMPLE_SIZE = 1000  # max number of inputs considered per selection
+    SATURATION = 100  # iterations without results that halve the energy of an input
+    SAVE_FREQ = 300  # minimum number of seconds between saves
+
+    def __init__(self, stats_file=None, adaptive_rotation=False):
+        self.adaptive_rotation = adaptive_rotation
+        self.stats = dict()
+        self.stats_file = stats_file
+        self._last_save = time.time()
+        self._rand = random.Random()
+        if stats_file is not None:
+            self.load()
+
+    def choose(self, input_files):
+        if len(input_files) > self.SAMPLE_SIZE:
+            # avoid calculating the energy of every input in large corpora
+            input_files = self._rand.sample(input_files, self.SAMPLE_SIZE)
+        weights = [self.energy(x) for x in input_files]
+        pick = self._rand.random() * sum(weights)
+        for file_name, weight in zip(input_files, weights):
+            pick -= weight
+            if pick < 0:
+                return file_name
+        return input_files[-1]
+
+    def close(self):
+        self.save()
+
+    def energy(self, file_name):
+        """Calculate the weight used when selecting an input file.
+
+        Args:
+            file_name (str): Path to input file.
+
+        Returns:
+            float: Energy of the input file.
+        """
+        stats = self.stats.get(file_name)
+        if stats is None or not stats.iterations:
+            return self.NEW_ENERGY
+        energy = (1.0 + stats.results * self.RESULT_ENERGY)
+        energy /= 1.0 + stats.iterations / float(self.SATURATION)
+        # inputs that time out slow down fuzzing
+        return energy * (1.0 - 0.5 * stats.timeouts / stats.iterations)
+
+    def load(self):
+        """Load statistics from stats_file.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if statistics were loaded otherwise False.
+        """
+        if self.stats_file is None or not os.path.isfile(self.stats_file):
+            return False
+        try:
+            with open(self.stats_file, "r") as in_fp:
+                data = json.load(in_fp)
+        except ValueError:
+            LOG.warning("Input statistics %r are invalid", self.stats_file)
+            return False
+        self.stats = dict((name, InputStats(*values)) for name, values in data.items())
+        LOG.debug("loaded statistics for %d inputs", len(self.stats))
+        return True
+
+    def record(self, file_name, duration=None, failure=False, ignored=False, timeout=False):
+        stats = self.stats.get(file_name)
+        if stats is None:
+            stats = self.stats[file_name] = InputStats()
+        stats.iterations += 1
+        if duration is not None:
+            stats.duration += duration
+        if failure:
+            stats.results += 1
+        if ignored:
+            stats.ignored += 1
+        if timeout:
+            stats.timeouts += 1
+        if time.time() - self._last_save >= self.SAVE_FREQ:
+            self.save()
+
+    def rotation_period(self, file_name, default):
+        if not self.adaptive_rotation or default < 1:
+            return default
+        # spend more time on inputs that produce results and less on inputs that time out
+        stats = self.stats.get(file_name)
+        if stats is None or not stats.iterations:
+            return default
+        scale = min(1.0 + stats.results, self.MAX_ROTATION)
+        scale *= 1.0 - 0.5 * stats.timeouts / stats.iterations
+        return max(int(default * scale), 1)
+
+    def save(self):
+        """Write statistics to stats_file.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if statistics were written otherwise False.
+        """
+        self._last_save = time.time()
+        if self.stats_file is None:
+            return False
+        # write to a temporary file and rename to avoid leaving a partial file
+        tmp_file = "%s.%d.tmp" % (self.stats_file, os.getpid())
+        with open(tmp_file, "w") as out_fp:
+            json.dump(dict((name, stats.to_list()) for name, stats in self.stats.items()), out_fp)
+        os.rename(tmp_file, self.stats_file)
+        return True
@@ -0,0 +1,114 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import errno
+import hashlib
+import logging
+import os
+
+__all__ = ("CorpusShard", "WorkQueue")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = logging.getLogger("sharding")
+
+
+class CorpusShard(object):
+    """CorpusShard deterministically divides a corpus between instances. Input files
+    are assigned to a shard using the content hash so every instance sharing a
+    corpus makes the same decision without communicating, files with identical
+    content always land in the same shard.
+    """
+    __slots__ = ("count", "index")
+
+    def __init__(self, index, count):
+        assert count > 0
+        assert 0 < index <= count
+        self.count = count
+        self.index = index  # 1-based
+
+    def __contains__(self, digest):
+        return int(digest[:8], 16) % self.count == self.index - 1
+
+    def __str__(self):
+        return "%d/%d" % (self.index, self.count)
+
+    @classmethod
+    def parse(cls, value):
+        """Create a CorpusShard from a string in the form 'INDEX/COUNT'.
+
+        Args:
+            value (str): Shard description, for example '2/4'.
+
+        Returns:
+            CorpusShard: Shard described by value.
+        """
+        try:
+            index, count = (int(x) for x in value.split("/"))
+        except ValueError:
+            raise ValueError("Invalid shard %r, expected 'INDEX/COUNT'" % (value,))
+        if count < 1 or not 0 < index <= count:
+            raise ValueError("Invalid shard %r, INDEX must be between 1 and COUNT" % (value,))
+        return cls(index, count)
+
+
+class WorkQueue(object):
+    """WorkQueue allows instances processing the same corpus to divide the work
+    dynamically. Before an input file is used it is claimed by atomically creating
+    a lock file in a shared directory, files claimed by another instance are skipped.
+    Claims are not removed once an input file has been processed, use a new directory
+    for each pass over a corpus.
+    """
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError as exc:
+                # created by another instance
+                if exc.errno != errno.EEXIST:
+                    raise
+        self.path = path
+
+    def _lock_file(self, file_name):
+        return os.path.join(
+            self.path,
+            "%s.lock" % (hashlib.sha1(os.path.abspath(file_name).encode("utf-8")).hexdigest(),))
+
+    def claim(self, file_name):
+        """Claim an input file.
+
+        Args:
+            file_name (str): Path to input file.
+
+        Returns:
+            bool: True if the input file was claimed otherwise False (claimed by
+                  another instance).
+        """
+        try:
+            fd = os.open(self._lock_file(file_name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+            LOG.debug("%r claimed by another instance", file_name)
+            return False
+        try:
+            os.write(fd, ("%d\n" % (os.getpid(),)).encode("ascii"))
+        finally:
+            os.close(fd)
+        return True
+
+    def release(self, file_name):
+        """Remove the claim on an input file that will not be processed so another
+        instance can process it.
+
+        Args:
+            file_name (str): Path to input file.
+
+        Returns:
+            None
+        """
+        try:
+            os.remove(self._lock_file(file_name))
+        except OSError:  # pragma: no cover
+            pass
@@ -3,23 +3,89 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import codecs
 from collections import namedtuple
+from contextlib import contextmanager
 import json
+import mmap
 import os
 import shutil
 import tempfile
+import zipfile
 
-__all__ = ("InputFile", "TestCase", "TestFile", "TestFileExists")
+import six
+
+__all__ = ("InputFile", "TestCase", "TestCaseLoadFailure", "TestFile", "TestFileExists", "TestFileWriter")
 __author__ = "Tyson Smith"
 __credits__ = ["Tyson Smith"]
 
+# extensions of files that contain compressed data (compressing again wastes CPU)
+COMPRESSED_EXTENSIONS = frozenset((
+    ".7z", ".br", ".bz2", ".gif", ".gz", ".jpeg", ".jpg", ".mkv", ".mp3", ".mp4", ".ogg", ".ogv",
+    ".png", ".webm", ".webp", ".woff", ".woff2", ".xz", ".zip", ".zst"))
+
+
+def archive_compression(file_name, compression=zipfile.ZIP_DEFLATED):
+    """Select the compression method used to add a file to a zip archive.
+
+    Args:
+        file_name (str): Name of the file.
+        compression (int): Compression method used for files that are not compressed.
+
+    Returns:
+        int: zipfile.ZIP_STORED for compressed data otherwise compression.
+    """
+    if os.path.splitext(file_name)[1].lower() in COMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return compression
+
+
+class TestCaseLoadFailure(Exception):
+    """Raised when a TestCase cannot be loaded"""
+
 
 class TestFileExists(RuntimeError):
     """Raised when adding a TestFile to a TestCase that has an existing TestFile with the same name"""
 
 
+class _MapReader(object):
+    """Read only file-like view of a memory mapped file. The map is owned by the
+    InputFile so close() does not unmap the file.
+    """
+    __slots__ = ("_map",)
+
+    def __init__(self, data_map):
+        self._map = data_map
+
+    def __iter__(self):
+        return iter(self._map.readline, b"")
+
+    def close(self):
+        pass
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._map) - self._map.tell()
+        return self._map.read(size)
+
+    def readline(self, size=-1):
+        line = self._map.readline()
+        if size is not None and 0 <= size < len(line):
+            # return the remainder of the line on the next call
+            self._map.seek(size - len(line), os.SEEK_CUR)
+            line = line[:size]
+        return line
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+
 class InputFile(object):
-    CACHE_LIMIT = 0x100000  # 1MB
+    CACHE_LIMIT = 0x100000  # 1MB (used when the file cannot be mapped)
 
     def __init__(self, file_name):
         self.extension = None
@@ -31,19 +97,47 @@ class InputFile(object):
         if "." in self.file_name:
             self.extension = os.path.splitext(self.file_name)[-1].lstrip(".")
 
-    def _cache_data(self):
-        """Cache file data.
+    def _cache_data(self, use_map=True):
+        """Map file data into memory to avoid copying it. If the file cannot be
+        mapped (empty file, unsupported file system) the data is copied.
 
         Args:
-            None
+            use_map (bool): Attempt to map the file.
 
         Returns:
             None
         """
-        self._fp = tempfile.SpooledTemporaryFile(max_size=self.CACHE_LIMIT)
         with open(self.file_name, "rb") as src_fp:
+            if use_map:
+                try:
+                    self._fp = mmap.mmap(src_fp.fileno(), 0, access=mmap.ACCESS_READ)
+                    return
+                except (EnvironmentError, ValueError):
+                    pass
+            self._fp = tempfile.SpooledTemporaryFile(max_size=self.CACHE_LIMIT)
             shutil.copyfileobj(src_fp, self._fp, 0x10000)  # 64KB
 
+    def _load(self):
+        """Load file data if needed. Accessing a mapped file that has been truncated
+        raises SIGBUS so the data is copied instead when that is detected.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if the file is mapped otherwise False.
+        """
+        if self._fp is None:
+            self._cache_data()
+        if not isinstance(self._fp, mmap.mmap):
+            return False
+        if self._fp.size() >= len(self._fp):
+            return True
+        # file was modified while in use
+        self._fp.close()
+        self._cache_data(use_map=False)
+        return False
+
     def close(self):
         """Close file handles.
 
@@ -57,6 +151,21 @@ class InputFile(object):
             self._fp.close()
         self._fp = None
 
+    def prefetch(self):
+        """Load file data so the first call to get_data() or get_fp() does not block
+        on I/O. Mapped files are read once to populate the page cache.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._load():
+            # touch each page
+            for offset in range(0, len(self._fp), mmap.PAGESIZE):
+                self._fp[offset]  # pylint: disable=pointless-statement
+
     def get_data(self):
         """Read file data.
 
@@ -66,11 +175,8 @@ class InputFile(object):
         Returns:
             bytes: Data from input file
         """
-        if self._fp is None:
-            self._cache_data()
-        self._fp.seek(0)
         # TODO: add size limit
-        return self._fp.read()
+        return self.get_fp().read()
 
     def get_fp(self):
         """Get input file File object.
@@ -81,9 +187,11 @@ class InputFile(object):
         Returns:
             file: input file object
         """
-        if self._fp is None:
-            self._cache_data()
+        self._load()
         self._fp.seek(0)
+        if isinstance(self._fp, mmap.mmap):
+            # read the data from the map without copying it, the map is not exposed
+            return _MapReader(self._fp)
         return self._fp
 
 
@@ -97,7 +205,7 @@ class TestCase(object):
         self.landing_page = landing_page
         self.redirect_page = redirect_page
         self._env_vars = dict()  # environment variables
-        self._existing_paths = list()  # file paths in use
+        self._existing_paths = set()  # file paths in use
         self._files = TestFileMap(
             meta=list(),  # environment files such as prefs.js, etc...
             optional=list(),
@@ -116,7 +224,7 @@ class TestCase(object):
         assert isinstance(test_file, TestFile), "only accepts TestFiles"
         if test_file.file_name in self._existing_paths:
             raise TestFileExists("%r exists in test" % (test_file.file_name,))
-        self._existing_paths.append(test_file.file_name)
+        self._existing_paths.add(test_file.file_name)
         target.append(test_file)
 
     def add_meta(self, meta_file):
@@ -194,6 +302,30 @@ class TestCase(object):
             tfile.close()
             raise
 
+    def clone(self):
+        """Make a copy of the TestCase.
+
+        Args:
+            None
+
+        Returns:
+            TestCase: A copy of the TestCase instance
+        """
+        result = type(self)(
+            self.landing_page,
+            self.redirect_page,
+            self.adapter_name,
+            input_fname=self.input_fname)
+        result.duration = self.duration
+        result._env_vars.update(self._env_vars)  # pylint: disable=protected-access
+        for entry in self._files.meta:
+            result.add_meta(entry.clone())
+        for entry in self._files.optional:
+            result.add_file(entry.clone(), required=False)
+        for entry in self._files.required:
+            result.add_file(entry.clone(), required=True)
+        return result
+
     def cleanup(self):
         """Close all the test files.
 
@@ -222,34 +354,55 @@ class TestCase(object):
             total += sum(x.size for x in group)
         return total
 
-    def dump(self, out_path, include_details=False):
+    @property
+    def contents(self):
+        """Get file names of required and optional TestFiles
+
+        Args:
+            None
+
+        Returns:
+            generator: file names (str) of required and optional files
+        """
+        for test in self._files.required + self._files.optional:
+            yield test.file_name
+
+    def dump(self, out_path, include_details=False, hardlink=True):
         """Write all the test case data to the filesystem.
 
         Args:
             out_path (str): Path to directory to output data
             include_details (bool): Output "test_info.json" file
+            hardlink (bool): Allow files to be hardlinked from TestFile.STORE
 
         Returns:
             None
         """
         # save test files to out_path
         for test_file in self._files.required + self._files.optional:
-            test_file.dump(out_path)
+            test_file.dump(out_path, hardlink=hardlink)
         # save test case files and meta data including:
         # adapter used, input file, environment info and files
         if include_details:
-            assert isinstance(self._env_vars, dict)
-            info = {
-                "adapter": self.adapter_name,
-                "duration": self.duration,
-                "env": self._env_vars,
-                "input": os.path.basename(self.input_fname) if self.input_fname else None,
-                "target": self.landing_page}
             with open(os.path.join(out_path, "test_info.json"), "w") as out_fp:
-                json.dump(info, out_fp, indent=2, sort_keys=True)
+                json.dump(self._info(), out_fp, indent=2, sort_keys=True)
             # save meta files
             for meta_file in self._files.meta:
-                meta_file.dump(out_path)
+                meta_file.dump(out_path, hardlink=hardlink)
+
+    def _info(self):
+        # test case details saved as "test_info.json"
+        assert isinstance(self._env_vars, dict)
+        return {
+            "adapter": self.adapter_name,
+            "duration": self.duration,
+            "env": self._env_vars,
+            "files": {
+                "meta": [x.file_name for x in self._files.meta],
+                "optional": [x.file_name for x in self._files.optional],
+                "required": [x.file_name for x in self._files.required]},
+            "input": os.path.basename(self.input_fname) if self.input_fname else None,
+            "target": self.landing_page}
 
     @property
     def env_vars(self):
@@ -265,6 +418,109 @@ class TestCase(object):
             if value is not None:
                 yield "=".join((name, value))
 
+    @classmethod
+    def load(cls, path, prefix=""):
+        """Load a TestCase from an archive created by save() or from a directory
+        created by dump() with include_details=True. Archive members are read
+        directly, the archive is not extracted.
+
+        Args:
+            path (str): Path to archive or directory.
+            prefix (str): Path of the test case within the archive (see write_archive()).
+
+        Returns:
+            TestCase: Loaded test case.
+        """
+        zip_fp = None
+        try:
+            if os.path.isdir(path):
+                root = os.path.join(path, prefix)
+                names = list()
+                for dir_name, _, dir_files in os.walk(root):
+                    rel_path = os.path.relpath(dir_name, root)
+                    names.extend(os.path.normpath(os.path.join(rel_path, x)) for x in dir_files)
+            else:
+                zip_fp = zipfile.ZipFile(path)
+                root = "/".join((prefix.strip("/"), "")) if prefix.strip("/") else ""
+                names = [os.path.normpath(x[len(root):]) for x in zip_fp.namelist()
+                         if x.startswith(root) and not x.endswith("/")]
+
+            def open_file(name):
+                if zip_fp is None:
+                    return open(os.path.join(root, name), "rb")
+                return zip_fp.open(root + name.replace(os.sep, "/"))
+
+            if "test_info.json" not in names:
+                raise TestCaseLoadFailure("Missing 'test_info.json' in %r" % (path,))
+            with open_file("test_info.json") as in_fp:
+                info = json.loads(in_fp.read().decode("utf-8"))
+            # test cases without a manifest treat every file as required
+            files = info.get("files", {"required": [x for x in names if x != "test_info.json"]})
+            for group in ("meta", "optional", "required"):
+                for name in files.get(group, ()):
+                    # file names must be relative to the test case
+                    if os.path.isabs(name) or os.path.normpath(name).split(os.sep)[0] == "..":
+                        raise TestCaseLoadFailure("Invalid file name %r in %r" % (name, path))
+            test = cls(info.get("target"), None, info.get("adapter"), input_fname=info.get("input"))
+            try:
+                test.duration = info.get("duration")
+                for name, value in info.get("env", {}).items():
+                    test.add_environ_var(name, value)
+                for group in ("meta", "optional", "required"):
+                    for name in files.get(group, ()):
+                        tfile = TestFile(name)
+                        with open_file(tfile.file_name) as in_fp:
+                            shutil.copyfileobj(in_fp, tfile, TestFile.XFER_BUF)
+                        if group == "meta":
+                            test.add_meta(tfile)
+                        else:
+                            test.add_file(tfile, required=group == "required")
+            except (IOError, KeyError, OSError) as exc:
+                test.cleanup()
+                raise TestCaseLoadFailure("Failed to load test case %r: %s" % (path, exc))
+        except (ValueError, zipfile.BadZipfile) as exc:
+            raise TestCaseLoadFailure("Invalid test case %r: %s" % (path, exc))
+        except (IOError, OSError) as exc:
+            # missing or unreadable path
+            raise TestCaseLoadFailure("Failed to load test case %r: %s" % (path, exc))
+        finally:
+            if zip_fp is not None:
+                zip_fp.close()
+        return test
+
+    @contextmanager
+    def open_file(self, file_name, encoding="UTF-8", required=True):
+        """Create a TestFile and write to it incrementally. Text is encoded as it is
+        written so large test cases do not need to be held in memory as a whole.
+        The TestFile is added to the test case when the context exits without an
+        exception.
+
+        Example:
+            with testcase.open_file("test.html") as test_fp:
+                test_fp.write("<html>")
+
+        Args:
+            file_name (str): Name for the test file
+            encoding (str): Encoding used for text (None to only accept bytes)
+            required (bool): Indicates if test file must be served
+
+        Yields:
+            TestFileWriter: Object used to write to the TestFile
+        """
+        tfile = TestFile(file_name)
+        added = False
+        try:
+            if tfile.file_name in self._existing_paths:
+                raise TestFileExists("%r exists in test" % (tfile.file_name,))
+            writer = TestFileWriter(tfile, encoding=encoding)
+            yield writer
+            writer.close()
+            self.add_file(tfile, required=required)
+            added = True
+        finally:
+            if not added:
+                tfile.close()
+
     @property
     def optional(self):
         """Get file names of optional TestFiles
@@ -278,6 +534,22 @@ class TestCase(object):
         for test in self._files.optional:
             yield test.file_name
 
+    def save(self, path, compress=False):
+        """Save the test case as a single zip archive (uncompressed by default). The
+        archive layout matches dump() with include_details=True and individual files
+        can be read without extracting the archive. Use load() to restore the test case.
+
+        Args:
+            path (str): Path of the archive to create.
+            compress (bool): Compress the files in the archive.
+
+        Returns:
+            None
+        """
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(path, mode="w", compression=compression) as zip_fp:
+            self.write_archive(zip_fp)
+
     def purge_optional(self, keep):
         """Remove optional files (by name) that are not in keep.
 
@@ -295,15 +567,43 @@ class TestCase(object):
         for idx in reversed(to_remove):
             self._files.optional.pop(idx).close()
 
+    def write_archive(self, zip_fp, prefix=""):
+        """Add the test case to an open zip archive. Used to store multiple
+        test cases in a single archive (each with a unique prefix).
+
+        Args:
+            zip_fp (zipfile.ZipFile): Archive opened for writing.
+            prefix (str): Path within the archive.
+
+        Returns:
+            None
+        """
+        prefix = prefix.strip("/")
+        for group in self._files:
+            for test_file in group:
+                name = test_file.file_name.replace(os.sep, "/")
+                zip_fp.writestr(
+                    "/".join((prefix, name)) if prefix else name,
+                    test_file.data,
+                    compress_type=archive_compression(name, zip_fp.compression))
+        zip_fp.writestr(
+            "/".join((prefix, "test_info.json")) if prefix else "test_info.json",
+            json.dumps(self._info(), indent=2, sort_keys=True))
+
 
 class TestFile(object):
     CACHE_LIMIT = 0x40000  # data cache limit per file: 256KB
+    STORE = None  # ContentStore used by dump() to link instead of copying data
     XFER_BUF = 0x10000  # transfer buffer size: 64KB
 
-    __slots__ = ("_fp", "file_name")
+    __slots__ = ("_buf", "_data", "_fp", "_size", "_stored", "file_name")
 
     def __init__(self, file_name):
-        self._fp = tempfile.SpooledTemporaryFile(max_size=self.CACHE_LIMIT, prefix="grz_tf_")
+        self._buf = bytearray()  # data (until CACHE_LIMIT is exceeded)
+        self._data = None  # shared read-only data (see freeze())
+        self._fp = None  # temporary file used when CACHE_LIMIT is exceeded
+        self._size = 0
+        self._stored = None  # ContentStore and digest of the data (see dump())
         # XXX: This is a naive fix for a larger path issue
         if "\\" in file_name:
             file_name = file_name.replace("\\", "/")
@@ -311,6 +611,20 @@ class TestFile(object):
             file_name = file_name.lstrip("/")
         self.file_name = os.path.normpath(file_name)  # name including path relative to wwwroot
 
+    def _chunks(self):
+        # yield the data in chunks without making a copy when possible
+        if self._data is not None:
+            yield self._data
+        elif self._fp is not None:
+            self._fp.seek(0)
+            while True:
+                chunk = self._fp.read(self.XFER_BUF)
+                if not chunk:
+                    break
+                yield chunk
+        elif self._buf:
+            yield self._buf
+
     def clone(self):
         """Make a copy of the TestFile.
 
@@ -320,9 +634,27 @@ class TestFile(object):
         Returns:
             TestFile: A copy of the TestFile instance
         """
-        cloned = TestFile(self.file_name)
-        self._fp.seek(0)
-        shutil.copyfileobj(self._fp, cloned._fp, self.XFER_BUF)  # pylint: disable=protected-access
+        # pylint: disable=protected-access
+        cloned = TestFile.__new__(TestFile)
+        cloned.file_name = self.file_name
+        cloned._fp = None
+        cloned._size = self._size
+        if self._data is not None:
+            # frozen data is shared by clones, a copy is made on write
+            cloned._buf = None
+            cloned._data = self._data
+        elif self._fp is None:
+            cloned._buf = bytearray(self._buf)
+            cloned._data = None
+        else:
+            cloned._buf = None
+            cloned._data = None
+            cloned._fp = tempfile.TemporaryFile(prefix="grz_tf_")
+            for chunk in self._chunks():
+                cloned._fp.write(chunk)
+        cloned._stored = self._stored
+        if self._stored is not None:
+            self._stored[0].acquire(self._stored[1])
         return cloned
 
     def close(self):
@@ -334,7 +666,12 @@ class TestFile(object):
         Returns:
             None TestFile instance
         """
-        self._fp.close()
+        self._release()
+        self._buf = None
+        self._data = None
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
 
     @property
     def data(self):
@@ -346,18 +683,20 @@ class TestFile(object):
         Returns:
             bytes: Data from the TestFile
         """
-        pos = self._fp.tell()
-        self._fp.flush()
-        self._fp.seek(0)
-        data = self._fp.read()
-        self._fp.seek(pos)
-        return data
+        if self._data is not None:
+            return self._data
+        if self._fp is not None:
+            self._fp.seek(0)
+            return self._fp.read()
+        return bytes(self._buf)
 
-    def dump(self, path):
+    def dump(self, path, hardlink=True):
         """Write test file data to the filesystem.
 
         Args:
             path (str): Path to output data
+            hardlink (bool): Allow the file to be hardlinked from STORE (the file
+                             will be read-only)
 
         Returns:
             None
@@ -365,9 +704,40 @@ class TestFile(object):
         target_path = os.path.join(path, os.path.dirname(self.file_name))
         if not os.path.isdir(target_path):
             os.makedirs(target_path)
-        self._fp.seek(0)
-        with open(os.path.join(path, self.file_name), "wb") as dst_fp:
-            shutil.copyfileobj(self._fp, dst_fp, self.XFER_BUF)
+        dst_file = os.path.join(path, self.file_name)
+        store = self.STORE
+        if store is not None:
+            # add the data to the content store once and link it on every dump
+            if self._stored is None or self._stored[0] is not store:
+                self._release()
+                self._stored = (store, store.add(self._chunks()))
+            if os.path.isfile(dst_file):
+                os.remove(dst_file)
+            if store.link(self._stored[1], dst_file, hardlink=hardlink):
+                return
+        with open(dst_file, "wb") as dst_fp:
+            for chunk in self._chunks():
+                dst_fp.write(chunk)
+
+    def freeze(self):
+        """Make the TestFile read-only. The data is kept in memory and shared
+        with clones instead of being copied. Writing to a frozen TestFile (or a
+        clone) creates a private copy of the data first. Intended for small files
+        that are added to every test case (harness, prefs, etc).
+
+        Args:
+            None
+
+        Returns:
+            TestFile: The frozen TestFile instance
+        """
+        if self._data is None:
+            self._data = self.data
+            self._buf = None
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+        return self
 
     @classmethod
     def from_data(cls, data, file_name, encoding="UTF-8"):
@@ -402,9 +772,15 @@ class TestFile(object):
         """
         t_file = cls(file_name=file_name)
         with open(input_file, "rb") as src_fp:
-            shutil.copyfileobj(src_fp, t_file._fp, cls.XFER_BUF)  # pylint: disable=protected-access
+            shutil.copyfileobj(src_fp, t_file, cls.XFER_BUF)
         return t_file
 
+    def _release(self):
+        # release the content store entry when the data is modified or closed
+        if self._stored is not None:
+            self._stored[0].release(self._stored[1])
+            self._stored = None
+
     @property
     def size(self):
         """Size of the file in bytes.
@@ -415,13 +791,7 @@ class TestFile(object):
         Returns:
             int: Size in bytes.
         """
-        pos = self._fp.tell()
-        self._fp.flush()
-        self._fp.seek(0, os.SEEK_END)
-        size = self._fp.tell()
-        self._fp.seek(pos)
-        return size
-
+        return self._size
 
     def write(self, data):
         """Add data to the TestFile.
@@ -432,4 +802,72 @@ class TestFile(object):
         Returns:
             None
         """
-        self._fp.write(data)
+        self._release()
+        if self._data is not None:
+            # copy on write
+            self._buf = bytearray(self._data)
+            self._data = None
+        if self._fp is not None:
+            self._fp.seek(0, os.SEEK_END)
+            self._fp.write(data)
+        else:
+            self._buf.extend(data)
+            if len(self._buf) > self.CACHE_LIMIT:
+                # move data to disk
+                self._fp = tempfile.TemporaryFile(prefix="grz_tf_")
+                self._fp.write(self._buf)
+                self._buf = None
+        self._size += len(data)
+
+
+class TestFileWriter(object):
+    """File-like object used to write text or bytes to a TestFile. Text is encoded
+    incrementally. See TestCase.open_file().
+    """
+    __slots__ = ("_encoder", "_test_file")
+
+    def __init__(self, test_file, encoding="UTF-8"):
+        self._encoder = codecs.getincrementalencoder(encoding)() if encoding else None
+        self._test_file = test_file
+
+    def close(self):
+        """Write data held by the encoder (if any).
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._encoder is not None:
+            data = self._encoder.encode(u"", final=True)
+            if data:
+                self._test_file.write(data)
+            self._encoder = None
+
+    def write(self, data):
+        """Add data to the TestFile.
+
+        Args:
+            data (bytes or str): Data to add, text is encoded
+
+        Returns:
+            None
+        """
+        if isinstance(data, six.text_type):
+            if self._encoder is None:
+                raise TypeError("Cannot write text without an encoding")
+            data = self._encoder.encode(data)
+        self._test_file.write(data)
+
+    def writelines(self, lines):
+        """Add a sequence of data to the TestFile.
+
+        Args:
+            lines (iterable): Data to add (see write())
+
+        Returns:
+            None
+        """
+        for line in lines:
+            self.write(line)
@@ -0,0 +1,74 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+unit tests for grizzly.common.compress
+"""
+import bz2
+import gzip
+import io
+import os
+
+import pytest
+
+from .compress import CODECS, ParallelCompressor
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    # not available in Python 2
+    lzma = None  # pylint: disable=invalid-name
+
+
+def _gz_decompress(data):
+    # GzipFile reads all members of concatenated streams
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as gz_fp:
+        return gz_fp.read()
+
+
+DECOMPRESS = {"bz2": bz2.decompress, "gz": _gz_decompress}
+if lzma is not None:
+    DECOMPRESS["xz"] = lzma.decompress
+
+
+@pytest.mark.parametrize("codec", [x for x in CODECS if x in DECOMPRESS])
+def test_parallel_compressor_01(tmp_path, codec):
+    """test ParallelCompressor round trip using multiple chunks"""
+    data = "".join("line %d\n" % (x,) for x in range(10000)).encode("ascii") + os.urandom(5000)
+    arc = tmp_path / ("data.%s" % (codec,))
+    with arc.open("wb") as out_fp:
+        with ParallelCompressor(out_fp, codec=codec, workers=3, chunk_size=4096) as comp_fp:
+            # write sizes that do not align with chunks
+            for offset in range(0, len(data), 3000):
+                comp_fp.write(data[offset:offset + 3000])
+    assert arc.stat().st_size < len(data)
+    # concatenated streams are decompressed as a single stream
+    assert DECOMPRESS[codec](arc.read_bytes()) == data
+
+
+def test_parallel_compressor_02():
+    """test ParallelCompressor with already compressed data and errors"""
+    with pytest.raises(ValueError, match="Unsupported codec"):
+        ParallelCompressor(io.BytesIO(), codec="foo")
+    # incompressible chunks are stored
+    data = os.urandom(0x20000)
+    out_fp = io.BytesIO()
+    with ParallelCompressor(out_fp, codec="gz", workers=2, chunk_size=0x8000) as comp_fp:
+        comp_fp.write(data)
+    assert _gz_decompress(out_fp.getvalue()) == data
+    # stored blocks add a few bytes per block and a header per chunk
+    assert len(data) < len(out_fp.getvalue()) < len(data) + 1024
+    # nothing written
+    out_fp = io.BytesIO()
+    with ParallelCompressor(out_fp, codec="bz2", workers=1) as comp_fp:
+        pass
+    assert not out_fp.getvalue()
+    comp_fp.close()
+    # abort
+    out_fp = io.BytesIO()
+    with pytest.raises(RuntimeError):
+        with ParallelCompressor(out_fp, workers=1, chunk_size=10) as comp_fp:
+            comp_fp.write(b"a" * 5)
+            raise RuntimeError("test")
+    assert not out_fp.getvalue()
@@ -0,0 +1,81 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# pylint: disable=protected-access
+"""
+unit tests for grizzly.common.content_store
+"""
+import os
+
+from .content_store import ContentStore
+from .storage import TestFile
+
+
+def test_content_store_01(tmp_path):
+    """test ContentStore.add(), ContentStore.link() and ContentStore.release()"""
+    store = ContentStore(str(tmp_path / "store"))
+    try:
+        digest = store.add([b"foo"])
+        assert digest in store
+        # identical content is stored once
+        assert store.add([b"foo"]) == digest
+        assert len(store) == 1
+        assert len(os.listdir(store.path)) == 1
+        # link (reflink or hardlink)
+        assert store.link(digest, str(tmp_path / "a.txt"))
+        assert (tmp_path / "a.txt").read_bytes() == b"foo"
+        # hardlinks are not allowed
+        if not store._reflink:
+            assert not store.link(digest, str(tmp_path / "b.txt"), hardlink=False)
+        # fallback when linking is not supported
+        store._hardlink = False
+        store._reflink = False
+        assert not store.link(digest, str(tmp_path / "b.txt"))
+        assert not store.link("missing", str(tmp_path / "c.txt"))
+        # entry is removed when it is no longer referenced
+        store.release(digest)
+        assert digest in store
+        store.release(digest)
+        assert digest not in store
+        assert not os.listdir(store.path)
+        store.release(digest)
+    finally:
+        store.cleanup()
+    assert not os.path.isdir(store.path)
+
+
+def test_content_store_02(tmp_path):
+    """test TestFile.dump() with a ContentStore"""
+    store = ContentStore(str(tmp_path / "store"))
+    TestFile.STORE = store
+    try:
+        tfile = TestFile.from_data(b"foo", "test.html")
+        frozen = TestFile.from_data(b"bar", "harness.html").freeze()
+        clone = frozen.clone()
+        try:
+            for i in range(2):
+                tfile.dump(str(tmp_path / ("out_%d" % (i,))))
+                clone.dump(str(tmp_path / ("out_%d" % (i,))))
+            assert len(store) == 2
+            assert (tmp_path / "out_1" / "test.html").read_bytes() == b"foo"
+            assert (tmp_path / "out_1" / "harness.html").read_bytes() == b"bar"
+            # dump over an existing file
+            tfile.dump(str(tmp_path / "out_1"))
+            # modified data is added to the store on the next dump
+            tfile.write(b"bar")
+            assert len(store) == 1
+            tfile.dump(str(tmp_path / "out_1"))
+            assert (tmp_path / "out_1" / "test.html").read_bytes() == b"foobar"
+            assert len(store) == 2
+            # clones reference the same entry
+            tfile.clone().close()
+            assert len(store) == 2
+        finally:
+            clone.close()
+            frozen.close()
+            tfile.close()
+        assert not store._refs
+    finally:
+        TestFile.STORE = None
+        store.cleanup()
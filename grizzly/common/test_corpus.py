@@ -0,0 +1,88 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# pylint: disable=protected-access
+"""
+unit tests for grizzly.common.corpus
+"""
+import os
+
+from .corpus import CorpusIndex
+
+
+def test_corpus_index_01(tmp_path):
+    """test CorpusIndex.update() and CorpusIndex.files()"""
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    (corpus / "a.html").write_bytes(b"a")
+    (corpus / "b.svg").write_bytes(b"bb")
+    (corpus / "empty.html").touch()
+    (corpus / ".hidden").write_bytes(b"x")
+    (corpus / "Thumbs.db").write_bytes(b"x")
+    (corpus / "sub").mkdir()
+    (corpus / "sub" / "c.html").write_bytes(b"ccc")
+    index = CorpusIndex(str(corpus))
+    assert not index.load()
+    assert not index.save()
+    added, removed = index.update()
+    assert len(added) == 4
+    assert not removed
+    assert len(index) == 4
+    assert sorted(os.path.basename(x) for x in index.files()) == ["a.html", "b.svg", "c.html"]
+    assert sorted(os.path.basename(x) for x in index.files(accepted_extensions=[".SVG"])) == ["b.svg"]
+    entries = dict(index)
+    assert entries[str(corpus / "sub" / "c.html")].size == 3
+    assert entries[str(corpus / "a.html")].hash == CorpusIndex.hash_file(str(corpus / "a.html"))
+    # nothing changed
+    assert index.update() == ([], [])
+    # add and remove files
+    (corpus / "a.html").unlink()
+    (corpus / "sub" / "d.html").write_bytes(b"d")
+    assert index.update() == ([str(corpus / "sub" / "d.html")], [str(corpus / "a.html")])
+    # remove directory
+    (corpus / "sub" / "c.html").unlink()
+    (corpus / "sub" / "d.html").unlink()
+    (corpus / "sub").rmdir()
+    added, removed = index.update()
+    assert not added
+    assert sorted(removed) == [str(corpus / "sub" / "c.html"), str(corpus / "sub" / "d.html")]
+    assert sorted(os.path.basename(x) for x in index.files()) == ["b.svg"]
+
+def test_corpus_index_03(tmp_path):
+    """test CorpusIndex.update() does not follow symlinked directories"""
+    corpus = tmp_path / "corpus"
+    (corpus / "sub").mkdir(parents=True)
+    (corpus / "sub" / "a.html").write_bytes(b"a")
+    # create a loop
+    (corpus / "sub" / "loop").symlink_to(str(corpus), target_is_directory=True)
+    index = CorpusIndex(str(corpus))
+    added, _ = index.update()
+    assert added == [str(corpus / "sub" / "a.html")]
+
+def test_corpus_index_02(tmp_path, mocker):
+    """test CorpusIndex.save() and CorpusIndex.load()"""
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    (corpus / "a.html").write_bytes(b"a")
+    index_file = tmp_path / "index.json"
+    index = CorpusIndex(str(corpus), index_file=str(index_file))
+    index.update()
+    assert index.save()
+    assert index_file.is_file()
+    # unmodified
+    assert not index.save()
+    # reuse saved index, files are not hashed again
+    fake_hash = mocker.patch.object(CorpusIndex, "hash_file", autospec=True)
+    index = CorpusIndex(str(corpus), index_file=str(index_file))
+    assert index.load()
+    assert index.update() == ([], [])
+    assert len(list(index.files())) == 1
+    assert fake_hash.call_count == 0
+    # different root
+    other = tmp_path / "other"
+    other.mkdir()
+    assert not CorpusIndex(str(other), index_file=str(index_file)).load()
+    # invalid index
+    index_file.write_text(u"{bad")
+    assert not index.load()
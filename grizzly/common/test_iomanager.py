@@ -4,9 +4,12 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # pylint: disable=protected-access
 
+from itertools import cycle, groupby
 import os
 
 from .iomanager import IOManager
+from .scheduler import InputScheduler
+from .sharding import CorpusShard, WorkQueue
 from .storage import InputFile, TestFile
 
 
@@ -80,17 +83,21 @@ def test_iomanager_03(tmp_path, mocker):
         iom.active_input = None
         assert iom._rotation_required(10)
         # don't pick a file because of rotation
-        iom._generated = 3
+        iom._input_generated = 3
         iom.active_input = mocker.Mock(spec=InputFile)
         assert not iom._rotation_required(10)
         # pick a file because of rotation
-        iom._generated = 2
+        iom._input_generated = 2
         iom.active_input = mocker.Mock(spec=InputFile)
         assert iom._rotation_required(2)
         # pick a file because of single pass
         iom._generated = 1
+        iom._input_generated = 1
         iom.active_input = mocker.Mock(spec=InputFile)
         assert iom._rotation_required(0)
+        # repeat the active input (single pass)
+        iom.repeat = 2
+        assert not iom._rotation_required(0)
     finally:
         iom.cleanup()
 
@@ -204,3 +211,355 @@ def test_iomanager_08():
         os.environ.pop("LSAN_OPTIONS", None)
         os.environ.pop("TEST_GOOD", None)
         os.environ.pop("TEST_BAD", None)
+
+def test_iomanager_09(tmp_path):
+    """test IOManager.save_state() and IOManager.load_state()"""
+    for i in range(4):
+        (tmp_path / ("input_%02d.bin" % (i,))).write_bytes(str(i).encode("ascii"))
+    iom = IOManager()
+    try:
+        assert iom.save_state() == {"active_input": None, "generated": 0, "input_generated": 0}
+        # single pass mode
+        iom.scan_input(str(tmp_path), sort=True)
+        iom.create_testcase("test-adapter", rotation_period=0)
+        iom.create_testcase("test-adapter", rotation_period=0)
+        state = iom.save_state()
+        assert state["active_input"] == str(tmp_path / "input_01.bin")
+        iom.input_files = list()
+        iom.scan_input(str(tmp_path), sort=True)
+        iom.load_state(state, rotation_period=0)
+        assert len(iom.input_files) == 2
+        assert iom.input_files[-1] == str(tmp_path / "input_02.bin")
+        # fuzzing mode
+        iom.load_state({"active_input": str(tmp_path / "input_03.bin"), "generated": 5})
+        assert iom.active_input.file_name == str(tmp_path / "input_03.bin")
+        assert iom._generated == 5
+        # missing input
+        iom.load_state({"active_input": str(tmp_path / "missing.bin"), "generated": 9})
+        assert iom._generated == 5
+    finally:
+        iom.cleanup()
+    # single pass mode with repeats, resume the remaining repeats of the last input
+    iom = IOManager(repeat=3)
+    try:
+        iom.scan_input(str(tmp_path), sort=True)
+        for _ in range(5):
+            iom.create_testcase("test-adapter", rotation_period=0)
+        state = iom.save_state()
+        assert state["active_input"] == str(tmp_path / "input_01.bin")
+        assert state["input_generated"] == 2
+        iom.cleanup()
+        iom = IOManager(repeat=3)
+        iom.scan_input(str(tmp_path), sort=True)
+        iom.load_state(state, rotation_period=0)
+        assert iom.active_input.file_name == str(tmp_path / "input_01.bin")
+        assert len(iom.input_files) == 2
+        test = iom.create_testcase("test-adapter", rotation_period=0)
+        assert test.input_fname == str(tmp_path / "input_01.bin")
+        test = iom.create_testcase("test-adapter", rotation_period=0)
+        assert test.input_fname == str(tmp_path / "input_02.bin")
+        # all repeats completed
+        state["input_generated"] = 3
+        iom.load_state(state, rotation_period=0)
+        assert iom.input_files[-1] == str(tmp_path / "input_03.bin")
+    finally:
+        iom.cleanup()
+
+def test_iomanager_10():
+    """test IOManager.create_testcase() batches"""
+    iom = IOManager(report_size=2)
+    try:
+        iom.harness = TestFile.from_data(b"data", "h.htm")
+        for batch_index in range(3):
+            iom.create_testcase("test-adapter", batch_index=batch_index)
+        # the whole batch is kept
+        assert len(iom.tests) == 3
+        assert iom.server_map.redirect["first_test"].target == "test_0000.html"
+        assert iom.server_map.redirect["batch_test_1"].target == "test_0001.html"
+        assert iom.server_map.redirect["batch_test_2"].target == "test_0002.html"
+        assert not iom.server_map.redirect["batch_test_2"].required
+        assert iom.server_map.redirect["next_test"].target == "test_0003.html"
+        assert iom.server_map.redirect["next_test"].required
+        # next batch
+        iom.create_testcase("test-adapter")
+        assert len(iom.tests) == 2
+        assert "batch_test_1" not in iom.server_map.redirect
+        # short batch (inputs exhausted), the harness requests 'batch_test_1' next
+        iom.end_batch(1)
+        assert "next_test" not in iom.server_map.redirect
+        assert iom.server_map.redirect["batch_test_1"].target == "test_0004.html"
+        assert iom.server_map.redirect["batch_test_1"].required
+    finally:
+        iom.cleanup()
+
+def test_iomanager_11(tmp_path, mocker):
+    """test IOManager.refresh_input()"""
+    mocker.patch.object(IOManager, "REFRESH_FREQ", 0)
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    (corpus / "b.html").write_bytes(b"b")
+    (corpus / "d.html").write_bytes(b"d")
+    index_file = tmp_path / "index.json"
+    iom = IOManager()
+    try:
+        # no corpus
+        iom.refresh_input(wait=True)
+        iom.scan_input(str(corpus), accepted_extensions=["html"], sort=True, index_file=str(index_file))
+        assert iom.input_files == [str(corpus / "d.html"), str(corpus / "b.html")]
+        # nothing changed
+        iom.refresh_input(wait=True)
+        assert len(iom.input_files) == 2
+        # add and remove files
+        (corpus / "a.html").write_bytes(b"a")
+        (corpus / "c.html").write_bytes(b"c")
+        (corpus / "e.txt").write_bytes(b"e")
+        (corpus / "d.html").unlink()
+        iom.refresh_input(wait=True)
+        assert iom.input_files == [str(corpus / "c.html"), str(corpus / "b.html"), str(corpus / "a.html")]
+        # rescan is performed in the background
+        (corpus / "f.html").write_bytes(b"f")
+        iom.create_testcase("test-adapter", rotation_period=0)
+        assert iom._refresh is not None
+        iom._refresh.join()
+        iom.create_testcase("test-adapter", rotation_period=0)
+        assert str(corpus / "f.html") in iom.input_files
+        # rescan frequency
+        IOManager.REFRESH_FREQ = 60
+        (corpus / "g.html").write_bytes(b"g")
+        iom.refresh_input(wait=True)
+        assert iom._refresh is None
+        assert str(corpus / "g.html") not in iom.input_files
+    finally:
+        iom.cleanup()
+    assert index_file.is_file()
+
+def test_iomanager_12(tmp_path, mocker):
+    """test IOManager with an InputScheduler"""
+    (tmp_path / "a.html").write_bytes(b"a")
+    (tmp_path / "b.html").write_bytes(b"b")
+    scheduler = mocker.Mock(spec=InputScheduler)
+    scheduler.choose.side_effect = lambda x: x[0]
+    scheduler.rotation_period.return_value = 3
+    iom = IOManager(scheduler=scheduler)
+    try:
+        iom.scan_input(str(tmp_path), sort=True)
+        # select the active input and the next input (prefetched)
+        test = iom.create_testcase("test-adapter", rotation_period=10)
+        assert scheduler.choose.call_count == 2
+        assert test.input_fname == str(tmp_path / "b.html")
+        # adaptive rotation period
+        iom.create_testcase("test-adapter", rotation_period=10)
+        iom.create_testcase("test-adapter", rotation_period=10)
+        assert scheduler.choose.call_count == 2
+        iom.create_testcase("test-adapter", rotation_period=10)
+        assert scheduler.choose.call_count == 3
+        # record results
+        iom.record_result(None)
+        assert scheduler.record.call_count == 0
+        iom.record_result(test.input_fname, duration=1.0, failure=True)
+        scheduler.record.assert_called_once_with(
+            test.input_fname, duration=1.0, failure=True, ignored=False, timeout=False)
+    finally:
+        iom.cleanup()
+    assert scheduler.close.call_count == 1
+
+def test_iomanager_13(tmp_path, mocker):
+    """test IOManager skips duplicate input files"""
+    mocker.patch.object(IOManager, "REFRESH_FREQ", 0)
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    (corpus / "a.html").write_bytes(b"a")
+    (corpus / "b.html").write_bytes(b"a")
+    (corpus / "sub").mkdir()
+    (corpus / "sub" / "c.html").write_bytes(b"c")
+    (corpus / "sub" / "d.html").write_bytes(b"a")
+    iom = IOManager()
+    try:
+        iom.scan_input(str(corpus), sort=True)
+        assert iom.input_files == [str(corpus / "sub" / "c.html"), str(corpus / "a.html")]
+        # duplicates added while running are skipped
+        (corpus / "e.html").write_bytes(b"c")
+        (corpus / "f.html").write_bytes(b"f")
+        iom.refresh_input(wait=True)
+        assert iom.input_files == [
+            str(corpus / "sub" / "c.html"), str(corpus / "f.html"), str(corpus / "a.html")]
+        # removing a file allows identical content to be added
+        (corpus / "a.html").unlink()
+        (corpus / "g.html").write_bytes(b"a")
+        iom.refresh_input(wait=True)
+        assert str(corpus / "g.html") in iom.input_files
+        assert len(iom.input_files) == 3
+    finally:
+        iom.cleanup()
+
+def test_iomanager_14(tmp_path):
+    """test IOManager memory limit (spill test cases to disk)"""
+    iom = IOManager(report_size=4, working_path=str(tmp_path), memory_limit=10)
+    def create_testcase(**kwargs):
+        test = iom.create_testcase("test-adapter", rotation_period=0, **kwargs)
+        test.input_fname = os.path.join("corpus", "in_%s" % (test.landing_page,))
+        return test
+    try:
+        for i in range(3):
+            create_testcase().add_from_data("x" * 4, "d%d.html" % (i,))
+        assert len(iom.tests) == 3
+        assert not iom._spilled
+        # older test cases that do not fit are moved to disk
+        create_testcase().add_from_data("x" * 4, "d3.html")
+        assert len(iom.tests) == 3
+        assert len(iom._spilled) == 1
+        assert len(os.listdir(str(tmp_path))) == 1
+        # history size includes spilled test cases
+        create_testcase().add_from_data("x" * 4, "d4.html")
+        assert len(iom.tests) == 3
+        assert len(iom._spilled) == 1
+        assert len(os.listdir(str(tmp_path))) == 1
+        # current batch is not spilled
+        iom.tests[-1].add_from_data("x" * 20, "big.html")
+        create_testcase(batch_index=1)
+        assert len(iom.tests) == 2
+        assert len(iom._spilled) == 2
+        # restore before reporting
+        iom.restore_tests()
+        assert not iom._spilled
+        assert not os.listdir(str(tmp_path))
+        assert [x.landing_page for x in iom.tests] == [
+            "test_0002.html", "test_0003.html", "test_0004.html", "test_0005.html"]
+        # details not stored in the archive are restored
+        assert [x.redirect_page for x in iom.tests] == [
+            "test_0003.html", "test_0004.html", "test_0005.html", "test_0006.html"]
+        for test in iom.tests:
+            assert test.input_fname == os.path.join("corpus", "in_%s" % (test.landing_page,))
+        assert iom.tests[0]._files.required[0].data == b"x" * 4
+        # purge removes spilled test cases
+        iom.create_testcase("test-adapter", rotation_period=0)
+        assert iom._spilled
+        iom.purge_tests()
+        assert not os.listdir(str(tmp_path))
+    finally:
+        iom.cleanup()
+
+def test_iomanager_15(tmp_path):
+    """test IOManager prefetching the next input file"""
+    for name in ("a.bin", "b.bin", "c.bin"):
+        (tmp_path / name).write_bytes(name.encode("ascii"))
+    iom = IOManager()
+    try:
+        # single pass mode
+        iom.scan_input(str(tmp_path), sort=True)
+        iom.create_testcase("test-adapter", rotation_period=0)
+        assert iom.active_input.file_name == str(tmp_path / "a.bin")
+        assert iom._prefetch.file_name == str(tmp_path / "b.bin")
+        iom._prefetch.join()
+        prefetched = iom._prefetch.input_file
+        assert prefetched is not None
+        iom.create_testcase("test-adapter", rotation_period=0)
+        assert iom.active_input is prefetched
+        # input list changed, prefetched file is not used
+        iom.input_files.append(str(tmp_path / "a.bin"))
+        iom.create_testcase("test-adapter", rotation_period=0)
+        assert iom.active_input.file_name == str(tmp_path / "a.bin")
+        assert iom.active_input.get_data() == b"a.bin"
+        # last input
+        iom.create_testcase("test-adapter", rotation_period=0)
+        assert iom._prefetch is None
+        # failed prefetch (removed before the prefetch starts)
+        iom.input_files = [str(tmp_path / "c.bin"), str(tmp_path / "b.bin")]
+        (tmp_path / "c.bin").unlink()
+        iom.create_testcase("test-adapter", rotation_period=0)
+        assert iom._prefetch.file_name == str(tmp_path / "c.bin")
+        iom._prefetch.join()
+        assert iom._prefetch.input_file is None
+        iom.input_files = [str(tmp_path / "a.bin")]
+        iom.create_testcase("test-adapter", rotation_period=0)
+        assert iom.active_input.file_name == str(tmp_path / "a.bin")
+        # fuzzing mode
+        iom.input_files = [str(tmp_path / "a.bin"), str(tmp_path / "b.bin")]
+        iom.create_testcase("test-adapter", rotation_period=1)
+        assert iom._prefetch is not None
+    finally:
+        iom.cleanup()
+    assert iom._prefetch is None
+
+
+def test_iomanager_16(tmp_path):
+    """test IOManager with a CorpusShard"""
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    for i in range(10):
+        (corpus / ("%d.html" % (i,))).write_bytes(str(i).encode("ascii"))
+    found = list()
+    for index in range(1, 4):
+        iom = IOManager(shard=CorpusShard(index, 3))
+        try:
+            iom.scan_input(str(corpus))
+            found.extend(iom.input_files)
+        finally:
+            iom.cleanup()
+    # each input file is used by exactly one shard
+    assert sorted(found) == sorted(str(x) for x in corpus.iterdir())
+
+def test_iomanager_17(tmp_path):
+    """test IOManager with a WorkQueue (single pass mode)"""
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    for name in ("a.html", "b.html", "c.html", "d.html"):
+        (corpus / name).write_bytes(name.encode("ascii"))
+    queue = WorkQueue(str(tmp_path / "queue"))
+    iom_a = IOManager(work_queue=queue)
+    iom_b = IOManager(work_queue=queue)
+    try:
+        iom_a.scan_input(str(corpus), sort=True)
+        iom_b.scan_input(str(corpus), sort=True)
+        # the next input is claimed when the active input is selected
+        iom_a.create_testcase("test-adapter", rotation_period=0)
+        assert iom_a.active_input.file_name == str(corpus / "a.html")
+        assert iom_a._claims == set([str(corpus / "b.html")])
+        # input files claimed by another instance are skipped
+        iom_b.create_testcase("test-adapter", rotation_period=0)
+        assert iom_b.active_input.file_name == str(corpus / "c.html")
+        assert iom_b.input_files == [str(corpus / "d.html")]
+        iom_a.create_testcase("test-adapter", rotation_period=0)
+        assert iom_a.active_input.file_name == str(corpus / "b.html")
+        assert not iom_a.input_files
+        assert not iom_a._claims
+    finally:
+        iom_a.cleanup()
+        iom_b.cleanup()
+    # unused claims are released
+    assert queue.claim(str(corpus / "d.html"))
+
+def test_iomanager_18(tmp_path):
+    """test IOManager.inputs_exhausted() and repeat (single pass mode)"""
+    (tmp_path / "a.html").write_bytes(b"a")
+    (tmp_path / "b.html").write_bytes(b"b")
+    iom = IOManager(repeat=2)
+    try:
+        assert iom.inputs_exhausted()
+        iom.scan_input(str(tmp_path), sort=True)
+        assert not iom.inputs_exhausted()
+        names = list()
+        for _ in range(4):
+            names.append(iom.create_testcase("test-adapter", rotation_period=0).input_fname)
+        assert names == [str(tmp_path / x) for x in ("a.html", "a.html", "b.html", "b.html")]
+        assert iom.inputs_exhausted()
+    finally:
+        iom.cleanup()
+
+def test_iomanager_19(tmp_path, mocker):
+    """test IOManager switching from an adapted rotation period to the default"""
+    for name in ("a.html", "b.html", "c.html"):
+        (tmp_path / name).write_bytes(name.encode("ascii"))
+    scheduler = mocker.Mock(spec=InputScheduler)
+    order = cycle(sorted(str(x) for x in tmp_path.iterdir()))
+    scheduler.choose.side_effect = lambda _: next(order)
+    # adapted period for the first input, the default (4) for the rest
+    scheduler.rotation_period.side_effect = lambda _, default: 3 if not iom._generated else default
+    iom = IOManager(scheduler=scheduler)
+    try:
+        iom.scan_input(str(tmp_path), sort=True)
+        names = [iom.create_testcase("test-adapter", rotation_period=4).input_fname for _ in range(12)]
+        # number of test cases generated from each input before rotating
+        assert [len(list(group)) for _, group in groupby(names)] == [3, 4, 4, 1]
+    finally:
+        iom.cleanup()
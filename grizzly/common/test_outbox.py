@@ -0,0 +1,166 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# pylint: disable=protected-access
+"""
+unit tests for grizzly.common.outbox
+"""
+import json
+import os
+import threading
+import time
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.urllib.parse import parse_qs
+
+from .outbox import Outbox
+from .reporter import FuzzManagerReporter
+
+
+def test_outbox_01(tmp_path):
+    """test Outbox.add() and Outbox.close()"""
+    submitted = list()
+    def _handler(entry, data):
+        with open(os.path.join(entry, "test.txt"), "r") as in_fp:
+            submitted.append((data, in_fp.read()))
+    src = tmp_path / "test.txt"
+    src.write_text(u"foo")
+    outbox = Outbox(str(tmp_path / "outbox"), _handler)
+    outbox.add({"a": 1}, files=(str(src),))
+    assert not src.is_file()
+    assert outbox.close() == 0
+    assert submitted == [({"a": 1}, "foo")]
+    assert outbox.pending == 0
+    # processed entries are removed
+    assert not [x for x in os.listdir(str(tmp_path / "outbox")) if not x.startswith(".")]
+
+def test_outbox_02(tmp_path, mocker):
+    """test Outbox retry and resume"""
+    mocker.patch.object(Outbox, "BACKOFF_MIN", 0)
+    mocker.patch.object(Outbox, "MAX_ATTEMPTS", 3)
+    path = tmp_path / "outbox"
+    # incomplete (staged) entries are removed
+    (path / "tmp_partial").mkdir(parents=True)
+    # failed entries are retried until MAX_ATTEMPTS is reached
+    handler = mocker.Mock(side_effect=RuntimeError("test"))
+    outbox = Outbox(str(path), handler)
+    assert not (path / "tmp_partial").is_dir()
+    outbox.add({"a": 1})
+    assert outbox.close() == 0
+    assert handler.call_count == 3
+    assert len([x for x in os.listdir(str(path)) if x.startswith("failed_")]) == 1
+    # pending entries are left in the outbox when close() times out
+    mocker.patch.object(Outbox, "BACKOFF_MIN", 60)
+    handler.reset_mock()
+    outbox = Outbox(str(path), handler)
+    outbox.add({"b": 2})
+    assert outbox.close(timeout=0.1) == 1
+    assert handler.call_count == 1
+    entries = [x for x in os.listdir(str(path)) if x.startswith("entry_")]
+    assert len(entries) == 1
+    with open(str(path / entries[0] / Outbox.ENTRY_DATA), "r") as in_fp:
+        assert json.load(in_fp)["attempts"] == 1
+    # pending entries are resumed (after the backoff delay)
+    mocker.patch("grizzly.common.outbox.time.time", return_value=1e12)
+    handler = mocker.Mock()
+    outbox = Outbox(str(path), handler)
+    assert outbox.close() == 0
+    handler.assert_called_once_with(str(path / entries[0]), {"b": 2})
+
+def test_outbox_04(tmp_path, mocker):
+    """test Outbox.close() does not wait for entries retried after the deadline"""
+    mocker.patch.object(Outbox, "BACKOFF_MIN", 60)
+    handler = mocker.Mock(side_effect=RuntimeError("test"))
+    outbox = Outbox(str(tmp_path), handler)
+    outbox.add({"a": 1})
+    start = time.time()
+    assert outbox.close(timeout=30) == 1
+    assert time.time() - start < 10
+    assert handler.call_count == 1
+
+class _StubFuzzManager(BaseHTTPRequestHandler):
+    # fail the first submission and accept the rest
+    requests = list()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+        self.requests.append(dict((key, value[0]) for key, value in body.items()))
+        if len(self.requests) == 1:
+            self.send_response(400)
+            self.end_headers()
+            return
+        data = json.dumps({"id": len(self.requests)}).encode("utf-8")
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *_):  # pylint: disable=arguments-differ
+        pass
+
+def test_outbox_03(tmp_path, mocker):
+    """test FuzzManagerReporter.submit_entry() with an Outbox and a stub server"""
+    mocker.patch.object(Outbox, "BACKOFF_MIN", 0)
+    server = HTTPServer(("127.0.0.1", 0), _StubFuzzManager)
+    worker = threading.Thread(target=server.serve_forever)
+    worker.start()
+    try:
+        fm_config = tmp_path / "fm.conf"
+        fm_config.write_text(u"\n".join((
+            "[Main]",
+            "serverhost = 127.0.0.1",
+            "serverport = %d" % (server.server_address[1],),
+            "serverproto = http",
+            "serverauthtoken = token",
+            "sigdir = %s" % (tmp_path,))))
+        mocker.patch.dict(os.environ, {"FM_CONFIG_PATH": str(fm_config)})
+        (tmp_path / "bin.fuzzmanagerconf").write_text(u"\n".join((
+            "[Main]",
+            "platform = x86-64",
+            "product = mozilla-central",
+            "os = linux")))
+        test_case = tmp_path / "test.zip"
+        test_case.write_bytes(b"PK")
+        outbox = FuzzManagerReporter.create_outbox(str(tmp_path / "outbox"))
+        outbox.add({
+            "aux": [],
+            "binary": str(tmp_path / "bin"),
+            "metadata": {"grizzly_input": "[]"},
+            "quality": FuzzManagerReporter.QUAL_UNREDUCED,
+            "stderr": ["ERROR: test"],
+            "stdout": [],
+            "test_case": "test.zip",
+            "tool": "test-tool"}, files=(str(test_case),))
+        # the configuration staged with the entry is used instead of the build
+        test_case.write_bytes(b"PK")
+        outbox.add({
+            "aux": [],
+            "binary": str(tmp_path / "bin"),
+            "configuration": {
+                "args": [],
+                "env": {},
+                "os": "linux",
+                "platform": "x86-64",
+                "product": "mozilla-beta",
+                "version": "abcd"},
+            "metadata": {"grizzly_input": "[]"},
+            "quality": FuzzManagerReporter.QUAL_UNREDUCED,
+            "stderr": ["ERROR: test"],
+            "stdout": [],
+            "test_case": "test.zip",
+            "tool": "test-tool"}, files=(str(test_case),))
+        assert outbox.close() == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+        worker.join()
+    assert len(_StubFuzzManager.requests) == 3
+    for request in _StubFuzzManager.requests[1:]:
+        assert request["rawStderr"] == "ERROR: test"
+        assert request["tool"] == "test-tool"
+        assert request["testcase_quality"] == str(FuzzManagerReporter.QUAL_UNREDUCED)
+    # the first submission (entry without a configuration) failed and was retried
+    products = sorted(x["product"] for x in _StubFuzzManager.requests[1:])
+    assert products == ["mozilla-beta", "mozilla-central"]
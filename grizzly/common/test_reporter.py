@@ -5,13 +5,17 @@
 """test Grizzly Reporter"""
 # pylint: disable=protected-access
 
+import json
 import os
 import sys
 import tarfile
+import zipfile
 
 import pytest
 
-from .reporter import FilesystemReporter, FuzzManagerReporter, Report, Reporter, S3FuzzManagerReporter
+from .outbox import Outbox
+from .reporter import (FilesystemReporter, FuzzManagerReporter, Report, Reporter, ReportQueue,
+                       S3FuzzManagerReporter)
 from .storage import TestCase
 
 
@@ -211,7 +215,7 @@ def test_report_10(tmp_path):
     report.cleanup()
     assert not tmp_path.is_dir()
 
-def test_reporter_01(tmp_path):
+def test_reporter_01(tmp_path, mocker):
     """test creating a simple Reporter"""
     class SimpleReporter(Reporter):
         def _pre_submit(self, report):
@@ -227,6 +231,60 @@ def test_reporter_01(tmp_path):
     with pytest.raises(IOError) as exc:
         reporter.submit(str(tmp_path), [])
     assert "No logs found in" in str(exc.value)
+    # callback receives the major hash of the submitted report
+    (tmp_path / "log_stderr.txt").write_bytes(b"STDERR log")
+    callback = mocker.Mock()
+    reporter.submit(str(tmp_path), [], callback=callback)
+    assert callback.call_count == 1
+    assert callback.call_args[0][0] == Report.DEFAULT_MAJOR
+
+def test_report_queue_01(tmp_path, mocker):
+    """test ReportQueue"""
+    fake_reporter = mocker.Mock(spec=Reporter)
+    working = tmp_path / "working"
+    working.mkdir()
+    queue = ReportQueue(fake_reporter, max_size=2, working_path=str(working))
+    try:
+        with pytest.raises(IOError, match="No such directory"):
+            queue.submit("missing_dir", [])
+        log_path = tmp_path / "logs"
+        log_path.mkdir()
+        (log_path / "log_stderr.txt").write_bytes(b"STDERR log")
+        testcase = mocker.Mock(spec=TestCase)
+        callback = mocker.Mock()
+        queue.submit(str(log_path), [testcase], callback=callback)
+        # logs are moved to the staging directory
+        assert not log_path.exists()
+        assert testcase.clone.call_count == 1
+    finally:
+        queue.close()
+    assert queue.pending == 0
+    assert fake_reporter.submit.call_count == 1
+    assert fake_reporter.submit.call_args[1]["callback"] is callback
+    assert testcase.clone.return_value.cleanup.call_count == 1
+    # staging directory is removed
+    assert not os.listdir(str(working))
+
+def test_report_queue_02(tmp_path, mocker):
+    """test ReportQueue worker exceptions"""
+    fake_reporter = mocker.Mock(spec=Reporter)
+    fake_reporter.submit.side_effect = RuntimeError("Running low on disk space")
+    queue = ReportQueue(fake_reporter, max_size=1, working_path=str(tmp_path))
+    log_path = tmp_path / "logs"
+    log_path.mkdir()
+    queue.submit(str(log_path), [])
+    queue._queue.join()
+    assert fake_reporter.submit.call_count == 1
+    assert not log_path.exists()
+    # raised by the next submit()
+    log_path.mkdir()
+    with pytest.raises(RuntimeError, match="Running low on disk space"):
+        queue.submit(str(log_path), [])
+    # logged (not raised) by close()
+    queue.submit(str(log_path), [])
+    queue.close()
+    assert fake_reporter.submit.call_count == 2
+    assert queue._exc_info is None
 
 def test_filesystem_reporter_01(tmp_path):
     """test FilesystemReporter without testcases"""
@@ -336,6 +394,29 @@ def test_filesystem_reporter_04(tmp_path):
     assert "echo-0" not in entries
     assert "latest-trace" not in entries
 
+def test_filesystem_reporter_05(tmp_path, mocker):
+    """test FilesystemReporter.compress_rr_trace() codecs"""
+    # create fake trace
+    trace_path = tmp_path / "rr-traces" / "echo-0"
+    trace_path.mkdir(parents=True)
+    (trace_path / "data").write_bytes(b"test_data" * 1000)
+    (trace_path / "mmap").write_bytes(os.urandom(1000))
+    (tmp_path / "rr-traces" / "latest-trace").symlink_to(str(trace_path), target_is_directory=True)
+    mocker.patch.object(FilesystemReporter, "RR_CODEC", "gz")
+    rr_arc = FilesystemReporter.compress_rr_trace(str(tmp_path / "rr-traces"), str(tmp_path), workers=2)
+    assert rr_arc == str(tmp_path / "rr.tar.gz")
+    assert not (tmp_path / "rr-traces").exists()
+    with tarfile.open(rr_arc, "r:gz") as arc_fp:
+        assert set(arc_fp.getnames()) == {"echo-0", "echo-0/data", "echo-0/mmap"}
+        assert arc_fp.extractfile("echo-0/data").read() == b"test_data" * 1000
+    # unsupported codec
+    trace_path.mkdir(parents=True)
+    (tmp_path / "rr-traces" / "latest-trace").symlink_to(str(trace_path), target_is_directory=True)
+    with pytest.raises(ValueError, match="Unsupported codec"):
+        FilesystemReporter.compress_rr_trace(str(tmp_path / "rr-traces"), str(tmp_path), codec="foo")
+    assert (tmp_path / "rr-traces").is_dir()
+    assert not (tmp_path / "rr.tar.foo").exists()
+
 def test_fuzzmanager_reporter_01(tmp_path, mocker):
     """test FuzzManagerReporter.sanity_check()"""
     mocker.patch("grizzly.common.reporter.ProgramConfiguration")
@@ -382,7 +463,7 @@ def test_fuzzmanager_reporter_03(tmp_path, mocker):
     fake_test.env_vars = ("TEST=1",)
     reporter.submit(str(log_path), [fake_test])
     assert not log_path.is_dir()
-    assert fake_test.dump.call_count == 1
+    assert fake_test.write_archive.call_count == 1
     assert fake_collector.return_value.submit.call_count == 1
 
 def test_fuzzmanager_reporter_04(tmp_path, mocker):
@@ -433,6 +514,115 @@ def test_fuzzmanager_reporter_06(tmp_path, mocker):
     reporter.submit(str(log_path), [])
     fake_collector.return_value.submit.assert_not_called()
 
+def test_fuzzmanager_reporter_07(tmp_path, mocker):
+    """test FuzzManagerReporter.submit() with an Outbox"""
+    fake_crashinfo = mocker.patch("grizzly.common.reporter.CrashInfo", autospec=True)
+    fake_crashinfo.fromRawCrashData.return_value.createShortSignature.return_value = "test [@ test]"
+    fake_collector = mocker.patch("grizzly.common.reporter.Collector", autospec=True)
+    fake_collector.return_value.search.return_value = (None, None)
+    fake_collector.return_value.generate.return_value = str(tmp_path / "fake_sig_file")
+    fake_crashinfo.fromRawCrashData.return_value.configuration = mocker.Mock(
+        args=["-a"],
+        env={},
+        metadata={},
+        os="linux",
+        platform="x86-64",
+        product="mozilla-central",
+        version="abcd")
+    fake_outbox = mocker.Mock(spec=Outbox)
+    reporter = FuzzManagerReporter("fake_bin", tool="fake-tool", outbox=fake_outbox)
+    log_path = tmp_path / "log_path"
+    log_path.mkdir()
+    (log_path / "log_stderr.txt").touch()
+    (log_path / "log_stdout.txt").touch()
+    reporter.submit(str(log_path), [])
+    fake_collector.return_value.submit.assert_not_called()
+    assert fake_outbox.add.call_count == 1
+    data = fake_outbox.add.call_args[0][0]
+    assert data["binary"] == "fake_bin"
+    # the configuration of the build is staged
+    assert data["configuration"] == {
+        "args": ["-a"],
+        "env": {},
+        "os": "linux",
+        "platform": "x86-64",
+        "product": "mozilla-central",
+        "version": "abcd"}
+    assert data["tool"] == "fake-tool"
+    assert data["test_case"].endswith(".zip")
+    assert fake_outbox.add.call_args[1]["files"][0].endswith(data["test_case"])
+
+def test_fuzzmanager_reporter_08(tmp_path, mocker):
+    """test FuzzManagerReporter.submit() skip known frequent stacks"""
+    mocker.patch.object(FuzzManagerReporter, "FREQUENT_STACKS", str(tmp_path / "frequent"))
+    fake_crashinfo = mocker.patch("grizzly.common.reporter.CrashInfo", autospec=True)
+    fake_collector = mocker.patch("grizzly.common.reporter.Collector", autospec=True)
+    sig_file = tmp_path / "fake.signature"
+    sig_file.touch()
+    fake_collector.return_value.search.return_value = (
+        str(sig_file), {"frequent": True, "shortDescription": "[@ test]"})
+    reporter = FuzzManagerReporter("fake_bin")
+    def _create_logs():
+        log_path = tmp_path / "log_path"
+        log_path.mkdir()
+        (log_path / "log_stderr.txt").touch()
+        (log_path / "log_stdout.txt").touch()
+        with (log_path / "log_asan_blah.txt").open("wb") as log_fp:
+            log_fp.write(b"    #0 0xbad000 in foo /file1.c:123:234\n")
+            log_fp.write(b"    #1 0x1337dd in bar /file2.c:1806:19")
+        return str(log_path)
+    # first match is recorded
+    reporter.submit(_create_logs(), [])
+    assert fake_crashinfo.fromRawCrashData.call_count == 1
+    assert fake_collector.return_value.search.call_count == 1
+    assert len(list((tmp_path / "frequent").iterdir())) == 1
+    # following matches are skipped before creating CrashInfo
+    reporter.submit(_create_logs(), [])
+    reporter.submit(_create_logs(), [])
+    assert fake_crashinfo.fromRawCrashData.call_count == 1
+    assert fake_collector.return_value.search.call_count == 1
+    with next((tmp_path / "frequent").iterdir()).open("r") as in_fp:
+        assert json.load(in_fp)["count"] == 2
+    # unless the report is forced
+    reporter.force_report = True
+    reporter.submit(_create_logs(), [])
+    assert fake_crashinfo.fromRawCrashData.call_count == 2
+    assert fake_collector.return_value.submit.call_count == 1
+    # markers are invalidated when the signature cache is refreshed
+    reporter.force_report = False
+    stat = sig_file.stat()
+    os.utime(str(sig_file), (stat.st_atime, stat.st_mtime + 10))
+    fake_collector.return_value.search.return_value = (
+        str(sig_file), {"frequent": False, "shortDescription": "[@ test]"})
+    reporter.submit(_create_logs(), [])
+    assert fake_crashinfo.fromRawCrashData.call_count == 3
+    assert fake_collector.return_value.submit.call_count == 2
+    assert not any((tmp_path / "frequent").iterdir())
+
+def test_fuzzmanager_reporter_09(tmp_path, mocker):
+    """test FuzzManagerReporter._create_archive()"""
+    mocker.patch.object(FuzzManagerReporter, "MAX_FILE_SIZE", 100)
+    mocker.patch.object(Report, "MAX_LOG_SIZE", 10)
+    log_path = tmp_path / "log_path"
+    (log_path / "sub").mkdir(parents=True)
+    (log_path / "log_stderr.txt").write_bytes(b"12345")
+    (log_path / "sub" / "big_log.txt").write_bytes(b"x" * 50 + b"0123456789")
+    (log_path / "big.dmp").write_bytes(b"x" * 101)
+    (log_path / "screen.png").write_bytes(b"x" * 50)
+    report = mocker.Mock(spec=Report, path=str(log_path), prefix="prefix")
+    fake_test = mocker.Mock(spec=TestCase)
+    reporter = FuzzManagerReporter("fake_bin", working_path=str(tmp_path))
+    reporter._create_archive(str(tmp_path / "test.zip"), report, [fake_test])
+    fake_test.write_archive.assert_called_once_with(mocker.ANY, prefix="prefix-0")
+    with zipfile.ZipFile(str(tmp_path / "test.zip"), "r") as zip_fp:
+        assert sorted(zip_fp.namelist()) == ["log_stderr.txt", "screen.png", "sub/big_log.txt"]
+        assert zip_fp.read("log_stderr.txt") == b"12345"
+        # oversized logs are tailed
+        assert zip_fp.read("sub/big_log.txt") == b"[LOG TAILED]\n0123456789"
+        # compressed files are stored
+        assert zip_fp.getinfo("screen.png").compress_type == zipfile.ZIP_STORED
+        assert zip_fp.getinfo("log_stderr.txt").compress_type == zipfile.ZIP_DEFLATED
+
 def test_s3fuzzmanager_reporter_01(tmp_path, mocker):
     """test S3FuzzManagerReporter.sanity_check()"""
     mocker.patch("grizzly.common.reporter.FuzzManagerReporter", autospec=True)
@@ -492,5 +682,30 @@ def test_s3fuzzmanager_reporter_02(tmp_path, mocker):
     assert "rr-trace" in reporter._extra_metadata
     assert fake_report.minor in reporter._extra_metadata["rr-trace"]
     assert fake_boto3.resource.return_value.meta.client.upload_file.call_count == 1
+    assert fake_boto3.resource.return_value.meta.client.upload_file.call_args[0][2] == "rr-1234abcd.tar.bz2"
 
 # TODO: fill out tests for FuzzManagerReporter and S3FuzzManagerReporter
+
+def test_s3fuzzmanager_reporter_03(tmp_path, mocker):
+    """test S3FuzzManagerReporter.submit() skips rr trace upload for known frequent stacks"""
+    mocker.patch.object(FuzzManagerReporter, "FREQUENT_STACKS", str(tmp_path / "frequent"))
+    fake_boto3 = mocker.patch("grizzly.common.reporter.boto3", autospec=True)
+    fake_crashinfo = mocker.patch("grizzly.common.reporter.CrashInfo", autospec=True)
+    fake_collector = mocker.patch("grizzly.common.reporter.Collector", autospec=True)
+    log_path = tmp_path / "log_path"
+    (log_path / "rr-traces" / "latest-trace").mkdir(parents=True)
+    (log_path / "log_stderr.txt").touch()
+    (log_path / "log_stdout.txt").touch()
+    with (log_path / "log_asan_blah.txt").open("wb") as log_fp:
+        log_fp.write(b"    #0 0xbad000 in foo /file1.c:123:234\n")
+        log_fp.write(b"    #1 0x1337dd in bar /file2.c:1806:19")
+    sig_file = tmp_path / "fake.signature"
+    sig_file.touch()
+    S3FuzzManagerReporter._mark_frequent(Report.from_path(str(log_path)), str(sig_file))
+    callback = mocker.Mock()
+    S3FuzzManagerReporter("fake_bin").submit(str(log_path), [], callback=callback)
+    assert fake_boto3.resource.call_count == 0
+    assert fake_crashinfo.fromRawCrashData.call_count == 0
+    assert fake_collector.return_value.submit.call_count == 0
+    assert callback.call_count == 1
+    assert not log_path.is_dir()
@@ -0,0 +1,89 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+unit tests for grizzly.common.scheduler
+"""
+from .scheduler import InputStats, RandomScheduler, WeightedScheduler
+
+
+def test_random_scheduler_01():
+    """test RandomScheduler"""
+    scheduler = RandomScheduler()
+    assert scheduler.choose(["a", "b"]) in ("a", "b")
+    scheduler.record("a", duration=1.0, failure=True)
+    assert scheduler.rotation_period("a", 10) == 10
+    scheduler.close()
+
+
+def test_weighted_scheduler_01():
+    """test WeightedScheduler.record() and WeightedScheduler.energy()"""
+    scheduler = WeightedScheduler()
+    assert scheduler.energy("new") == WeightedScheduler.NEW_ENERGY
+    for _ in range(100):
+        scheduler.record("idle", duration=0.5)
+    scheduler.record("result", duration=1.0, failure=True)
+    scheduler.record("result", duration=2.0, ignored=True)
+    scheduler.record("hang", timeout=True)
+    stats = scheduler.stats["result"]
+    assert stats.iterations == 2
+    assert stats.results == 1
+    assert stats.ignored == 1
+    assert stats.mean_duration == 1.5
+    assert scheduler.stats["hang"].timeouts == 1
+    assert InputStats().mean_duration == 0
+    # inputs that produce results are preferred and idle inputs decay
+    assert scheduler.energy("result") > scheduler.energy("new") > scheduler.energy("idle")
+    assert scheduler.energy("hang") < scheduler.energy("new")
+    # weighted selection
+    scheduler.stats["idle"].iterations = 10 ** 9
+    picks = [scheduler.choose(["idle", "result"]) for _ in range(100)]
+    assert picks.count("result") > picks.count("idle")
+    # large corpus is sampled
+    WeightedScheduler.SAMPLE_SIZE = 2
+    try:
+        assert scheduler.choose(["a", "b", "c", "d"]) in ("a", "b", "c", "d")
+    finally:
+        WeightedScheduler.SAMPLE_SIZE = 1000
+
+
+def test_weighted_scheduler_02(tmp_path):
+    """test WeightedScheduler.rotation_period()"""
+    scheduler = WeightedScheduler()
+    scheduler.record("result", failure=True)
+    assert scheduler.rotation_period("result", 10) == 10
+    scheduler = WeightedScheduler(adaptive_rotation=True)
+    assert scheduler.rotation_period("new", 10) == 10
+    assert scheduler.rotation_period("new", 0) == 0
+    scheduler.record("result", failure=True)
+    assert scheduler.rotation_period("result", 10) == 20
+    for _ in range(5):
+        scheduler.record("result", failure=True)
+    assert scheduler.rotation_period("result", 10) == 10 * WeightedScheduler.MAX_ROTATION
+    scheduler.record("hang", timeout=True)
+    assert scheduler.rotation_period("hang", 10) == 5
+    assert scheduler.rotation_period("hang", 1) == 1
+
+
+def test_weighted_scheduler_03(tmp_path):
+    """test WeightedScheduler.save() and WeightedScheduler.load()"""
+    stats_file = tmp_path / "stats.json"
+    scheduler = WeightedScheduler()
+    assert not scheduler.save()
+    assert not scheduler.load()
+    scheduler = WeightedScheduler(stats_file=str(stats_file))
+    assert not scheduler.stats
+    scheduler.record("a", duration=1.0, failure=True)
+    scheduler.close()
+    assert stats_file.is_file()
+    scheduler = WeightedScheduler(stats_file=str(stats_file))
+    assert scheduler.stats["a"].iterations == 1
+    assert scheduler.stats["a"].results == 1
+    # periodic save
+    scheduler.SAVE_FREQ = 0
+    scheduler.record("b")
+    assert "b" in WeightedScheduler(stats_file=str(stats_file)).stats
+    # invalid stats file
+    stats_file.write_text(u"!")
+    assert not WeightedScheduler(stats_file=str(stats_file)).stats
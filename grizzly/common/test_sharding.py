@@ -0,0 +1,39 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+unit tests for grizzly.common.sharding
+"""
+import hashlib
+
+import pytest
+
+from .sharding import CorpusShard, WorkQueue
+
+
+def test_corpus_shard_01():
+    """test CorpusShard"""
+    shards = [CorpusShard.parse("%d/3" % (x,)) for x in range(1, 4)]
+    assert str(shards[1]) == "2/3"
+    # each digest belongs to exactly one shard
+    for i in range(100):
+        digest = hashlib.sha1(str(i).encode("ascii")).hexdigest()
+        assert sum(1 for shard in shards if digest in shard) == 1
+    assert "00000000" in CorpusShard(1, 1)
+    # invalid shards
+    for value in ("", "1", "a/2", "0/2", "3/2", "1/0", "1/2/3"):
+        with pytest.raises(ValueError):
+            CorpusShard.parse(value)
+
+def test_work_queue_01(tmp_path):
+    """test WorkQueue"""
+    queue_a = WorkQueue(str(tmp_path / "queue"))
+    queue_b = WorkQueue(str(tmp_path / "queue"))
+    assert queue_a.claim("a.html")
+    assert not queue_b.claim("a.html")
+    assert queue_b.claim("b.html")
+    # released claims can be claimed by another instance
+    queue_a.release("a.html")
+    assert queue_b.claim("a.html")
+    assert not queue_a.claim("a.html")
@@ -5,11 +5,13 @@
 # pylint: disable=protected-access
 
 import json
+import mmap
 import os
+import zipfile
 
 import pytest
 
-from .storage import InputFile, TestCase, TestFile, TestFileExists
+from .storage import archive_compression, InputFile, TestCase, TestCaseLoadFailure, TestFile, TestFileExists
 
 
 def test_testcase_01(tmp_path):
@@ -144,6 +146,131 @@ def test_testcase_06():
     finally:
         tcase.cleanup()
 
+def test_testcase_07():
+    """test TestCase.clone()"""
+    tcase = TestCase("land_page.html", "redirect.html", "test-adapter", input_fname="in.bin")
+    try:
+        tcase.duration = 1.2
+        tcase.add_environ_var("TEST_ENV", "1")
+        tcase.add_from_data("1", "testfile1.bin", required=True)
+        tcase.add_from_data("12", "testfile2.bin", required=False)
+        tcase.add_meta(TestFile.from_data("123", "meta.bin"))
+        cloned = tcase.clone()
+        tcase.cleanup()
+        try:
+            assert cloned.adapter_name == "test-adapter"
+            assert cloned.duration == 1.2
+            assert cloned.input_fname == "in.bin"
+            assert cloned.landing_page == "land_page.html"
+            assert cloned.redirect_page == "redirect.html"
+            assert list(cloned.env_vars) == ["TEST_ENV=1"]
+            assert list(cloned.optional) == ["testfile2.bin"]
+            assert cloned.data_size == 6
+            assert cloned._files.meta[0].data == b"123"
+        finally:
+            cloned.cleanup()
+    finally:
+        tcase.cleanup()
+
+def test_testcase_08(tmp_path):
+    """test TestCase.save() and TestCase.load()"""
+    tcase = TestCase("land_page.html", "redirect.html", "test-adapter", input_fname="in.bin")
+    try:
+        tcase.duration = 1.2
+        tcase.add_environ_var("TEST_ENV", "1")
+        tcase.add_from_data("1", "land_page.html", required=True)
+        tcase.add_from_data("12", "sub/testfile2.bin", required=False)
+        tcase.add_meta(TestFile.from_data("123", "prefs.js"))
+        archive = tmp_path / "test.zip"
+        tcase.save(str(archive))
+        tcase.dump(str(tmp_path / "dump"), include_details=True)
+    finally:
+        tcase.cleanup()
+    # load from archive and dumped directory
+    for src in (str(archive), str(tmp_path / "dump")):
+        loaded = TestCase.load(src)
+        try:
+            assert loaded.adapter_name == "test-adapter"
+            assert loaded.duration == 1.2
+            assert loaded.input_fname == "in.bin"
+            assert loaded.landing_page == "land_page.html"
+            assert list(loaded.env_vars) == ["TEST_ENV=1"]
+            assert list(loaded.optional) == [os.path.join("sub", "testfile2.bin")]
+            assert loaded._files.required[0].data == b"1"
+            assert loaded._files.meta[0].data == b"123"
+            assert loaded.data_size == 6
+        finally:
+            loaded.cleanup()
+    # multiple test cases in one archive
+    with zipfile.ZipFile(str(tmp_path / "multi.zip"), "w") as zip_fp:
+        for i in range(2):
+            tcase = TestCase("land_%d.html" % (i,), None, "test-adapter")
+            try:
+                tcase.add_from_data("data", "land_%d.html" % (i,))
+                tcase.write_archive(zip_fp, prefix="test-%d" % (i,))
+            finally:
+                tcase.cleanup()
+    loaded = TestCase.load(str(tmp_path / "multi.zip"), prefix="test-1")
+    try:
+        assert loaded.landing_page == "land_1.html"
+        assert loaded.data_size == 4
+    finally:
+        loaded.cleanup()
+    # directory without a manifest
+    (tmp_path / "old").mkdir()
+    (tmp_path / "old" / "test_info.json").write_text(u'{"target": "a.html"}')
+    (tmp_path / "old" / "a.html").write_bytes(b"a")
+    loaded = TestCase.load(str(tmp_path / "old"))
+    try:
+        assert loaded.data_size == 1
+    finally:
+        loaded.cleanup()
+    # invalid test cases
+    with pytest.raises(TestCaseLoadFailure, match="Failed"):
+        TestCase.load(str(tmp_path / "missing.zip"))
+    with pytest.raises(TestCaseLoadFailure, match="Missing"):
+        TestCase.load(str(tmp_path / "dump" / "sub"))
+    (tmp_path / "bad.zip").write_bytes(b"bad")
+    with pytest.raises(TestCaseLoadFailure, match="Invalid"):
+        TestCase.load(str(tmp_path / "bad.zip"))
+    (tmp_path / "old" / "test_info.json").write_text(u'{"files": {"required": ["missing.html"]}}')
+    with pytest.raises(TestCaseLoadFailure, match="Failed"):
+        TestCase.load(str(tmp_path / "old"))
+    # file names outside of the test case
+    for name in ("../a.html", "sub/../../a.html", str(tmp_path / "old" / "a.html")):
+        manifest = {"files": {"required": [name]}}
+        (tmp_path / "old" / "test_info.json").write_text(u"%s" % (json.dumps(manifest),))
+        with pytest.raises(TestCaseLoadFailure, match="Invalid file name"):
+            TestCase.load(str(tmp_path / "old"))
+
+def test_testcase_09():
+    """test TestCase.open_file()"""
+    tcase = TestCase("land_page.html", "redirect.html", "test-adapter")
+    try:
+        with tcase.open_file("land_page.html") as test_fp:
+            test_fp.write(u"f\u00f6o")
+            test_fp.write(b"bar")
+            test_fp.writelines([u"1", b"2"])
+        assert tcase._files.required[0].data == u"f\u00f6obar12".encode("utf-8")
+        # stateful encoder
+        with tcase.open_file("utf16.txt", encoding="utf-16", required=False) as test_fp:
+            test_fp.write(u"a")
+            test_fp.write(u"b")
+        assert tcase._files.optional[0].data.decode("utf-16") == u"ab"
+        # bytes only
+        with pytest.raises(TypeError, match="without an encoding"):
+            with tcase.open_file("bytes.bin", encoding=None) as test_fp:
+                test_fp.write(b"a")
+                test_fp.write(u"a")
+        # file is not added when an exception is raised
+        assert "bytes.bin" not in tcase._existing_paths
+        with pytest.raises(TestFileExists):
+            with tcase.open_file("land_page.html"):
+                pass
+        assert tcase.data_size == 15
+    finally:
+        tcase.cleanup()
+
 def test_inputfile_01():
     """test InputFile with non-existing file"""
     missing_file = os.path.join("foo", "bar", "none")
@@ -169,15 +296,96 @@ def test_inputfile_02(tmp_path):
     finally:
         in_file.close()
 
+def test_inputfile_03(tmp_path):
+    """test InputFile that cannot be mapped"""
+    tfile = tmp_path / "empty.bin"
+    tfile.touch()
+    in_file = InputFile(str(tfile))
+    try:
+        assert in_file.get_data() == b""
+        assert in_file.get_fp().read() == b""
+    finally:
+        in_file.close()
+
+def test_inputfile_04(tmp_path):
+    """test InputFile.prefetch()"""
+    for name, data in (("data.bin", b"a" * 10000), ("empty.bin", b"")):
+        (tmp_path / name).write_bytes(data)
+        in_file = InputFile(str(tmp_path / name))
+        try:
+            in_file.prefetch()
+            assert in_file._fp is not None
+            assert in_file.get_data() == data
+        finally:
+            in_file.close()
+
+def test_inputfile_05(tmp_path):
+    """test InputFile mapped file modified while in use"""
+    tfile = tmp_path / "data.bin"
+    tfile.write_bytes(b"a" * 10000)
+    in_file = InputFile(str(tfile))
+    try:
+        assert in_file.get_data() == b"a" * 10000
+        # the map is not exposed
+        in_fp = in_file.get_fp()
+        assert not isinstance(in_fp, mmap.mmap)
+        assert in_fp.read(2) == b"aa"
+        assert in_fp.tell() == 2
+        # the view is rewound by each call
+        in_fp = in_file.get_fp()
+        assert in_fp.tell() == 0
+        in_fp.close()
+        assert in_fp.seek(-2, os.SEEK_END) == 9998
+        assert in_fp.read() == b"aa"
+        assert in_file.get_data() == b"a" * 10000
+        # truncated file is copied instead of reading the map
+        tfile.write_bytes(b"b" * 10)
+        assert in_file.get_data() == b"b" * 10
+        assert not isinstance(in_file._fp, mmap.mmap)
+        assert in_file.get_fp().read() == b"b" * 10
+    finally:
+        in_file.close()
+
+def test_inputfile_06(tmp_path):
+    """test InputFile.get_fp() reading lines from a mapped file"""
+    tfile = tmp_path / "data.txt"
+    tfile.write_bytes(b"line1\nline2\nlast")
+    in_file = InputFile(str(tfile))
+    try:
+        in_fp = in_file.get_fp()
+        assert in_fp.readline(3) == b"lin"
+        assert in_fp.readline() == b"e1\n"
+        assert list(in_fp) == [b"line2\n", b"last"]
+        assert isinstance(in_file._fp, mmap.mmap)
+    finally:
+        in_file.close()
+
+def test_testcase_10(tmp_path):
+    """test TestCase.write_archive() compression"""
+    assert archive_compression("a.html") == zipfile.ZIP_DEFLATED
+    assert archive_compression("a.PNG") == zipfile.ZIP_STORED
+    assert archive_compression("a.html", zipfile.ZIP_STORED) == zipfile.ZIP_STORED
+    tcase = TestCase("land_page.html", "redirect.html", "test-adapter")
+    try:
+        tcase.add_from_data("a" * 100, "land_page.html")
+        tcase.add_from_data("b" * 100, "media/image.png")
+        with zipfile.ZipFile(str(tmp_path / "test.zip"), "w", compression=zipfile.ZIP_DEFLATED) as zip_fp:
+            tcase.write_archive(zip_fp, prefix="test")
+    finally:
+        tcase.cleanup()
+    with zipfile.ZipFile(str(tmp_path / "test.zip"), "r") as zip_fp:
+        assert zip_fp.getinfo("test/land_page.html").compress_type == zipfile.ZIP_DEFLATED
+        assert zip_fp.getinfo("test/media/image.png").compress_type == zipfile.ZIP_STORED
+
 def test_testfile_01():
     """test simple TestFile"""
     tfile = TestFile("test_file.txt")
     try:
         assert tfile.file_name == "test_file.txt"
-        assert not tfile._fp.closed
+        assert tfile._buf is not None
         assert tfile.size == 0
         tfile.close()
-        assert tfile._fp.closed
+        assert tfile._buf is None
     finally:
         tfile.close()
 
@@ -249,7 +457,7 @@ def test_testfile_06(tmp_path):
             tf2 = tf1.clone()
             tf2.write(b"test")
             assert tf1.file_name == tf2.file_name
-            assert tf1._fp != tf2._fp
+            assert tf1._buf is not tf2._buf
             tf2.dump(str(tmp_path))
             assert out_file.is_file()
             with out_file.open("r") as in_fp:
@@ -272,3 +480,53 @@ def test_testfile_07(tmp_path):
         assert tfile.data == b"foobar"
     finally:
         tfile.close()
+
+def test_testfile_08(tmp_path):
+    """test TestFile.freeze()"""
+    tfile = TestFile.from_data(b"foo", "a/test.html").freeze()
+    assert tfile.freeze() is tfile
+    clone = tfile.clone()
+    try:
+        # data is shared
+        assert clone.data is tfile.data
+        assert clone.file_name == "a/test.html"
+        assert clone.size == 3
+        clone.dump(str(tmp_path))
+        assert (tmp_path / "a" / "test.html").read_bytes() == b"foo"
+        # copy on write
+        clone.write(b"bar")
+        assert clone.data == b"foobar"
+        assert tfile.data == b"foo"
+        assert clone.clone().data == b"foobar"
+    finally:
+        clone.close()
+        tfile.close()
+
+def test_testfile_09(tmp_path, mocker):
+    """test TestFile data exceeding CACHE_LIMIT"""
+    mocker.patch.object(TestFile, "CACHE_LIMIT", 4)
+    in_file = tmp_path / "infile.txt"
+    in_file.write_bytes(b"foobar")
+    tfile = TestFile.from_file(str(in_file), "a.txt")
+    try:
+        assert tfile._buf is None
+        assert tfile._fp is not None
+        assert tfile.size == 6
+        # read data then write
+        assert tfile.data == b"foobar"
+        tfile.write(b"!")
+        assert tfile.size == 7
+        clone = tfile.clone()
+        try:
+            clone.write(b"?")
+            assert clone.data == b"foobar!?"
+            assert tfile.data == b"foobar!"
+            clone.dump(str(tmp_path))
+            assert (tmp_path / "a.txt").read_bytes() == b"foobar!?"
+            clone.freeze()
+            assert clone._fp is None
+            assert clone.size == 8
+        finally:
+            clone.close()
+    finally:
+        tfile.close()
@@ -19,13 +19,20 @@ Support for different browser can be added by the creation of a browser "puppet"
 module (see ffpuppet). TODO: Implement generic "puppet" support.
 """
 
+import hashlib
+import itertools
 import logging
 import os
+import tempfile
+
+import fasteners
 
 import grizzly.adapters
 from .args import GrizzlyArgs
-from .common import FilesystemReporter, FuzzManagerReporter, IOManager, S3FuzzManagerReporter
-from .session import Session
+from .common import (ContentStore, CorpusShard, FilesystemReporter, FuzzManagerReporter, IOManager,
+                     ReportQueue, S3FuzzManagerReporter, TestFile, WeightedScheduler, WorkQueue)
+from .replay import ParallelReplay, ReplaySummary
+from .session import AdaptiveTimeout, RelaunchScheduler, Session
 from .target import load as load_target, TargetLaunchError, TargetLaunchTimeout
 
 
@@ -51,6 +58,39 @@ def console_main():
     return main(GrizzlyArgs().parse_args())
 
 
+def claim_checkpoint(args):
+    """Find and lock the checkpoint file used by this instance. The same command line
+    maps to the same set of checkpoint files and each instance running at the same
+    time is given the first checkpoint file that is not in use.
+
+    Args:
+        args (argparse.Namespace): Arguments.
+
+    Returns:
+        tuple(str, fasteners.InterProcessLock): Checkpoint file and the lock held
+                                                until the instance exits, or
+                                                (None, None) if the given checkpoint
+                                                file is in use.
+    """
+    if args.checkpoint is not None:
+        candidates = (os.path.abspath(args.checkpoint),)
+    else:
+        key = "\n".join((
+            args.adapter.lower(),
+            os.path.abspath(args.binary),
+            os.path.abspath(args.input) if args.input else "",
+            args.shard or ""))
+        prefix = os.path.join(
+            args.working_path or tempfile.gettempdir(),
+            "grz_checkpoint_%s" % (hashlib.sha1(key.encode("utf-8")).hexdigest()[:16],))
+        candidates = ("%s_%d.json" % (prefix, instance) for instance in itertools.count())
+    for checkpoint in candidates:
+        lock = fasteners.InterProcessLock("%s.lock" % (checkpoint,))
+        if lock.acquire(blocking=False):
+            return checkpoint, lock
+    return None, None
+
+
 def main(args):
     # NOTE: grizzly.reduce.reduce.main mirrors this pretty closely
     #       please check if updates here should go there too
@@ -68,17 +108,64 @@ def main(args):
         log.info("Running with Valgrind. This will be SLOW!")
     if args.rr:
         log.info("Running with RR")
+        FilesystemReporter.RR_CODEC = args.rr_codec
+
+    if args.workers > 1:
+        if grizzly.adapters.get(args.adapter).ROTATION_PERIOD:
+            log.error("--workers requires an adapter that runs in SINGLE PASS mode")
+            return Session.EXIT_ERROR
+        return ParallelReplay(args, args.workers).run(main)
 
     adapter = None
+    checkpoint_lock = None
     iomanager = None
+    outbox = None
+    reporter = None
     session = None
+    summary = None
     target = None
     try:
+        # cached test cases are only dumped again by the FilesystemReporter
+        # (FuzzManager reporters write archives)
+        dump_cached = args.cache > 0 and not (args.fuzzmanager or args.s3_fuzzmanager)
+        if dump_cached or args.repeat > 1:
+            # test cases are dumped more than once, link test files from the content
+            # store instead of copying them (a single dump is cheaper without the store)
+            log.debug("using content store")
+            TestFile.STORE = ContentStore(tempfile.mkdtemp(prefix="grz_store_", dir=args.working_path))
+
+        # the corpus index and input statistics are reused by later runs using the same input
+        corpus_key = hashlib.sha1(os.path.abspath(args.input or "").encode("utf-8")).hexdigest()[:16]
+        corpus_prefix = os.path.join(
+            args.working_path or tempfile.gettempdir(), "grz_corpus_%s" % (corpus_key,))
+        if args.scheduler == "weighted":
+            log.info("Using weighted input scheduling")
+            scheduler = WeightedScheduler(
+                stats_file=("%s.stats.json" % (corpus_prefix,)) if args.input else None,
+                adaptive_rotation=args.adaptive_rotation)
+        else:
+            scheduler = None
+        if args.shard is not None:
+            shard = CorpusShard.parse(args.shard)
+            log.info("Using corpus shard %s", shard)
+        else:
+            shard = None
+        if args.shard_queue is not None:
+            log.info("Claiming input files using %r", args.shard_queue)
+            work_queue = WorkQueue(args.shard_queue)
+        else:
+            work_queue = None
+
         log.debug("initializing the IOManager")
         iomanager = IOManager(
             report_size=(max(args.cache, 0) + 1),
             mime_type=args.mime,
-            working_path=args.working_path)
+            working_path=args.working_path,
+            scheduler=scheduler,
+            memory_limit=args.cache_limit * 1048576,
+            shard=shard,
+            work_queue=work_queue,
+            repeat=args.repeat)
 
         log.debug("initializing Adapter %r", args.adapter)
         adapter = grizzly.adapters.get(args.adapter)()
@@ -91,17 +178,26 @@ def main(args):
             iomanager.scan_input(
                 args.input,
                 accepted_extensions=args.accepted_extensions,
-                sort=adapter.ROTATION_PERIOD == 0)
+                sort=adapter.ROTATION_PERIOD == 0,
+                index_file="%s.json" % (corpus_prefix,))
         log.info("Found %d input files(s)", len(iomanager.input_files))
 
         if adapter.ROTATION_PERIOD == 0:
             log.info("Running in SINGLE PASS mode")
+            if args.repeat > 1:
+                log.info("Each input file will be used %d times (min crashes: %d)",
+                         args.repeat, args.min_crashes)
+            summary = ReplaySummary(min_crashes=args.min_crashes)
         elif args.coverage:
             log.info("Running in COVERAGE mode")
             # cover as many test cases as possible
             adapter.ROTATION_PERIOD = 1
         else:
             log.info("Running in FUZZING mode")
+        if work_queue is not None and adapter.ROTATION_PERIOD:
+            log.warning("--shard-queue is only used in SINGLE PASS mode")
+        if args.repeat > 1 and adapter.ROTATION_PERIOD:
+            log.warning("--repeat is only used in SINGLE PASS mode")
 
         if adapter.RELAUNCH > 0:
             log.debug("relaunch (%d) set in Adapter", adapter.RELAUNCH)
@@ -109,43 +205,91 @@ def main(args):
         else:
             relaunch = args.relaunch
 
+        def create_target():
+            new_target = load_target(args.platform)(
+                args.binary,
+                args.extension,
+                args.launch_timeout,
+                args.log_limit,
+                args.memory,
+                args.prefs,
+                relaunch,
+                rr=args.rr,
+                valgrind=args.valgrind,
+                xvfb=args.xvfb)
+            if args.soft_asserts:
+                new_target.add_abort_token("###!!! ASSERTION:")
+            return new_target
+
         log.debug("initializing the Target")
-        target = load_target(args.platform)(
-            args.binary,
-            args.extension,
-            args.launch_timeout,
-            args.log_limit,
-            args.memory,
-            args.prefs,
-            relaunch,
-            rr=args.rr,
-            valgrind=args.valgrind,
-            xvfb=args.xvfb)
+        target = create_target()
         adapter.monitor = target.monitor
-        if args.soft_asserts:
-            target.add_abort_token("###!!! ASSERTION:")
+        if args.standby:
+            log.info("Using standby targets")
 
         log.debug("calling adapter setup()")
         adapter.setup(iomanager.server_map)
         log.debug("configuring harness")
         iomanager.harness = adapter.get_harness()
+        if adapter.BATCH_SIZE > 1:
+            if iomanager.harness is None:
+                raise RuntimeError("Adapter BATCH_SIZE (%d) requires a harness" % (adapter.BATCH_SIZE,))
+            log.info("Serving %d test cases per iteration", adapter.BATCH_SIZE)
 
         log.debug("initializing the Reporter")
+        if args.outbox is not None:
+            log.info("FuzzManager submissions will be staged in %r", args.outbox)
+            outbox = FuzzManagerReporter.create_outbox(args.outbox)
         if args.fuzzmanager:
             log.info("Results will be reported via FuzzManager")
-            reporter = FuzzManagerReporter(args.binary, tool=args.tool)
+            reporter = FuzzManagerReporter(
+                args.binary,
+                tool=args.tool,
+                outbox=outbox,
+                working_path=args.working_path)
         elif args.s3_fuzzmanager:
             log.info("Results will be reported via FuzzManager w/ large attachments in S3")
-            reporter = S3FuzzManagerReporter(args.binary, tool=args.tool)
+            reporter = S3FuzzManagerReporter(
+                args.binary,
+                tool=args.tool,
+                outbox=outbox,
+                working_path=args.working_path)
         else:
             reporter = FilesystemReporter()
             log.info("Results will be stored in %r", reporter.report_path)
+        if args.report_queue > 0:
+            log.info("Results will be submitted in the background (queue size: %d)", args.report_queue)
+            reporter = ReportQueue(reporter, max_size=args.report_queue, working_path=args.working_path)
+
+        # progress is recorded by the work queue when it is used
+        checkpoint = None
+        if (args.resume or args.checkpoint is not None) and work_queue is None:
+            checkpoint, checkpoint_lock = claim_checkpoint(args)
+            if checkpoint is None:
+                log.error("Checkpoint %r is in use by another instance", args.checkpoint)
+                return Session.EXIT_ERROR
+            log.info("Saving progress to %r", checkpoint)
 
         log.debug("initializing the Session")
         if bool(os.getenv("DEBUG")):
             display_mode = Session.DISPLAY_VERBOSE
         else:
             display_mode = Session.DISPLAY_NORMAL
+        if args.adaptive_timeout:
+            log.info("Using adaptive timeout (limit: %ds)", args.timeout)
+            adaptive_timeout = AdaptiveTimeout(
+                adapter.TEST_DURATION,
+                args.timeout,
+                min_duration=adapter.MIN_TEST_DURATION,
+                adjust_timeout="timeout" in args.ignore)
+        else:
+            adaptive_timeout = None
+        if args.adaptive_relaunch:
+            log.info("Using adaptive relaunch (limit: %d)", relaunch)
+            # relaunch before memory growth approaches the memory limit
+            relaunch_scheduler = RelaunchScheduler(rss_limit=target.memory_limit // 2)
+        else:
+            relaunch_scheduler = None
         session = Session(
             adapter,
             args.coverage,
@@ -153,7 +297,14 @@ def main(args):
             iomanager,
             reporter,
             target,
-            display_mode=display_mode)
+            display_mode=display_mode,
+            adaptive_timeout=adaptive_timeout,
+            relaunch_scheduler=relaunch_scheduler,
+            target_factory=create_target if args.standby else None,
+            checkpoint=checkpoint,
+            summary=summary)
+        if checkpoint is not None:
+            session.load_checkpoint()
 
         session.config_server(args.timeout)
         target.reverse(session.server.get_port(), session.server.get_port())
@@ -168,7 +319,18 @@ def main(args):
 
     finally:
         log.warning("Shutting down...")
+        if isinstance(reporter, ReportQueue):
+            reporter.close()
+        if outbox is not None:
+            # submissions that are not complete are resumed by the next run
+            outbox.close(timeout=60)
+        if summary is not None and summary.inputs:
+            summary.report()
+            if args.replay_summary is not None:
+                summary.save(args.replay_summary)
         if session is not None:
+            # the active target may have been replaced by a standby target
+            target = session.target
             session.close()
         if target is not None:
             target.cleanup()
@@ -176,5 +338,10 @@ def main(args):
             adapter.cleanup()
         if iomanager is not None:
             iomanager.cleanup()
+        if TestFile.STORE is not None:
+            TestFile.STORE.cleanup()
+            TestFile.STORE = None
+        if checkpoint_lock is not None:
+            checkpoint_lock.release()
 
     return Session.EXIT_SUCCESS
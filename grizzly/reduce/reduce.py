@@ -947,8 +947,8 @@ class ReductionJob(object):
                 harness = harness.replace("'/next_test'", "_reduce_next()")
                 # insert the close condition. we are iterating over the array of landing pages,
                 # undefined means we hit the end and the harness should close
-                # newer harness uses conditional operator in open() call
-                if re.search(r'open\(.*_reduce_next\(\)\s*:\s*_reduce_next\(\)', harness) is None:
+                # newer harness selects the test to open() using if/else statements
+                if len(re.findall(r'\bnext\s*=\s*_reduce_next\(\)', harness)) != 2:
                     raise ReducerError("Unable to insert finish condition, please update pattern "
                                        "to match harness!")
                 # insert the landing page loop
@@ -0,0 +1,238 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+__all__ = ("ParallelReplay", "ReplaySummary")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+
+log = logging.getLogger("grizzly")  # pylint: disable=invalid-name
+
+
+class ReplaySummary(object):
+    """ReplaySummary collects the outcome of each run of each input file when
+    replaying a corpus (SINGLE PASS mode). An input file is considered reproduced
+    when the number of results is at least min_crashes.
+    """
+    def __init__(self, min_crashes=1):
+        assert min_crashes > 0
+        self._lock = threading.Lock()  # add_signature() can be called by a worker thread
+        self.inputs = dict()
+        self.min_crashes = min_crashes
+
+    def _entry(self, file_name):
+        entry = self.inputs.get(file_name)
+        if entry is None:
+            entry = self.inputs[file_name] = {
+                "crashes": 0,
+                "duration": 0.0,
+                "ignored": 0,
+                "runs": 0,
+                "signatures": dict(),
+                "timeouts": 0}
+        return entry
+
+    def add_signature(self, file_name, signature):
+        """Record the signature of a result once it has been reported. This is
+        called separately from record() because reports can be submitted in the
+        background (see ReportQueue).
+
+        Args:
+            file_name (str): Path to input file.
+            signature (str): Major stack hash of the result.
+
+        Returns:
+            None
+        """
+        if file_name is None or signature is None:
+            return
+        with self._lock:
+            signatures = self._entry(file_name)["signatures"]
+            signatures[signature] = signatures.get(signature, 0) + 1
+
+    @classmethod
+    def load(cls, path, min_crashes=1):
+        """Load a summary created by save().
+
+        Args:
+            path (str): File to load.
+            min_crashes (int): Results required to consider an input reproduced.
+
+        Returns:
+            ReplaySummary: Loaded summary.
+        """
+        summary = cls(min_crashes=min_crashes)
+        with open(path, "r") as in_fp:
+            data = json.load(in_fp)
+        for file_name, entry in data["inputs"].items():
+            summary._entry(file_name).update(
+                (k, v) for k, v in entry.items() if k not in ("mean_duration", "reproduced"))
+        return summary
+
+    def merge(self, other):
+        """Add the results collected by another ReplaySummary.
+
+        Args:
+            other (ReplaySummary): Summary to add.
+
+        Returns:
+            None
+        """
+        for file_name, src in other.inputs.items():
+            dst = self._entry(file_name)
+            for key in ("crashes", "duration", "ignored", "runs", "timeouts"):
+                dst[key] += src[key]
+            for signature, count in src["signatures"].items():
+                dst["signatures"][signature] = dst["signatures"].get(signature, 0) + count
+
+    def record(self, file_name, duration=None, failure=False, ignored=False, timeout=False):
+        """Record the outcome of a run.
+
+        Args:
+            file_name (str): Path to input file.
+            duration (float): Time spent running the test case.
+            failure (bool): A result was detected.
+            ignored (bool): An ignored result was detected.
+            timeout (bool): The test case timed out.
+
+        Returns:
+            None
+        """
+        if file_name is None:
+            return
+        with self._lock:
+            entry = self._entry(file_name)
+            entry["runs"] += 1
+            if duration is not None:
+                entry["duration"] += duration
+            if failure:
+                entry["crashes"] += 1
+            if ignored:
+                entry["ignored"] += 1
+            if timeout:
+                entry["timeouts"] += 1
+
+    def report(self):
+        """Log the inputs that reproduced a result.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        reproduced = sorted(x for x in self.inputs if self.reproduced(x))
+        log.info("Replay summary: %d of %d input(s) reproduced a result", len(reproduced), len(self.inputs))
+        for file_name in reproduced:
+            entry = self.inputs[file_name]
+            log.info(
+                "%s: %d/%d, signature(s): %s",
+                file_name,
+                entry["crashes"],
+                entry["runs"],
+                ", ".join(sorted(entry["signatures"])) or "unknown")
+
+    def reproduced(self, file_name):
+        """Check if an input file reproduced a result.
+
+        Args:
+            file_name (str): Path to input file.
+
+        Returns:
+            bool: True if the number of results is at least min_crashes otherwise False.
+        """
+        entry = self.inputs.get(file_name)
+        return entry is not None and entry["crashes"] >= self.min_crashes
+
+    def save(self, path):
+        """Write the summary to a JSON file.
+
+        Args:
+            path (str): Destination file.
+
+        Returns:
+            None
+        """
+        inputs = dict()
+        for file_name, entry in self.inputs.items():
+            inputs[file_name] = dict(entry)
+            inputs[file_name]["mean_duration"] = entry["duration"] / entry["runs"] if entry["runs"] else None
+            inputs[file_name]["reproduced"] = self.reproduced(file_name)
+        # write to a temporary file and rename to avoid leaving a partial summary
+        tmp_file = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_file, "w") as out_fp:
+            json.dump({"inputs": inputs, "min_crashes": self.min_crashes}, out_fp, indent=2, sort_keys=True)
+        os.rename(tmp_file, path)
+
+
+def _run_worker(main_fn, args):
+    sys.exit(main_fn(args))
+
+
+class ParallelReplay(object):
+    """ParallelReplay replays a corpus (SINGLE PASS mode) using multiple worker
+    processes, each with its own target, server and test case history. Input files
+    are divided dynamically using a shared WorkQueue. The summaries created by the
+    workers are merged once all the workers have exited.
+    """
+    def __init__(self, args, workers):
+        assert workers > 1
+        self.args = args
+        self.workers = workers
+
+    def run(self, main_fn):
+        """Launch the workers and wait for them to complete.
+
+        Args:
+            main_fn (callable): Called with the arguments of a worker, returns exit code.
+
+        Returns:
+            int: Exit code of the first worker that failed otherwise 0.
+        """
+        working = tempfile.mkdtemp(prefix="grz_replay_", dir=self.args.working_path)
+        try:
+            procs = list()
+            for worker in range(self.workers):
+                worker_args = copy.copy(self.args)
+                if self.args.outbox is not None:
+                    # an outbox can only be used by one process
+                    worker_args.outbox = os.path.join(self.args.outbox, "worker_%d" % (worker,))
+                worker_args.replay_summary = os.path.join(working, "summary_%d.json" % (worker,))
+                worker_args.shard_queue = self.args.shard_queue or os.path.join(working, "queue")
+                worker_args.workers = 1
+                proc = multiprocessing.Process(target=_run_worker, args=(main_fn, worker_args))
+                proc.start()
+                procs.append(proc)
+            log.info("Replaying using %d workers", self.workers)
+            exit_code = 0
+            for proc in procs:
+                try:
+                    proc.join()
+                except KeyboardInterrupt:
+                    # workers receive the interrupt and shutdown
+                    proc.join()
+                if not exit_code:
+                    exit_code = proc.exitcode
+            # merge the summaries created by the workers
+            summary = ReplaySummary(min_crashes=self.args.min_crashes)
+            for worker in range(self.workers):
+                summary_file = os.path.join(working, "summary_%d.json" % (worker,))
+                if os.path.isfile(summary_file):
+                    summary.merge(ReplaySummary.load(summary_file))
+            summary.report()
+            if self.args.replay_summary is not None:
+                summary.save(self.args.replay_summary)
+            return exit_code
+        finally:
+            shutil.rmtree(working, ignore_errors=True)
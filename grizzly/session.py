@@ -3,10 +3,14 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from collections import deque
+from functools import partial
+import json
 import logging
 import os
 import shutil
 import tempfile
+import threading
 import time
 
 import sapphire
@@ -14,7 +18,7 @@ from .common import Status, TestFile
 from .target import TargetLaunchError, TargetLaunchTimeout
 
 
-__all__ = ("LogOutputLimiter", "Session")
+__all__ = ("AdaptiveTimeout", "LogOutputLimiter", "RelaunchScheduler", "Session", "StandbyTarget")
 __author__ = "Tyson Smith"
 __credits__ = ["Tyson Smith", "Jesse Schwartzentruber"]
 
@@ -22,6 +26,107 @@ __credits__ = ["Tyson Smith", "Jesse Schwartzentruber"]
 log = logging.getLogger("grizzly")  # pylint: disable=invalid-name
 
 
+class AdaptiveTimeout(object):
+    """AdaptiveTimeout calculates the harness time limit and the iteration (server)
+    timeout from the distribution of recent test case durations. A high percentile
+    plus a margin is used. Each timeout increases a backoff multiplier that decays
+    as tests complete. The time limit is kept between the minimum and the maximum
+    test duration declared by the adapter and the iteration timeout never exceeds
+    the configured timeout.
+    """
+    BACKOFF_DECAY = 0.95  # applied to the backoff multiplier when a test completes
+    BACKOFF_LIMIT = 4.0  # maximum backoff multiplier
+    MARGIN = 5.0  # seconds added to calculated values
+    MIN_SAMPLES = 20  # samples required before limits are adjusted
+    PERCENTILE = 95
+    WINDOW = 200  # number of recent durations tracked
+
+    def __init__(self, test_duration, timeout, min_duration=1, adjust_timeout=True):
+        assert min_duration > 0
+        assert test_duration < timeout
+        self._adjust_timeout = adjust_timeout  # allow the iteration timeout to be reduced
+        self._backoff = 1.0
+        self._durations = deque(maxlen=self.WINDOW)
+        self._min_duration = min(min_duration, test_duration)
+        self._test_duration = test_duration
+        self._timeout = timeout
+
+    def _estimate(self):
+        if len(self._durations) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(self._durations)
+        idx = min(len(ordered) * self.PERCENTILE // 100, len(ordered) - 1)
+        return ordered[idx] * self._backoff + self.MARGIN
+
+    def completed(self, duration):
+        """Record the duration of a test case that did not time out.
+
+        Args:
+            duration (float): Number of seconds the test case took to run.
+
+        Returns:
+            None
+        """
+        self._durations.append(duration)
+        self._backoff = max(self._backoff * self.BACKOFF_DECAY, 1.0)
+
+    def expired(self):
+        """Record an iteration timeout.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._backoff = min(self._backoff * 1.5, self.BACKOFF_LIMIT)
+        log.debug("adaptive timeout backoff: %0.2f", self._backoff)
+
+    @property
+    def time_limit(self):
+        """Number of seconds the harness allows each test case to run.
+
+        Args:
+            None
+
+        Returns:
+            float: Test case time limit.
+        """
+        estimate = self._estimate()
+        if estimate is None:
+            return self._test_duration
+        return max(self._min_duration, min(self._test_duration, estimate))
+
+    @property
+    def timeout(self):
+        """Number of seconds to wait for a test case to be served before timing out.
+
+        Args:
+            None
+
+        Returns:
+            float: Iteration timeout.
+        """
+        if not self._adjust_timeout or self._estimate() is None:
+            return self._timeout
+        return min(self._timeout, self.time_limit + self.MARGIN)
+
+    def timeout_for(self, time_limit):
+        """Iteration timeout to use with a target that was launched using time_limit.
+        The harness time limit is fixed when the target is launched so the iteration
+        timeout is not reduced below it, otherwise the server could time out first.
+
+        Args:
+            time_limit (float): Harness time limit used by the running target.
+
+        Returns:
+            float: Iteration timeout.
+        """
+        if time_limit is None:
+            return self.timeout
+        return max(self.timeout, min(self._timeout, time_limit + self.MARGIN))
+
+
 class LogOutputLimiter(object):
     def __init__(self, delay=300, delta_multiplier=2, verbose=False):
         self._delay = delay  # maximum time delay between output
@@ -49,50 +154,228 @@ class LogOutputLimiter(object):
         return ready
 
 
+class RelaunchScheduler(object):
+    """RelaunchScheduler decides when the Target should be relaunched to maximize
+    the number of iterations performed per hour. The cost of a launch is amortized
+    over the iterations performed by the Target. Once the (smoothed) duration of an
+    iteration exceeds the average cost of an iteration in the current launch cycle
+    (launch time included) it is cheaper to relaunch. The fixed relaunch count
+    (Target.rl_reset) is still used as an upper bound.
+    """
+    MIN_ITERATIONS = 10  # iterations performed before a decision is made
+    SMOOTHING = 0.2  # weight of the most recent sample in the moving average
+
+    def __init__(self, rss_limit=0):
+        self._cycle_time = 0.0  # total time spent in the current launch cycle
+        self._iterations = 0  # iterations performed since launch
+        self._launch_time = None  # duration of the most recent launch
+        self._recent = None  # moving average of iteration duration
+        self._rss_base = None  # memory usage after the first iteration
+        self._rss_limit = rss_limit  # maximum memory growth since launch (0 = no limit)
+
+    @property
+    def average(self):
+        """Average cost of an iteration in the current launch cycle including the launch.
+
+        Args:
+            None
+
+        Returns:
+            float: Average number of seconds per iteration.
+        """
+        if not self._iterations:
+            return None
+        return self._cycle_time / self._iterations
+
+    def launched(self, duration):
+        """Record a Target launch and begin a new launch cycle.
+
+        Args:
+            duration (float): Number of seconds it took to launch the Target.
+
+        Returns:
+            None
+        """
+        log.debug("relaunch scheduler: launch took %0.2fs", duration)
+        self._cycle_time = duration
+        self._iterations = 0
+        self._launch_time = duration
+        self._recent = None
+        self._rss_base = None
+
+    def update(self, duration, rss):
+        """Record an iteration and check if relaunching the Target is recommended.
+
+        Args:
+            duration (float): Number of seconds the iteration took.
+            rss (int): Current memory usage of the Target in bytes.
+
+        Returns:
+            bool: True if the Target should be relaunched otherwise False.
+        """
+        if self._launch_time is None:
+            # launch cost is unknown
+            return False
+        self._cycle_time += duration
+        self._iterations += 1
+        if self._recent is None:
+            self._recent = duration
+        else:
+            self._recent += self.SMOOTHING * (duration - self._recent)
+        if self._rss_base is None:
+            self._rss_base = rss
+        elif self._rss_limit and rss - self._rss_base > self._rss_limit:
+            log.info(
+                "Relaunching after %d iterations, memory usage grew %0.1fMB (limit %0.1fMB)",
+                self._iterations,
+                (rss - self._rss_base) / 1048576.0,
+                self._rss_limit / 1048576.0)
+            return True
+        if self._iterations < self.MIN_ITERATIONS:
+            return False
+        if self._recent > self.average:
+            log.info(
+                "Relaunching after %d iterations, iteration %0.3fs > average %0.3fs (launch %0.2fs)",
+                self._iterations,
+                self._recent,
+                self.average,
+                self._launch_time)
+            return True
+        return False
+
+
+class StandbyTarget(object):
+    """StandbyTarget launches a Target in the background while the active Target is
+    still in use. Each standby Target has a dedicated server (port) and the Target
+    creates its own profile and logs. The launch is complete once the Target has
+    loaded the bootstrap page, it then waits for the server to begin serving.
+    """
+    __slots__ = ("error", "launch_time", "server", "target", "time_limit", "_thread")
+
+    def __init__(self, target, server, time_limit=None):
+        self._thread = None
+        self.error = None  # exception raised by Target.launch()
+        self.launch_time = None  # time spent in Target.launch()
+        self.server = server
+        self.target = target
+        self.time_limit = time_limit  # harness time limit passed to the target
+
+    def _launch(self, location):
+        start_time = time.time()
+        try:
+            self.target.launch(location)
+        except (TargetLaunchError, TargetLaunchTimeout) as exc:
+            self.error = exc
+        finally:
+            self.launch_time = time.time() - start_time
+
+    def cleanup(self):
+        """Wait for the launch to complete and remove all resources.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.wait()
+        self.target.cleanup()
+        self.server.close()
+
+    def launch(self, location):
+        """Launch the Target in a background thread.
+
+        Args:
+            location (str): URL to open.
+
+        Returns:
+            None
+        """
+        assert self._thread is None
+        self._thread = threading.Thread(target=self._launch, args=(location,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait(self):
+        """Wait for the launch to complete.
+
+        Args:
+            None
+
+        Returns:
+            float: Number of seconds spent waiting.
+        """
+        start_time = time.time()
+        if self._thread is not None:
+            self._thread.join()
+        return time.time() - start_time
+
+
 class Session(object):
+    CHECKPOINT_FREQ = 60  # minimum number of seconds between checkpoints
     DISPLAY_VERBOSE = 0  # display status every iteration
     DISPLAY_NORMAL = 1  # quickly reduce the amount of output
     EXIT_SUCCESS = 0
     EXIT_ERROR = 1
     EXIT_ABORT = 3
     EXIT_LAUNCH_FAILURE = 7
+    STANDBY_LEAD = 10  # iterations before a scheduled relaunch to launch the standby target
     TARGET_LOG_SIZE_WARN = 0x1900000  # display warning when target log files exceed limit (25MB)
 
-    def __init__(self, adapter, coverage, ignore, iomanager, reporter, target, display_mode=DISPLAY_NORMAL):
+    def __init__(self, adapter, coverage, ignore, iomanager, reporter, target, display_mode=DISPLAY_NORMAL,
+                 adaptive_timeout=None, relaunch_scheduler=None, target_factory=None, checkpoint=None,
+                 summary=None):
+        self._checkpoint_time = time.time()  # time of last checkpoint
+        self._launches = 0  # number of successful target launches
         self._lol = LogOutputLimiter(verbose=display_mode == self.DISPLAY_VERBOSE)
+        self._prefs = None  # prefs file path and shared TestFile
+        self._standby = None  # target launched in the background
+        self._time_limit = None  # harness time limit the active target was launched with
         self.adapter = adapter
+        self.adaptive_timeout = adaptive_timeout
+        self.checkpoint = checkpoint  # file used to save progress
         self.coverage = coverage
         self.ignore = ignore
         self.iomanager = iomanager
+        self.relaunch_scheduler = relaunch_scheduler
         self.reporter = reporter
         self.server = None
         self.status = Status.start()
+        self.summary = summary  # ReplaySummary, outcome of each test case (SINGLE PASS mode)
         self.target = target
+        self.target_factory = target_factory  # used to create standby targets
 
-    def check_results(self, unserved, was_timeout):
+    def check_results(self, unserved, was_timeout, input_fname=None):
         # attempt to detect a failure
         failure_detected = self.target.detect_failure(self.ignore, was_timeout)
         if unserved and self.adapter.IGNORE_UNSERVED:
-            # if nothing was served remove most recent
-            # test case from list to help maintain browser/fuzzer sync
-            log.info("Ignoring test case since nothing was served")
-            self.iomanager.tests.pop().cleanup()
+            # remove the most recent test case(s) that were not served
+            # from the list to help maintain browser/fuzzer sync
+            log.info("Ignoring %d test case(s) since they were not served", unserved)
+            for _ in range(unserved):
+                self.iomanager.tests.pop().cleanup()
         # handle failure if detected
         if failure_detected == self.target.RESULT_FAILURE:
             self.status.results += 1
             log.info("Result detected")
-            self.report_result()
+            self.report_result(input_fname=input_fname)
         elif failure_detected == self.target.RESULT_IGNORED:
             self.status.ignored += 1
             log.info("Ignored (%d)", self.status.ignored)
+        return failure_detected
+
+    def clear_checkpoint(self):
+        if self.checkpoint is not None and os.path.isfile(self.checkpoint):
+            log.debug("removing checkpoint %r", self.checkpoint)
+            os.remove(self.checkpoint)
 
     def config_server(self, iteration_timeout):
         assert self.server is None
         log.debug("starting sapphire server")
         # have client error pages (code 4XX) call window.close() after a few seconds
         sapphire.Sapphire.CLOSE_CLIENT_ERROR = 1
-        # launch http server used to serve test cases
-        self.server = sapphire.Sapphire(timeout=iteration_timeout)
+        # launch http server used to serve test cases (the timeout covers the whole batch)
+        self.server = sapphire.Sapphire(timeout=iteration_timeout * self.adapter.BATCH_SIZE)
         def _dyn_resp_close():
             self.target.close()
             return b"<h1>Close Browser</h1>"
@@ -103,6 +386,12 @@ class Session(object):
 
     def close(self):
         self.status.cleanup()
+        if self._prefs is not None:
+            self._prefs[1].close()
+            self._prefs = None
+        if self._standby is not None:
+            self._standby.cleanup()
+            self._standby = None
         if self.server is not None:
             self.server.close()
 
@@ -115,19 +404,27 @@ class Session(object):
                 len(self.iomanager.input_files),
                 self.status.results,
                 os.path.basename(self.status.test_name))
-        elif self._lol.ready(self.status.iteration, self.target.monitor.launches):
+        elif self._lol.ready(self.status.iteration, self._launches):
             if self.status.test_name:
                 log.debug("fuzzing: %s", os.path.basename(self.status.test_name))
             log.info("I%04d-R%02d ", self.status.iteration, self.status.results)
 
-    def generate_testcase(self):
+    def generate_testcase(self, batch_index=0):
         assert self.server is not None
         log.debug("calling iomanager.create_testcase()")
-        test = self.iomanager.create_testcase(self.adapter.NAME, rotation_period=self.adapter.ROTATION_PERIOD)
+        test = self.iomanager.create_testcase(
+            self.adapter.NAME,
+            rotation_period=self.adapter.ROTATION_PERIOD,
+            batch_index=batch_index)
         log.debug("calling self.adapter.generate()")
         self.adapter.generate(test, self.iomanager.active_input, self.iomanager.server_map)
         if self.target.prefs is not None:
-            test.add_meta(TestFile.from_file(self.target.prefs, "prefs.js"))
+            # read the prefs file once and share it with every test case
+            if self._prefs is None or self._prefs[0] != self.target.prefs:
+                if self._prefs is not None:
+                    self._prefs[1].close()
+                self._prefs = (self.target.prefs, TestFile.from_file(self.target.prefs, "prefs.js").freeze())
+            test.add_meta(self._prefs[1].clone())
         return test
 
     def launch_target(self):
@@ -136,6 +433,8 @@ class Session(object):
         while True:
             try:
                 log.info("Launching target")
+                launch_start = time.time()
+                self._time_limit = self.time_limit
                 self.target.launch(self.location)
             except TargetLaunchError:
                 # this result likely has nothing to do with Grizzly
@@ -152,28 +451,150 @@ class Session(object):
                     continue
                 raise
             break
+        self._launches += 1
+        if self.adaptive_timeout is not None:
+            self._set_server_timeout()
+        if self.relaunch_scheduler is not None:
+            self.relaunch_scheduler.launched(time.time() - launch_start)
+
+    def launch_standby(self):
+        assert self._standby is None
+        assert self.target_factory is not None
+        log.debug("launching standby target")
+        server = sapphire.Sapphire(timeout=self.server.timeout)
+        target = self.target_factory()
+        target.reverse(server.get_port(), server.get_port())
+        self.adapter.pre_launch()
+        self._standby = StandbyTarget(target, server, time_limit=self.time_limit)
+        self._standby.launch(self._location(server))
+
+    def load_checkpoint(self):
+        """Restore progress saved by a previous session using the same checkpoint file.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if a checkpoint was loaded otherwise False.
+        """
+        assert self.checkpoint is not None
+        if not os.path.isfile(self.checkpoint):
+            log.warning("Checkpoint %r does not exist", self.checkpoint)
+            return False
+        try:
+            with open(self.checkpoint, "r") as in_fp:
+                data = json.load(in_fp)
+        except ValueError:
+            log.warning("Checkpoint %r is invalid", self.checkpoint)
+            return False
+        if data.get("adapter") != self.adapter.NAME:
+            log.warning("Checkpoint was created by adapter %r", data.get("adapter"))
+            return False
+        self.iomanager.load_state(data["iomanager"], rotation_period=self.adapter.ROTATION_PERIOD)
+        self.status.ignored = data["status"]["ignored"]
+        self.status.iteration = data["status"]["iteration"]
+        self.status.results = data["status"]["results"]
+        # exclude the time between sessions
+        self.status.start_time = time.time() - data["status"]["duration"]
+        if data.get("fuzz") is not None:
+            self.adapter.fuzz.update(data["fuzz"])
+        log.info("Resuming from checkpoint (iteration: %d, results: %d)",
+                 self.status.iteration, self.status.results)
+        return True
 
     @property
     def location(self):
         assert self.server is not None
-        location = ["http://127.0.0.1:%d/" % self.server.get_port(), self.iomanager.landing_page()]
+        return self._location(self.server)
+
+    def _location(self, server):
+        location = ["http://127.0.0.1:%d/" % server.get_port(), self.iomanager.landing_page()]
         if self.iomanager.harness is not None:
-            location.append("?timeout=%d" % (self.adapter.TEST_DURATION * 1000))
-            location.append("&close_after=%d" % self.target.rl_reset)
+            location.append("?timeout=%d" % (self.time_limit * 1000))
+            if self.adapter.BATCH_SIZE > 1:
+                location.append("&batch=%d" % self.adapter.BATCH_SIZE)
+            # the harness counts test cases not iterations
+            location.append("&close_after=%d" % (self.target.rl_reset * self.adapter.BATCH_SIZE,))
             if not self.target.forced_close:
                 location.append("&forced_close=0")
         return "".join(location)
 
-    def report_result(self):
+    def _relaunch_scheduled(self, duration):
+        # check if the relaunch scheduler recommends relaunching the target early
+        if self.relaunch_scheduler is None or self.target.closed:
+            return False
+        if self.target.rl_countdown < 1:
+            log.debug("fixed relaunch limit (%d) reached", self.target.rl_reset)
+            return False
+        if not self.relaunch_scheduler.update(duration, self.target.memory_usage()):
+            return False
+        self.target.rl_countdown = 0
+        return True
+
+    def report_result(self, input_fname=None):
         # create working directory for current testcase
         result_logs = tempfile.mkdtemp(prefix="grz_logs_", dir=self.iomanager.working_path)
         self.target.save_logs(result_logs, meta=True)
         log.info("Reporting results...")
+        self.iomanager.restore_tests()
         self.iomanager.tests.reverse()  # order test cases newest to oldest
-        self.reporter.submit(result_logs, self.iomanager.tests)
+        callback = None
+        if input_fname is None and self.iomanager.tests:
+            input_fname = self.iomanager.tests[0].input_fname
+        if self.summary is not None and input_fname is not None:
+            # the signature (major stack hash) is recorded once the report is submitted
+            callback = partial(self.summary.add_signature, input_fname)
+        self.reporter.submit(result_logs, self.iomanager.tests, callback=callback)
         if os.path.isdir(result_logs):
             shutil.rmtree(result_logs)
 
+    def save_checkpoint(self, force=False):
+        """Save progress to the checkpoint file. Checkpoints are only written when the
+        duration of time since the previous checkpoint exceeds CHECKPOINT_FREQ seconds.
+
+        Args:
+            force (bool): Ignore checkpoint frequency limiting.
+
+        Returns:
+            bool: True if the checkpoint was written otherwise False.
+        """
+        if self.checkpoint is None:
+            return False
+        now = time.time()
+        if not force and now < self._checkpoint_time + self.CHECKPOINT_FREQ:
+            return False
+        self._checkpoint_time = now
+        try:
+            # adapter state is only included if it can be serialized
+            json.dumps(self.adapter.fuzz)
+            fuzz = self.adapter.fuzz
+        except (TypeError, ValueError):
+            log.debug("adapter state cannot be saved in checkpoint")
+            fuzz = None
+        data = {
+            "adapter": self.adapter.NAME,
+            "fuzz": fuzz,
+            "iomanager": self.iomanager.save_state(),
+            "status": {
+                "duration": now - self.status.start_time,
+                "ignored": self.status.ignored,
+                "iteration": self.status.iteration,
+                "results": self.status.results}}
+        # write to a temporary file and rename to avoid leaving a partial checkpoint
+        fd, tmp_file = tempfile.mkstemp(
+            prefix="tmp_", suffix=".json", dir=os.path.dirname(os.path.abspath(self.checkpoint)))
+        try:
+            with os.fdopen(fd, "w") as out_fp:
+                json.dump(data, out_fp)
+            os.rename(tmp_file, self.checkpoint)
+        except (IOError, OSError) as exc:
+            log.warning("Failed to save checkpoint %r (%s)", self.checkpoint, exc)
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            return False
+        log.debug("saved checkpoint %r", self.checkpoint)
+        return True
+
     def run(self, iteration_limit=None):
         assert self.server is not None, "server is not configured"
         while True:  # main fuzzing loop
@@ -182,54 +603,231 @@ class Session(object):
 
             if self.target.closed:
                 self.iomanager.purge_tests()
-                self.adapter.pre_launch()
-                self.launch_target()
+                if self._standby is not None:
+                    self.use_standby()
+                else:
+                    self.adapter.pre_launch()
+                    self.launch_target()
             self.target.step()
-
-            # create and populate a test case
-            current_test = self.generate_testcase()
+            iteration_start = time.time()
+
+            # create and populate test cases (more than one when batching)
+            batch = list()
+            for batch_index in range(self.adapter.BATCH_SIZE):
+                if batch_index and not self.adapter.ROTATION_PERIOD and self.iomanager.inputs_exhausted():
+                    # all inputs have been used in single pass mode
+                    break
+                batch.append(self.generate_testcase(batch_index=batch_index))
+            self.status.iteration += len(batch) - 1
+            current_test = batch[-1]
+            if len(batch) < self.adapter.BATCH_SIZE:
+                self.iomanager.end_batch(len(batch))
             if self.iomanager.active_input is not None:
                 self.status.test_name = self.iomanager.active_input.file_name
 
             # display status
             self.display_status()
 
-            # use Sapphire to serve the most recent test case
-            server_status, files_served = self.server.serve_testcase(
-                current_test,
-                continue_cb=self.target.monitor.is_healthy,
-                server_map=self.iomanager.server_map,
-                working_path=self.iomanager.working_path)
-            if self.adapter.IGNORE_UNSERVED:
-                log.debug("removing unserved files from the test case")
-                current_test.purge_optional(files_served)
-
-            if server_status == sapphire.SERVED_TIMEOUT:
-                log.debug("calling self.adapter.on_timeout()")
-                self.adapter.on_timeout(current_test, files_served)
+            # use Sapphire to serve the most recent test case(s)
+            if len(batch) > 1:
+                server_status, files_served = self.serve_batch(batch)
             else:
-                log.debug("calling self.adapter.on_served()")
-                self.adapter.on_served(current_test, files_served)
+                server_status, files_served = self.server.serve_testcase(
+                    current_test,
+                    continue_cb=self.target.monitor.is_healthy,
+                    server_map=self.iomanager.server_map,
+                    working_path=self.iomanager.working_path)
+            for test in batch:
+                if self.adapter.IGNORE_UNSERVED:
+                    log.debug("removing unserved files from the test case")
+                    test.purge_optional(files_served)
+                if server_status == sapphire.SERVED_TIMEOUT:
+                    log.debug("calling self.adapter.on_timeout()")
+                    self.adapter.on_timeout(test, files_served)
+                else:
+                    log.debug("calling self.adapter.on_served()")
+                    self.adapter.on_served(test, files_served)
+
+            if self.adaptive_timeout is not None:
+                self._update_timeout(current_test.duration, server_status == sapphire.SERVED_TIMEOUT)
 
             if self.coverage and server_status != sapphire.SERVED_TIMEOUT:
                 self.target.dump_coverage()
 
+            if len(batch) > 1:
+                # test cases in a batch are served in order, count the ones that were not reached
+                unserved = sum(1 for test in batch if test.landing_page not in files_served)
+                if unserved < len(batch):
+                    # results are attributed to the most recent test case that was served
+                    current_test = batch[len(batch) - unserved - 1]
+            else:
+                unserved = int(not files_served)
+
             # check for results and report as necessary
-            self.check_results(not files_served, server_status == sapphire.SERVED_TIMEOUT)
+            result = self.check_results(
+                unserved,
+                server_status == sapphire.SERVED_TIMEOUT,
+                input_fname=current_test.input_fname)
+
+            # update input statistics used by the scheduler
+            # results are attributed to the most recent test case that was served
+            for test in batch:
+                self.iomanager.record_result(
+                    test.input_fname,
+                    duration=test.duration,
+                    failure=test is current_test and result == self.target.RESULT_FAILURE,
+                    ignored=test is current_test and result == self.target.RESULT_IGNORED,
+                    timeout=server_status == sapphire.SERVED_TIMEOUT)
+                if self.summary is not None:
+                    self.summary.record(
+                        test.input_fname,
+                        duration=test.duration,
+                        failure=test is current_test and result == self.target.RESULT_FAILURE,
+                        ignored=test is current_test and result == self.target.RESULT_IGNORED,
+                        timeout=server_status == sapphire.SERVED_TIMEOUT)
 
             # warn about large browser logs
             self.status.log_size = self.target.log_size()
             if self.status.log_size > self.TARGET_LOG_SIZE_WARN:
                 log.warning("Large browser logs: %dMBs", (self.status.log_size / 0x100000))
 
+            # launch the next target in the background before it is needed
+            if (self.target_factory is not None and self._standby is None
+                    and self.target.rl_countdown <= self.STANDBY_LEAD):
+                self.launch_standby()
+
             # trigger relaunch by closing the browser if needed
-            self.target.check_relaunch()
+            if self._relaunch_scheduled(time.time() - iteration_start):
+                # the target will not close itself, do not wait
+                self.target.check_relaunch(wait=0)
+            else:
+                self.target.check_relaunch()
 
             # all test cases have been replayed
-            if not self.adapter.ROTATION_PERIOD and not self.iomanager.input_files:
+            if not self.adapter.ROTATION_PERIOD and self.iomanager.inputs_exhausted():
                 log.info("Replay Complete")
+                self.clear_checkpoint()
                 break
 
-            if iteration_limit is not None and self.status.iteration == iteration_limit:
+            if iteration_limit is not None and self.status.iteration >= iteration_limit:
                 log.info("Hit iteration limit")
+                self.save_checkpoint(force=True)
                 break
+
+            self.save_checkpoint()
+
+    def _batch_groups(self, batch):
+        # split a batch into groups of test cases that can share a directory
+        # (files with the same name would overwrite each other)
+        shared = set()
+        if self.iomanager.harness is not None:
+            shared.add(self.iomanager.harness.file_name)
+        groups = list()
+        start = 0
+        names = set()
+        for index, test in enumerate(batch):
+            test_names = set(test.contents) - shared
+            if not names.isdisjoint(test_names):
+                log.debug("file name collision in batch, serving test cases %d-%d", start, index - 1)
+                groups.append((start, index))
+                start = index
+                names.clear()
+            names.update(test_names)
+        groups.append((start, len(batch)))
+        return groups
+
+    def serve_batch(self, batch):
+        # serve multiple test cases with a call to serve_path() per group of test cases
+        # the harness navigates between them using the "batch_test_#" redirects
+        redirects = self.iomanager.server_map.redirect
+        # redirects that lead to the next batch
+        exits = [x for x in redirects.values() if x.required]
+        files_served = list()
+        try:
+            for start, end in self._batch_groups(batch):
+                last = end == len(batch)
+                # the group is complete when the harness requests the next test case
+                for resource in exits:
+                    resource.required = last
+                if not last:
+                    redirects["batch_test_%d" % (end,)].required = True
+                wwwdir = tempfile.mkdtemp(prefix="sphr_test_", dir=self.iomanager.working_path)
+                try:
+                    optional = set()
+                    for test in batch[start:end]:
+                        test.dump(wwwdir)
+                        optional.update(test.optional)
+                    serve_start = time.time()
+                    server_status, served = self.server.serve_path(
+                        wwwdir,
+                        continue_cb=self.target.monitor.is_healthy,
+                        optional_files=tuple(optional),
+                        server_map=self.iomanager.server_map)
+                finally:
+                    shutil.rmtree(wwwdir, ignore_errors=True)
+                    if not last:
+                        redirects["batch_test_%d" % (end,)].required = False
+                # individual durations are not available, use the average
+                duration = (time.time() - serve_start) / (end - start)
+                for test in batch[start:end]:
+                    test.duration = duration
+                files_served.extend(served)
+                if server_status != sapphire.SERVED_ALL:
+                    break
+        finally:
+            for resource in exits:
+                resource.required = True
+        return server_status, files_served
+
+    @property
+    def time_limit(self):
+        if self.adaptive_timeout is not None:
+            return self.adaptive_timeout.time_limit
+        return self.adapter.TEST_DURATION
+
+    def _update_timeout(self, duration, was_timeout):
+        # update the adaptive timeout using the results of the latest iteration
+        if was_timeout:
+            self.adaptive_timeout.expired()
+        elif duration is not None:
+            self.adaptive_timeout.completed(duration)
+        self._set_server_timeout()
+
+    def _set_server_timeout(self):
+        # the new time limit is only used by the harness once the target is relaunched
+        timeout = self.adaptive_timeout.timeout_for(self._time_limit) * self.adapter.BATCH_SIZE
+        if timeout != self.server.timeout:
+            log.debug("adaptive timeout: iteration timeout %0.1fs (time limit: %0.1fs)",
+                      timeout, self.adaptive_timeout.time_limit)
+            self.server.timeout = timeout
+
+    def use_standby(self):
+        # replace the active target (and server) with the standby target
+        assert self.target.closed
+        standby = self._standby
+        self._standby = None
+        waited = standby.wait()
+        log.info("Switching to standby target (launch: %0.2fs, waited: %0.2fs)",
+                 standby.launch_time, waited)
+        self.target.cleanup()
+        self.server.close()
+        self.server = standby.server
+        self.target = standby.target
+        self._time_limit = standby.time_limit
+        self.adapter.monitor = self.target.monitor
+        if isinstance(standby.error, TargetLaunchError):
+            # this result likely has nothing to do with Grizzly
+            self.status.results += 1
+            log.error("Launch error detected")
+            self.report_result()
+            raise standby.error
+        if standby.error is not None:
+            log.warning("Launch timeout detected (standby target)")
+            self.launch_target()
+            return
+        self._launches += 1
+        if self.adaptive_timeout is not None:
+            self._set_server_timeout()
+        if self.relaunch_scheduler is not None:
+            # only the time spent waiting is a cost to the fuzzing loop
+            self.relaunch_scheduler.launched(waited)
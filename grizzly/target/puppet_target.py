@@ -2,9 +2,11 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import errno
 import logging
 import os
 import platform
+import select
 import signal
 import time
 
@@ -63,6 +65,24 @@ class PuppetTarget(Target):
     def closed(self):
         return self._puppet.reason is not None
 
+    def memory_usage(self):
+        # total resident memory used by the browser and its child processes
+        pid = self._puppet.get_pid()
+        if pid is None:
+            return 0
+        try:
+            procs = [psutil.Process(pid)]
+            procs.extend(procs[0].children(recursive=True))
+        except (psutil.AccessDenied, psutil.NoSuchProcess):
+            return 0
+        total = 0
+        for proc in procs:
+            try:
+                total += proc.memory_info().rss
+            except (psutil.AccessDenied, psutil.NoSuchProcess):
+                pass
+        return total
+
     @property
     def monitor(self):
         if self._monitor is None:
@@ -79,6 +99,8 @@ class PuppetTarget(Target):
                     return self._puppet.launches
                 def log_length(_, log_id):
                     return self._puppet.log_length(log_id)
+                def wait(_, timeout):
+                    return self._wait_for_exit(timeout)
             self._monitor = _PuppetMonitor()
         return self._monitor
 
@@ -211,6 +233,26 @@ class PuppetTarget(Target):
                 raise TargetLaunchTimeout(str(exc))
             raise TargetLaunchError(str(exc))
 
+    def _wait_for_exit(self, timeout):
+        # wait for the browser process to exit
+        pid = self._puppet.get_pid()
+        if pid is None:
+            return True
+        if hasattr(os, "pidfd_open"):
+            # Linux: the pidfd becomes readable when the process exits
+            try:
+                pid_fd = os.pidfd_open(pid)  # pylint: disable=no-member
+            except OSError as exc:
+                if exc.errno == errno.ESRCH:
+                    return True
+                log.debug("pidfd_open() failed: %s", exc)
+            else:
+                try:
+                    return bool(select.select([pid_fd], [], [], timeout)[0])
+                finally:
+                    os.close(pid_fd)
+        return self._puppet.wait(timeout=timeout)
+
     def log_size(self):
         return self._puppet.log_length("stderr") + self._puppet.log_length("stdout")
 
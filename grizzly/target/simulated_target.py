@@ -0,0 +1,264 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import logging
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+
+from six.moves.urllib.parse import parse_qs, urlparse  # pylint: disable=import-error
+
+from .target_monitor import TargetMonitor
+from .target import Target
+
+__all__ = ("SimulatedTarget",)
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+log = logging.getLogger("grizzly")  # pylint: disable=invalid-name
+
+
+class SimulatedTarget(Target):
+    """SimulatedTarget replaces the browser with a lightweight HTTP client that runs in a
+    background thread. The client follows the same protocol as harness.html and can
+    inject crashes (with sanitizer logs) and hangs at configurable rates. It is used to
+    measure the overhead of Grizzly itself (see grizzly.benchmark).
+    """
+    MAX_REDIRECTS = 5
+    POLL_DELAY = 0.25  # max time a blocked request takes to notice close()
+    SIGNATURES = 4  # number of unique simulated crashes
+
+    def __init__(self, binary, extension, launch_timeout, log_limit, memory_limit, prefs, relaunch, **kwds):
+        super(SimulatedTarget, self).__init__(binary, extension, launch_timeout, log_limit,
+                                              memory_limit, prefs, relaunch)
+        self.crash_rate = kwds.pop("crash_rate", 0.0)  # chance a test case crashes
+        self.test_delay = kwds.pop("test_delay", 0.0)  # simulated time to run a test case
+        self.timeout_rate = kwds.pop("timeout_rate", 0.0)  # chance a test case hangs
+        self._rand = random.Random(kwds.pop("seed", None))
+        for unsupported in ("rr", "valgrind", "xvfb"):
+            if kwds.pop(unsupported, False):
+                log.warning("SimulatedTarget does not support %r", unsupported)
+        if kwds:
+            log.warning("SimulatedTarget ignoring unsupported arguments: %s", ", ".join(kwds))
+        self._conn = None  # socket used by the active request
+        self._crashed = False
+        self._launches = 0
+        self._log_path = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def cleanup(self):
+        self.close()
+        if self._log_path is not None:
+            shutil.rmtree(self._log_path, ignore_errors=True)
+            self._log_path = None
+
+    def close(self):
+        with self._lock:
+            self._stop.set()
+            if self._conn is not None:
+                # abort a blocked request
+                try:
+                    self._conn.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    @property
+    def closed(self):
+        return self._thread is None
+
+    def _crash(self):
+        # write a sanitizer log like the one created by a real crash
+        signature = self._rand.randint(1, self.SIGNATURES)
+        pid = os.getpid()
+        log_file = os.path.join(self._log_path, "log_ffp_asan_%d.log.%d.txt" % (pid, self._launches))
+        with open(log_file, "w") as out_fp:
+            out_fp.write(
+                "==%d==ERROR: AddressSanitizer: heap-use-after-free on address 0x602000000010"
+                " at pc 0x55d2b4c1e2f0 bp 0x7ffd6a1f2b10 sp 0x7ffd6a1f2b08\n" % (pid,))
+            out_fp.write("READ of size 8 at 0x602000000010 thread T0\n")
+            out_fp.write("    #0 0x55d2b4c1e2f0 in SimulatedCrash%d simulated.cpp:%d\n" % (
+                signature, signature * 10))
+            out_fp.write("    #1 0x55d2b4c1e400 in SimulatedTest simulated.cpp:100\n")
+            out_fp.write("    #2 0x55d2b4c1e500 in main simulated.cpp:200\n\n")
+            out_fp.write(
+                "SUMMARY: AddressSanitizer: heap-use-after-free simulated.cpp:%d in SimulatedCrash%d\n" % (
+                    signature * 10, signature))
+        self._write_log("stderr", "Simulated crash (signature %d)\n" % (signature,))
+        self._crashed = True
+
+    def detect_failure(self, ignored, was_timeout):
+        status = self.RESULT_NONE
+        is_healthy = self.monitor.is_healthy()
+        if not is_healthy or was_timeout:
+            self.close()
+        if self._crashed:
+            log.debug("failure detected, simulated crash")
+            status = self.RESULT_FAILURE
+        elif was_timeout:
+            log.info("Timeout detected")
+            status = self.RESULT_IGNORED if "timeout" in ignored else self.RESULT_FAILURE
+        return status
+
+    def _get(self, port, path):
+        # perform a minimal HTTP GET request, 307 redirects are followed
+        # returns the response body or None if the request failed or close() was called
+        for _ in range(self.MAX_REDIRECTS):
+            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            conn.settimeout(self.POLL_DELAY)
+            with self._lock:
+                if self._stop.is_set():
+                    conn.close()
+                    return None
+                self._conn = conn
+            try:
+                conn.connect(("127.0.0.1", port))
+                conn.sendall((
+                    "GET %s HTTP/1.1\r\n"
+                    "Host: 127.0.0.1:%d\r\n"
+                    "Connection: close\r\n\r\n" % (path, port)).encode("ascii"))
+                chunks = list()
+                while True:
+                    try:
+                        data = conn.recv(0x10000)
+                    except socket.timeout:
+                        if self._stop.is_set():
+                            return None
+                        continue
+                    if not data:
+                        break
+                    chunks.append(data)
+            except socket.error:
+                return None
+            finally:
+                with self._lock:
+                    self._conn = None
+                conn.close()
+            header, _, body = b"".join(chunks).partition(b"\r\n\r\n")
+            lines = header.decode("ascii", errors="ignore").split("\r\n")
+            if " 307 " not in lines[0]:
+                return body
+            for line in lines[1:]:
+                if line.lower().startswith("location:"):
+                    path = "/%s" % (line.split(":", 1)[1].strip().lstrip("/"),)
+                    break
+            else:
+                return None
+        return None
+
+    def _is_running(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def launch(self, location, env_mod=None):  # pylint: disable=arguments-differ,unused-argument
+        assert self.closed
+        self.rl_countdown = self.rl_reset
+        if self._log_path is not None:
+            shutil.rmtree(self._log_path, ignore_errors=True)
+        self._log_path = tempfile.mkdtemp(prefix="grz_sim_logs_")
+        self._write_log("stderr", "Simulated launch: %s\n" % (location,))
+        self._write_log("stdout", "")
+        self._crashed = False
+        self._launches += 1
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(location,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def log_size(self):
+        return self.monitor.log_length("stderr") + self.monitor.log_length("stdout")
+
+    @property
+    def monitor(self):
+        if self._monitor is None:
+            class _SimulatedMonitor(TargetMonitor):
+                # pylint: disable=no-self-argument,protected-access
+                def clone_log(_, log_id, offset=0):
+                    if self._log_path is None:
+                        return None
+                    log_file = os.path.join(self._log_path, "log_%s.txt" % (log_id,))
+                    if not os.path.isfile(log_file):
+                        return None
+                    fd, clone = tempfile.mkstemp(prefix="grz_sim_clone_")
+                    with os.fdopen(fd, "wb") as out_fp, open(log_file, "rb") as in_fp:
+                        in_fp.seek(offset)
+                        shutil.copyfileobj(in_fp, out_fp)
+                    return clone
+                def is_healthy(_):
+                    return self._is_running() and not self._crashed
+                def is_running(_):
+                    return self._is_running()
+                @property
+                def launches(_):
+                    return self._launches
+                def log_length(_, log_id):
+                    if self._log_path is None:
+                        return 0
+                    log_file = os.path.join(self._log_path, "log_%s.txt" % (log_id,))
+                    return os.stat(log_file).st_size if os.path.isfile(log_file) else 0
+                def wait(_, timeout):
+                    thread = self._thread
+                    if thread is not None:
+                        thread.join(timeout)
+                    return not self._is_running()
+            self._monitor = _SimulatedMonitor()
+        return self._monitor
+
+    def _run(self, location):
+        # simulate the browser running harness.html
+        url = urlparse(location)
+        query = parse_qs(url.query)
+        if self._get(url.port, "%s?%s" % (url.path, url.query) if url.query else url.path) is None:
+            return
+        batch = max(int(query.get("batch", ["1"])[0]), 1)
+        close_after = int(query["close_after"][0]) if "close_after" in query else None
+        forced_close = query.get("forced_close", ["1"])[0] != "0"
+        next_test = "/first_test"
+        opened = 0
+        while not self._stop.is_set():
+            if close_after is not None:
+                if close_after < 1:
+                    if forced_close:
+                        self._get(url.port, "/close_browser")
+                    break
+                close_after -= 1
+            if self._get(url.port, next_test) is None:
+                break
+            opened += 1
+            if opened % batch:
+                # next test case in the current batch
+                next_test = "/batch_test_%d" % (opened % batch,)
+            else:
+                next_test = "/next_test"
+            if self.test_delay > 0 and self._stop.wait(self.test_delay):
+                break
+            roll = self._rand.random()
+            if roll < self.crash_rate:
+                self._crash()
+                break
+            if roll < self.crash_rate + self.timeout_rate:
+                # hang until close() is called
+                self._stop.wait()
+                break
+
+    def save_logs(self, *args, **kwargs):
+        # only the destination is used (see FFPuppet.save_logs())
+        dest = kwargs["dest"] if "dest" in kwargs else args[0]
+        if self._log_path is None:
+            return
+        if not os.path.isdir(dest):
+            os.makedirs(dest)
+        for fname in os.listdir(self._log_path):
+            shutil.copy(os.path.join(self._log_path, fname), dest)
+
+    def _write_log(self, log_id, data):
+        with open(os.path.join(self._log_path, "log_%s.txt" % (log_id,)), "a") as out_fp:
+            out_fp.write(data)
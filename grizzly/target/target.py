@@ -68,10 +68,12 @@ class Target(object):
         log.debug("relaunch will be triggered... waiting up to %0.2f seconds", wait)
         deadline = time.time() + wait
         while self.monitor.is_healthy():
-            if time.time() >= deadline:
+            remaining = deadline - time.time()
+            if remaining <= 0:
                 log.info("Forcing target relaunch")
                 break
-            time.sleep(1)
+            # returns as soon as the target exits, health is checked at least once a second
+            self.monitor.wait(min(remaining, 1))
         self.close()
 
     @abc.abstractmethod
@@ -106,6 +108,10 @@ class Target(object):
         log.debug("log_size() not implemented! returning 0")
         return 0
 
+    def memory_usage(self):  # pylint: disable=no-self-use
+        log.debug("memory_usage() not implemented! returning 0")
+        return 0
+
     @abc.abstractproperty
     def monitor(self):
         pass
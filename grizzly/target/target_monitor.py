@@ -4,6 +4,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import abc
 import os
+import time
 
 import six
 
@@ -14,6 +15,8 @@ __credits__ = ["Tyson Smith", "Jesse Schwartzentruber"]
 
 @six.add_metaclass(abc.ABCMeta)
 class TargetMonitor(object):
+    POLL_DELAY = 0.1  # used by the default implementation of wait()
+
     @abc.abstractmethod
     def clone_log(self, log_id, offset=0):
         pass
@@ -43,3 +46,21 @@ class TargetMonitor(object):
     @abc.abstractmethod
     def log_length(self, log_id):
         pass
+
+    def wait(self, timeout):
+        """Wait for the target to exit. Implementations should return as soon as
+        the target exits. By default is_running() is polled.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the target is not running otherwise False.
+        """
+        deadline = time.time() + timeout
+        while self.is_running():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, self.POLL_DELAY))
+        return True
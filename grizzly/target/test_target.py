@@ -5,12 +5,16 @@
 
 import os
 import platform
+import subprocess
+import sys
+import time
 
 import pytest
 
 from ffpuppet import BrowserTimeoutError, FFPuppet
 
 from .puppet_target import PuppetTarget
+from .simulated_target import SimulatedTarget
 from .target import Target, TargetError, TargetLaunchTimeout
 from .target_monitor import TargetMonitor
 
@@ -47,6 +51,7 @@ def test_target_01(tmp_path):
     assert target.memory_limit == 3 * 0x100000
     assert target.rl_countdown == 0
     assert target.rl_reset == 25
+    assert target.memory_usage() == 0
     assert target.poll_for_idle(0, 0) == target.POLL_BUSY
     assert target.prefs == str(fake_file)
     assert not target.expect_close
@@ -90,6 +95,11 @@ def test_target_03(tmp_path, mocker):
     target.rl_countdown = 0
     target.step()
     target.check_relaunch(wait=5)
+    # test target exits while waiting
+    target._monitor.is_healthy.side_effect = (True, False)
+    target.check_relaunch(wait=60)
+    assert target._monitor.wait.call_count == 1
+    assert target._monitor.wait.call_args[0][0] <= 1
     target.cleanup()
 
 def test_puppet_target_01(mocker, tmp_path):
@@ -349,3 +359,93 @@ def test_puppet_target_06(mocker, tmp_path):
     assert target.monitor.log_length("stdout") == 100
     target.monitor.clone_log("somelog")
     assert fake_ffp.return_value.clone_log.call_count == 1
+
+def test_puppet_target_07(mocker, tmp_path):
+    """test PuppetTarget.memory_usage()"""
+    fake_ffp = mocker.patch("grizzly.target.puppet_target.FFPuppet", autospec=True)
+    fake_psutil = mocker.patch("grizzly.target.puppet_target.psutil", autospec=True)
+    fake_psutil.AccessDenied = OSError
+    fake_psutil.NoSuchProcess = OSError
+    fake_file = tmp_path / "fake"
+    fake_file.touch()
+    target = PuppetTarget(str(fake_file), None, 300, 25, 5000, None, 25)
+    # not running
+    fake_ffp.return_value.get_pid.return_value = None
+    assert target.memory_usage() == 0
+    # parent and children
+    fake_ffp.return_value.get_pid.return_value = 1234
+    fake_psutil.Process.return_value.memory_info.return_value = mocker.Mock(rss=100)
+    child = mocker.Mock()
+    child.memory_info.return_value = mocker.Mock(rss=50)
+    gone = mocker.Mock()
+    gone.memory_info.side_effect = OSError
+    fake_psutil.Process.return_value.children.return_value = [child, gone]
+    assert target.memory_usage() == 150
+    # process exited
+    fake_psutil.Process.side_effect = OSError
+    assert target.memory_usage() == 0
+
+def test_puppet_target_08(mocker, tmp_path):
+    """test PuppetTarget.monitor.wait()"""
+    fake_ffp = mocker.patch("grizzly.target.puppet_target.FFPuppet", autospec=True)
+    fake_file = tmp_path / "fake"
+    fake_file.touch()
+    target = PuppetTarget(str(fake_file), None, 300, 25, 5000, None, 25)
+    # not running
+    fake_ffp.return_value.get_pid.return_value = None
+    assert target.monitor.wait(10)
+    # running process
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(0.5)"])
+    try:
+        fake_ffp.return_value.get_pid.return_value = proc.pid
+        def fake_wait(timeout):
+            deadline = time.time() + timeout
+            while proc.poll() is None:
+                if time.time() >= deadline:
+                    return False
+                time.sleep(0.01)
+            return True
+        # used when pidfd is not available
+        fake_ffp.return_value.wait.side_effect = fake_wait
+        assert not target.monitor.wait(0)
+        assert target.monitor.wait(10)
+    finally:
+        proc.wait()
+
+def test_simulated_target_01(tmp_path):
+    """test SimulatedTarget"""
+    fake_file = tmp_path / "fake"
+    fake_file.touch()
+    target = SimulatedTarget(str(fake_file), None, 300, 0, 0, None, 10, seed=1, xvfb=True, foo=1)
+    try:
+        assert target.closed
+        assert target.log_size() == 0
+        assert target.monitor.clone_log("stderr") is None
+        target.save_logs(dest=str(tmp_path / "none"))
+        assert not (tmp_path / "none").is_dir()
+        # nothing is listening on the port
+        target.launch("http://127.0.0.1:1/harness?close_after=1")
+        assert not target.closed
+        assert target.monitor.launches == 1
+        assert target.monitor.wait(10)
+        assert not target.monitor.is_running()
+        assert not target.monitor.is_healthy()
+        assert target.detect_failure([], False) == Target.RESULT_NONE
+        assert target.closed
+        assert target.log_size() > 0
+        assert b"Simulated launch" in target.monitor.log_data("stderr")
+        assert target.monitor.log_data("missing") is None
+        # simulated crash logs
+        target._crash()
+        target.save_logs(str(tmp_path / "logs"), meta=True)
+        logs = os.listdir(str(tmp_path / "logs"))
+        assert "log_stderr.txt" in logs
+        assert any("asan" in x for x in logs)
+        assert target.detect_failure([], False) == Target.RESULT_FAILURE
+        # timeout
+        target._crashed = False
+        assert target.detect_failure(["timeout"], True) == Target.RESULT_IGNORED
+        assert target.detect_failure([], True) == Target.RESULT_FAILURE
+    finally:
+        target.cleanup()
+    assert target._log_path is None
@@ -30,3 +30,15 @@ def test_target_monitor_01(tmp_path):
     assert mon.launches == 1
     assert mon.log_data("test_log") == b"test"
     assert mon.log_length("test_log") == 100
+    assert not mon.wait(0)
+
+def test_target_monitor_02(mocker):
+    """test TargetMonitor.wait()"""
+    fake_mon = mocker.Mock(spec=TargetMonitor)
+    fake_mon.POLL_DELAY = 0.01
+    fake_mon.is_running.side_effect = (True, True, False)
+    assert TargetMonitor.wait(fake_mon, 60)
+    assert fake_mon.is_running.call_count == 3
+    fake_mon.is_running.side_effect = None
+    fake_mon.is_running.return_value = True
+    assert not TargetMonitor.wait(fake_mon, 0.05)
@@ -0,0 +1,60 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+unit tests for grizzly.benchmark
+"""
+import pytest
+
+from .benchmark import main, PhaseTimer, run_benchmark
+from .common import Status
+
+
+def test_phase_timer_01():
+    """test PhaseTimer"""
+    timer = PhaseTimer()
+    func = timer.wrap("test", lambda x: x + 1)
+    timer.wrap("unused", lambda: None)
+    assert func(1) == 2
+    assert func(2) == 3
+    assert timer.calls["test"] == 2
+    assert timer.totals["test"] >= 0
+    lines = timer.summary(1.0)
+    assert len(lines) == 2
+    assert lines[1].startswith("test ")
+
+def test_benchmark_01(tmp_path):
+    """test run_benchmark()"""
+    Status.PATH = str(tmp_path / "status")
+    results = run_benchmark(10, relaunch=4, working_path=str(tmp_path))
+    assert results["iterations"] == 10
+    assert results["launches"] == 3
+    assert results["results"] == 0
+    assert results["rate"] > 0
+    assert results["timer"].calls["serve"] == 10
+    assert results["timer"].calls["launch"] == 3
+    # batches
+    results = run_benchmark(12, batch=3, relaunch=2, working_path=str(tmp_path))
+    assert results["iterations"] == 12
+    assert results["launches"] == 2
+    assert results["timer"].calls["serve"] == 4
+    # every test case crashes
+    results = run_benchmark(3, crash_rate=1.0, working_path=str(tmp_path))
+    assert results["results"] == 3
+    assert results["launches"] == 3
+    assert results["timer"].calls["report"] == 3
+    # every test case hangs
+    results = run_benchmark(1, timeout=1, timeout_rate=1.0, working_path=str(tmp_path))
+    assert results["results"] == 1
+    assert not any(tmp_path.glob("grz_bench_*"))
+
+def test_benchmark_02(tmp_path):
+    """test benchmark main()"""
+    assert main(["-n", "2", "-w", str(tmp_path)]) == 0
+    with pytest.raises(SystemExit):
+        main(["-n", "0"])
+    with pytest.raises(SystemExit):
+        main(["--crash-rate", "2"])
+    with pytest.raises(SystemExit):
+        main(["-w", str(tmp_path / "missing")])
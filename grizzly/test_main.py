@@ -7,19 +7,24 @@
 import pytest
 
 from sapphire import Sapphire
-from .common import Adapter
-from .main import main
+from .common import Adapter, IOManager, Status
+from .main import claim_checkpoint, main
 from .session import Session
 from .target import TargetLaunchError
 
 
 class FakeArgs(object):
     def __init__(self, working_path):
-        self.binary = None
+        self.binary = "fake_bin"
         self.input = None
         self.accepted_extensions = None
         self.adapter = None
+        self.adaptive_relaunch = False
+        self.adaptive_rotation = False
+        self.adaptive_timeout = False
         self.cache = 0
+        self.cache_limit = 0
+        self.checkpoint = None
         self.coverage = False
         self.extension = None
         self.fuzzmanager = False
@@ -28,21 +33,35 @@ class FakeArgs(object):
         self.log_limit = 0
         self.memory = 0
         self.mime = None
+        self.min_crashes = 1
+        self.outbox = None
         self.platform = "test"
         self.prefs = None
         self.rr = False
+        self.rr_codec = "bz2"
         self.relaunch = 1000
+        self.repeat = 1
+        self.replay_summary = None
+        self.report_queue = 0
+        self.resume = False
         self.s3_fuzzmanager = False
+        self.scheduler = "random"
+        self.shard = None
+        self.shard_queue = None
         self.soft_asserts = False
+        self.standby = False
         self.timeout = 60
         self.tool = None
         self.valgrind = False
+        self.workers = 1
         self.working_path = working_path
         self.xvfb = False
 
 def test_main_01(tmp_path, mocker):
     """test main()"""
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
+    fake_adapter.MIN_TEST_DURATION = 1
     fake_adapter.NAME = "fake"
     fake_adapter.RELAUNCH = 1
     fake_adapter.TEST_DURATION = 10
@@ -52,6 +71,7 @@ def test_main_01(tmp_path, mocker):
     targets.return_value = "fake-target"
     fake_session = mocker.patch("grizzly.main.Session", autospec=True)
     fake_session.return_value.server = mocker.Mock(spec=Sapphire)
+    fake_session.return_value.target = None
     fake_session.EXIT_SUCCESS = Session.EXIT_SUCCESS
     args = FakeArgs(str(tmp_path))
     args.adapter = "fake"
@@ -62,21 +82,54 @@ def test_main_01(tmp_path, mocker):
     args.valgrind = True
     args.xvfb = True
     assert main(args) == Session.EXIT_SUCCESS
+    args.adaptive_relaunch = True
+    assert main(args) == Session.EXIT_SUCCESS
+    assert fake_session.call_args[1]["relaunch_scheduler"] is not None
+    args.adaptive_timeout = True
+    assert main(args) == Session.EXIT_SUCCESS
+    args.report_queue = 2
+    assert main(args) == Session.EXIT_SUCCESS
+    args.report_queue = 0
+    args.standby = True
+    assert main(args) == Session.EXIT_SUCCESS
+    assert callable(fake_session.call_args[1]["target_factory"])
+    assert fake_session.call_args[1]["adaptive_timeout"] is not None
+    # checkpoints are only saved when requested
+    assert fake_session.call_args[1]["checkpoint"] is None
+    args.resume = True
+    assert main(args) == Session.EXIT_SUCCESS
+    assert fake_session.return_value.load_checkpoint.call_count == 1
+    assert fake_session.call_args[1]["checkpoint"].startswith(str(tmp_path))
+    args.adaptive_rotation = True
+    args.scheduler = "weighted"
+    assert main(args) == Session.EXIT_SUCCESS
     fake_reporter = mocker.patch("grizzly.main.FuzzManagerReporter", autospec=True)
     fake_reporter.sanity_check.return_value = True
     args.input = None
     args.fuzzmanager = True
     args.coverage = True
     assert main(args) == Session.EXIT_SUCCESS
+    args.outbox = str(tmp_path / "outbox")
+    assert main(args) == Session.EXIT_SUCCESS
+    assert fake_reporter.create_outbox.call_count == 1
+    assert fake_reporter.create_outbox.return_value.close.call_count == 1
+    args.outbox = None
     fake_reporter = mocker.patch("grizzly.main.S3FuzzManagerReporter", autospec=True)
     fake_reporter.sanity_check.return_value = True
     args.fuzzmanager = False
     args.s3_fuzzmanager = True
     assert main(args) == Session.EXIT_SUCCESS
+    # batches require a harness
+    fake_adapter.BATCH_SIZE = 2
+    assert main(args) == Session.EXIT_SUCCESS
+    fake_adapter.get_harness.return_value = None
+    with pytest.raises(RuntimeError, match="requires a harness"):
+        main(args)
 
 def test_main_02(tmp_path, mocker):
     """test main()"""
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
     adapter_get = mocker.patch("grizzly.adapters.get")
     adapter_get.return_value = lambda: fake_adapter
     fake_session = mocker.patch("grizzly.main.Session", autospec=True)
@@ -84,12 +137,32 @@ def test_main_02(tmp_path, mocker):
     args = FakeArgs(str(tmp_path))
     args.adapter = "fake"
     fake_adapter.TEST_DURATION = args.timeout + 10
+    fake_store = mocker.patch("grizzly.main.ContentStore", autospec=True)
     with pytest.raises(RuntimeError):
         main(args)
+    # content store is only used when test cases are dumped more than once
+    assert fake_store.call_count == 0
+    args.cache = 1
+    with pytest.raises(RuntimeError):
+        main(args)
+    assert fake_store.call_count == 1
+    assert fake_store.return_value.cleanup.call_count == 1
+    # cached test cases are not dumped when reporting via FuzzManager
+    fake_store.reset_mock()
+    mocker.patch("grizzly.main.FuzzManagerReporter", autospec=True)
+    args.fuzzmanager = True
+    with pytest.raises(RuntimeError):
+        main(args)
+    assert fake_store.call_count == 0
+    args.repeat = 2
+    with pytest.raises(RuntimeError):
+        main(args)
+    assert fake_store.call_count == 1
 
 def test_main_03(tmp_path, mocker):
     """test main() exit codes"""
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
     fake_adapter.TEST_DURATION = 10
     fake_adapter.RELAUNCH = 0
     fake_adapter.ROTATION_PERIOD = 0
@@ -102,6 +175,7 @@ def test_main_03(tmp_path, mocker):
     fake_session.EXIT_ABORT = Session.EXIT_ABORT
     fake_session.EXIT_LAUNCH_FAILURE = Session.EXIT_LAUNCH_FAILURE
     fake_session.return_value.server = mocker.Mock(spec=Sapphire)
+    fake_session.return_value.target = None
     args = FakeArgs(str(tmp_path))
     args.adapter = "fake"
     args.input = "fake"
@@ -109,3 +183,107 @@ def test_main_03(tmp_path, mocker):
     assert main(args) == Session.EXIT_ABORT
     fake_session.return_value.run.side_effect = TargetLaunchError("test")
     assert main(args) == Session.EXIT_LAUNCH_FAILURE
+
+def test_main_04(tmp_path, mocker):
+    """test main() with multiple replay workers"""
+    adapter_get = mocker.patch("grizzly.adapters.get")
+    fake_replay = mocker.patch("grizzly.main.ParallelReplay", autospec=True)
+    fake_replay.return_value.run.return_value = Session.EXIT_SUCCESS
+    args = FakeArgs(str(tmp_path))
+    args.adapter = "fake"
+    args.workers = 2
+    # fuzzing mode is not supported
+    adapter_get.return_value.ROTATION_PERIOD = 10
+    assert main(args) == Session.EXIT_ERROR
+    assert fake_replay.call_count == 0
+    adapter_get.return_value.ROTATION_PERIOD = 0
+    assert main(args) == Session.EXIT_SUCCESS
+    fake_replay.assert_called_once_with(args, 2)
+    fake_replay.return_value.run.assert_called_once_with(main)
+
+def test_main_05(tmp_path, mocker):
+    """test main() cleanup when a queued report fails"""
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
+    fake_adapter.RELAUNCH = 1
+    fake_adapter.TEST_DURATION = 10
+    adapter_get = mocker.patch("grizzly.adapters.get")
+    adapter_get.return_value = lambda: fake_adapter
+    fake_target = mocker.patch("grizzly.main.load_target")
+    fake_reporter = mocker.patch("grizzly.main.FilesystemReporter", autospec=True)
+    fake_reporter.return_value.report_path = str(tmp_path / "results")
+    fake_reporter.return_value.submit.side_effect = RuntimeError("Running low on disk space")
+    fake_session = mocker.patch("grizzly.main.Session", autospec=True)
+    fake_session.EXIT_SUCCESS = Session.EXIT_SUCCESS
+    fake_session.return_value.server = mocker.Mock(spec=Sapphire)
+    fake_session.return_value.target = fake_target.return_value.return_value
+    def _fake_run():
+        # submit a report using the reporter passed to the Session
+        log_path = tmp_path / "logs"
+        log_path.mkdir()
+        fake_session.call_args[0][4].submit(str(log_path), [])
+    fake_session.return_value.run.side_effect = _fake_run
+    args = FakeArgs(str(tmp_path))
+    args.adapter = "fake"
+    args.report_queue = 1
+    assert main(args) == Session.EXIT_SUCCESS
+    assert fake_reporter.return_value.submit.call_count == 1
+    assert fake_session.return_value.close.call_count == 1
+    assert fake_target.return_value.return_value.cleanup.call_count == 1
+    assert fake_adapter.cleanup.call_count == 1
+
+def test_main_06(tmp_path, mocker):
+    """test claim_checkpoint() with two sessions sharing a working path"""
+    # file locks are held per process, track the locks held by each "instance"
+    held = set()
+    class _FakeLock(object):
+        def __init__(self, path):
+            self.path = path
+        def acquire(self, blocking=True):
+            assert not blocking
+            if self.path in held:
+                return False
+            held.add(self.path)
+            return True
+        def release(self):
+            held.remove(self.path)
+    mocker.patch("grizzly.main.fasteners.InterProcessLock", side_effect=_FakeLock)
+    Status.PATH = str(tmp_path)
+    args = FakeArgs(str(tmp_path))
+    args.adapter = "fake"
+    args.resume = True
+    first, first_lock = claim_checkpoint(args)
+    second, second_lock = claim_checkpoint(args)
+    try:
+        assert first != second
+        # a different shard uses different checkpoints
+        args.shard = "1/2"
+        assert claim_checkpoint(args)[0] not in (first, second)
+        # explicit checkpoint in use
+        args.checkpoint = first
+        assert claim_checkpoint(args) == (None, None)
+        fake_adapter = mocker.Mock(spec=Adapter)
+        fake_adapter.NAME = "fake"
+        fake_adapter.fuzz = {}
+        sessions = list()
+        for iteration, checkpoint in enumerate((first, second), start=1):
+            fake_iomgr = mocker.Mock(spec=IOManager)
+            fake_iomgr.save_state.return_value = {"generated": iteration}
+            session = Session(fake_adapter, False, [], fake_iomgr, None, None, checkpoint=checkpoint)
+            session.status.iteration = iteration
+            sessions.append(session)
+        for session in sessions:
+            assert session.save_checkpoint(force=True)
+        for iteration, session in enumerate(sessions, start=1):
+            session.status.iteration = 0
+            assert session.load_checkpoint()
+            assert session.status.iteration == iteration
+            session.close()
+        assert not list(tmp_path.glob("tmp_*"))
+    finally:
+        first_lock.release()
+        second_lock.release()
+    # released checkpoints are reused
+    args.checkpoint = None
+    args.shard = None
+    assert claim_checkpoint(args)[0] == first
@@ -0,0 +1,71 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+unit tests for grizzly.replay
+"""
+import json
+
+from .replay import ParallelReplay, ReplaySummary
+from .test_main import FakeArgs
+
+
+def _fake_main(args):
+    # stand-in for grizzly.main.main() used by worker processes
+    summary = ReplaySummary()
+    summary.record("a.html", duration=1.0, failure=True)
+    summary.add_signature("a.html", "abcd")
+    summary.save(args.replay_summary)
+    return 0 if args.workers == 1 else 1
+
+
+def test_replay_summary_01(tmp_path):
+    """test ReplaySummary"""
+    summary = ReplaySummary(min_crashes=2)
+    summary.record(None)
+    assert not summary.inputs
+    summary.record("a.html", duration=1.0, failure=True)
+    summary.add_signature("a.html", "abcd")
+    summary.record("a.html", duration=3.0, timeout=True)
+    summary.record("b.html", duration=1.0, ignored=True)
+    assert not summary.reproduced("a.html")
+    assert not summary.reproduced("missing.html")
+    summary.record("a.html", failure=True)
+    summary.add_signature("a.html", "abcd")
+    assert summary.reproduced("a.html")
+    summary.report()
+    # save and load
+    summary_file = tmp_path / "summary.json"
+    summary.save(str(summary_file))
+    data = json.loads(summary_file.read_text())
+    assert data["min_crashes"] == 2
+    assert data["inputs"]["a.html"]["mean_duration"] == 4.0 / 3
+    assert data["inputs"]["a.html"]["reproduced"]
+    assert data["inputs"]["a.html"]["signatures"] == {"abcd": 2}
+    assert data["inputs"]["a.html"]["timeouts"] == 1
+    assert not data["inputs"]["b.html"]["reproduced"]
+    loaded = ReplaySummary.load(str(summary_file), min_crashes=2)
+    assert loaded.inputs == summary.inputs
+    # merge
+    loaded.merge(summary)
+    assert loaded.inputs["a.html"]["runs"] == 6
+    assert loaded.inputs["a.html"]["signatures"] == {"abcd": 4}
+    assert loaded.inputs["b.html"]["ignored"] == 2
+    # signatures recorded after the report is submitted
+    loaded.add_signature("b.html", "efgh")
+    loaded.add_signature("b.html", None)
+    loaded.add_signature(None, "efgh")
+    assert loaded.inputs["b.html"]["signatures"] == {"efgh": 1}
+
+def test_parallel_replay_01(tmp_path):
+    """test ParallelReplay.run()"""
+    args = FakeArgs(str(tmp_path))
+    args.replay_summary = str(tmp_path / "summary.json")
+    args.workers = 3
+    assert ParallelReplay(args, 3).run(_fake_main) == 0
+    data = json.loads((tmp_path / "summary.json").read_text())
+    assert data["inputs"]["a.html"]["runs"] == 3
+    assert data["inputs"]["a.html"]["signatures"] == {"abcd": 3}
+    # working directory is removed
+    assert [x.name for x in tmp_path.iterdir()] == ["summary.json"]
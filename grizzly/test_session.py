@@ -11,7 +11,8 @@ import pytest
 
 from sapphire import Sapphire, ServerMap, SERVED_ALL, SERVED_TIMEOUT
 from grizzly.common import Adapter, InputFile, IOManager, Reporter, Status, TestCase, TestFile
-from grizzly.session import LogOutputLimiter, Session
+from grizzly.replay import ReplaySummary
+from grizzly.session import AdaptiveTimeout, LogOutputLimiter, RelaunchScheduler, Session, StandbyTarget
 from grizzly.target import Target, TargetLaunchError, TargetLaunchTimeout
 
 
@@ -22,6 +23,7 @@ def test_session_00(tmp_path, mocker):
     fake_server.return_value.serve_testcase.return_value = (SERVED_TIMEOUT, [])
     mocker.patch("grizzly.session.TestFile", autospec=True)
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
     fake_adapter.TEST_DURATION = 10
     fake_adapter.ROTATION_PERIOD = 0
     fake_iomgr = mocker.Mock(spec=IOManager)
@@ -31,7 +33,7 @@ def test_session_00(tmp_path, mocker):
     fake_iomgr.server_map.dynamic_responses = []
     fake_iomgr.active_input = mocker.Mock(spec=InputFile)
     fake_iomgr.active_input.file_name = "input.txt"
-    fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase)
+    fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase, duration=None, input_fname=None)
     fake_iomgr.harness = None
     fake_iomgr.input_files = []
     fake_iomgr.landing_page.return_value = "HOMEPAGE.HTM"
@@ -55,19 +57,21 @@ def test_session_00(tmp_path, mocker):
     assert fake_server.return_value.serve_testcase.call_count == 1
     assert fake_server.return_value.close.call_count == 1
     assert fake_target.detect_failure.call_count == 1
+    assert fake_iomgr.record_result.call_count == 1
 
 def test_session_01(tmp_path, mocker):
     """test Session.check_results()"""
     Status.PATH = str(tmp_path)
     mocker.patch("grizzly.session.TestFile", autospec=True)
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
     fake_adapter.IGNORE_UNSERVED = True
     fake_iomgr = mocker.Mock(spec=IOManager)
     fake_iomgr.tests = [mocker.Mock(spec=TestCase)]
     fake_target = mocker.Mock(spec=Target)
 
     session = Session(fake_adapter, False, [], fake_iomgr, None, fake_target)
-    session.report_result = mocker.Mock(return_value=None)
+    session.report_result = mocker.Mock()
 
     session.check_results(True, False)
     assert not fake_iomgr.tests
@@ -87,6 +91,14 @@ def test_session_01(tmp_path, mocker):
     session.check_results(False, False)
     assert fake_target.detect_failure.call_count == 1
     assert session.status.ignored == 1
+    fake_target.reset_mock()
+
+    # all unserved test cases in a batch are removed
+    served = mocker.Mock(spec=TestCase)
+    fake_iomgr.tests = [served, mocker.Mock(spec=TestCase), mocker.Mock(spec=TestCase)]
+    fake_target.detect_failure.return_value = fake_target.RESULT_NONE
+    session.check_results(2, False)
+    assert fake_iomgr.tests == [served]
 
     session.close()
 
@@ -94,13 +106,14 @@ def test_session_02(tmp_path, mocker):
     """test Session.generate_testcase()"""
     Status.PATH = str(tmp_path)
     mocker.patch("sapphire.Sapphire", autospec=True)
-    mocker.patch("grizzly.session.TestFile", autospec=True)
+    fake_testfile = mocker.patch("grizzly.session.TestFile", autospec=True)
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
     fake_iomgr = mocker.Mock(spec=IOManager)
     fake_iomgr.active_input = mocker.Mock(spec=InputFile)
     fake_iomgr.active_input.file_name = "infile"
     fake_iomgr.server_map = mocker.Mock(spec=ServerMap)
-    fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase)
+    fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase, duration=None, input_fname=None)
     fake_target = mocker.Mock(spec=Target)
     fake_target.prefs = "fake_prefs.js"
 
@@ -110,6 +123,13 @@ def test_session_02(tmp_path, mocker):
     testcase = session.generate_testcase()
     assert fake_adapter.generate.call_count == 1
     assert testcase.add_meta.call_count == 1
+    # prefs file is only read once
+    session.generate_testcase()
+    assert fake_testfile.from_file.call_count == 1
+    fake_target.prefs = "other_prefs.js"
+    session.generate_testcase()
+    assert fake_testfile.from_file.call_count == 2
+    session.close()
 
 def test_session_03(mocker, tmp_path):
     """test Session.launch_target()"""
@@ -117,6 +137,7 @@ def test_session_03(mocker, tmp_path):
     fake_server = mocker.Mock(spec=Sapphire)
     fake_server.get_port.return_value = 1
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
     fake_adapter.TEST_DURATION = 10
     fake_iomgr = mocker.Mock(spec=IOManager)
     fake_iomgr.harness = None
@@ -176,6 +197,7 @@ def test_session_04(tmp_path, mocker):
     fake_server = mocker.Mock(spec=Sapphire)
     fake_server.get_port.return_value = 1
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
     fake_adapter.TEST_DURATION = 1
     fake_iomgr = mocker.Mock(spec=IOManager)
     fake_iomgr.harness = mocker.Mock(spec=TestFile)
@@ -202,6 +224,7 @@ def test_session_05(tmp_path, mocker):
     """test Session.config_server()"""
     Status.PATH = str(tmp_path)
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
     mocker.patch("sapphire.Sapphire", autospec=True)
     fake_iomgr = mocker.Mock(spec=IOManager)
     fake_iomgr.server_map = mocker.Mock(spec=ServerMap)
@@ -215,6 +238,7 @@ def test_session_06(tmp_path, mocker):
     fake_server = mocker.patch("sapphire.Sapphire", autospec=True)
     mocker.patch("grizzly.session.TestFile", autospec=True)
     fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
     fake_adapter.IGNORE_UNSERVED = True
     fake_adapter.ROTATION_PERIOD = 2
     fake_adapter.TEST_DURATION = 10
@@ -225,7 +249,7 @@ def test_session_06(tmp_path, mocker):
     fake_iomgr.server_map.dynamic_responses = []
     fake_iomgr.active_input = mocker.Mock(spec=InputFile)
     fake_iomgr.active_input.file_name = "input.txt"
-    fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase)
+    fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase, duration=None, input_fname=None)
     fake_iomgr.harness = None
     fake_iomgr.input_files = []
     fake_iomgr.landing_page.return_value = "HOMEPAGE.HTM"
@@ -316,3 +340,537 @@ def test_log_output_limiter_04(mocker):
     assert lol._iterations == 4
     assert lol._launches == 1
     assert lol._time == 2.0
+
+def test_relaunch_scheduler_01():
+    """test RelaunchScheduler.update()"""
+    sched = RelaunchScheduler()
+    sched.MIN_ITERATIONS = 3
+    # launch time unknown
+    assert not sched.update(1.0, 0)
+    assert sched.average is None
+    sched.launched(10.0)
+    # steady iteration time, launch cost dominates
+    for _ in range(20):
+        assert not sched.update(1.0, 0)
+    assert sched.average == 30.0 / 20
+    # iterations slow down
+    for _ in range(100):
+        if sched.update(5.0, 0):
+            break
+    else:
+        pytest.fail("relaunch was not recommended")
+    # new launch cycle
+    sched.launched(10.0)
+    assert sched.average is None
+    assert not sched.update(5.0, 0)
+
+def test_relaunch_scheduler_02():
+    """test RelaunchScheduler.update() memory limit"""
+    sched = RelaunchScheduler(rss_limit=100)
+    sched.launched(60.0)
+    assert not sched.update(1.0, 1000)
+    assert not sched.update(1.0, 1100)
+    assert sched.update(1.0, 1101)
+
+def test_session_07(tmp_path, mocker):
+    """test Session.run() with RelaunchScheduler"""
+    Status.PATH = str(tmp_path)
+    mocker.patch("sapphire.Sapphire", autospec=True)
+    mocker.patch("grizzly.session.TestFile", autospec=True)
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
+    fake_adapter.IGNORE_UNSERVED = False
+    fake_adapter.ROTATION_PERIOD = 1
+    fake_adapter.TEST_DURATION = 10
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.harness = None
+    fake_iomgr.input_files = []
+    fake_iomgr.landing_page.return_value = "HOMEPAGE.HTM"
+    fake_iomgr.active_input = None
+    fake_iomgr.server_map = mocker.Mock(spec=ServerMap)
+    fake_iomgr.tests = []
+    fake_iomgr.working_path = str(tmp_path)
+    fake_target = mocker.Mock(spec=Target)
+    fake_target.closed = False
+    fake_target.log_size.return_value = 0
+    fake_target.memory_usage.return_value = 0
+    fake_target.prefs = None
+    fake_target.rl_countdown = 10
+    fake_target.rl_reset = 10
+    fake_sched = mocker.Mock(spec=RelaunchScheduler)
+    fake_sched.update.side_effect = (False, True, False)
+    session = Session(fake_adapter, False, [], fake_iomgr, None, fake_target, relaunch_scheduler=fake_sched)
+    session.config_server(5)
+    session._lol = mocker.Mock(spec=LogOutputLimiter)
+    session.server.serve_testcase.return_value = (SERVED_ALL, ["a.html"])
+    session.run(2)
+    assert fake_sched.update.call_count == 2
+    assert fake_target.rl_countdown == 0
+    fake_target.check_relaunch.assert_called_with(wait=0)
+    # fixed relaunch limit reached
+    session.run(3)
+    assert fake_sched.update.call_count == 2
+    fake_target.check_relaunch.assert_called_with()
+    session.close()
+
+def test_adaptive_timeout_01():
+    """test AdaptiveTimeout"""
+    adpt = AdaptiveTimeout(30, 60, min_duration=2)
+    adpt.MIN_SAMPLES = 10
+    # not enough samples
+    assert adpt.time_limit == 30
+    assert adpt.timeout == 60
+    for _ in range(10):
+        adpt.completed(1.0)
+    assert adpt.time_limit == 1.0 + adpt.MARGIN
+    assert adpt.timeout == 1.0 + adpt.MARGIN * 2
+    # timeouts increase limits
+    adpt.expired()
+    assert adpt.time_limit > 1.0 + adpt.MARGIN
+    for _ in range(20):
+        adpt.expired()
+    assert adpt.time_limit == 1.0 * adpt.BACKOFF_LIMIT + adpt.MARGIN
+    # respect upper and lower limits
+    adpt = AdaptiveTimeout(30, 60, min_duration=10)
+    adpt.MIN_SAMPLES = 1
+    adpt.completed(0.1)
+    assert adpt.time_limit == 10
+    adpt.completed(100)
+    assert adpt.time_limit == 30
+    assert adpt.timeout == 30 + adpt.MARGIN
+    # iteration timeout for a target using an older time limit
+    adpt = AdaptiveTimeout(30, 60, min_duration=10)
+    adpt.MIN_SAMPLES = 1
+    adpt.completed(0.1)
+    assert adpt.timeout == 10 + adpt.MARGIN
+    assert adpt.timeout_for(None) == adpt.timeout
+    assert adpt.timeout_for(30) == 30 + adpt.MARGIN
+    assert adpt.timeout_for(59) == 60
+    # iteration timeout not adjustable
+    adpt = AdaptiveTimeout(30, 60, adjust_timeout=False)
+    adpt.MIN_SAMPLES = 1
+    adpt.completed(1.0)
+    assert adpt.time_limit == 1.0 + adpt.MARGIN
+    assert adpt.timeout == 60
+
+def test_session_08(tmp_path, mocker):
+    """test Session with AdaptiveTimeout"""
+    Status.PATH = str(tmp_path)
+    fake_server = mocker.Mock(spec=Sapphire)
+    fake_server.get_port.return_value = 1
+    fake_server.timeout = 60
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
+    fake_adapter.TEST_DURATION = 30
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.harness = mocker.Mock(spec=TestFile)
+    fake_iomgr.landing_page.return_value = "x"
+    fake_target = mocker.Mock(spec=Target)
+    fake_target.forced_close = True
+    fake_target.rl_reset = 1
+    adpt = AdaptiveTimeout(30, 60)
+    adpt.MIN_SAMPLES = 1
+    session = Session(fake_adapter, False, [], fake_iomgr, None, fake_target, adaptive_timeout=adpt)
+    session.server = fake_server
+    assert session.location == "http://127.0.0.1:1/x?timeout=30000&close_after=1"
+    session._update_timeout(None, True)
+    assert fake_server.timeout == 60
+    session._update_timeout(1.0, False)
+    assert session.time_limit < 30
+    assert fake_server.timeout < 60
+    assert session.location == "http://127.0.0.1:1/x?timeout=%d&close_after=1" % (session.time_limit * 1000,)
+    # the iteration timeout is not reduced below the time limit used by the running target
+    fake_target.closed = True
+    fake_server.timeout = 60
+    session._launches = 0
+    adpt._durations.clear()
+    session.launch_target()
+    assert "timeout=30000" in fake_target.launch.call_args[0][0]
+    assert fake_server.timeout == 60
+    for _ in range(10):
+        session._update_timeout(1.0, False)
+    assert session.time_limit < 30
+    assert fake_server.timeout == 30 + adpt.MARGIN
+
+def test_standby_target_01(mocker):
+    """test StandbyTarget"""
+    fake_server = mocker.Mock(spec=Sapphire)
+    fake_target = mocker.Mock(spec=Target)
+    standby = StandbyTarget(fake_target, fake_server)
+    assert standby.wait() >= 0
+    standby.launch("http://127.0.0.1:1/")
+    standby.wait()
+    assert standby.error is None
+    assert standby.launch_time is not None
+    fake_target.launch.assert_called_once_with("http://127.0.0.1:1/")
+    standby.cleanup()
+    assert fake_target.cleanup.call_count == 1
+    assert fake_server.close.call_count == 1
+    # launch failure
+    fake_target.launch.side_effect = TargetLaunchError("test")
+    standby = StandbyTarget(fake_target, fake_server)
+    standby.launch("http://127.0.0.1:1/")
+    standby.wait()
+    assert isinstance(standby.error, TargetLaunchError)
+
+def test_session_09(tmp_path, mocker):
+    """test Session.run() with standby targets"""
+    Status.PATH = str(tmp_path)
+    fake_server = mocker.patch("sapphire.Sapphire", autospec=True)
+    mocker.patch("grizzly.session.TestFile", autospec=True)
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
+    fake_adapter.IGNORE_UNSERVED = False
+    fake_adapter.ROTATION_PERIOD = 1
+    fake_adapter.TEST_DURATION = 10
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.active_input = None
+    fake_iomgr.harness = None
+    fake_iomgr.input_files = []
+    fake_iomgr.landing_page.return_value = "HOMEPAGE.HTM"
+    fake_iomgr.server_map = mocker.Mock(spec=ServerMap)
+    fake_iomgr.tests = []
+    fake_iomgr.working_path = str(tmp_path)
+    targets = []
+    def fake_factory():
+        new_target = mocker.Mock(spec=Target)
+        new_target.closed = False
+        new_target.log_size.return_value = 0
+        new_target.prefs = None
+        new_target.rl_countdown = 1
+        new_target.rl_reset = 1
+        targets.append(new_target)
+        return new_target
+    first_target = fake_factory()
+    first_target.closed = True
+    session = Session(fake_adapter, False, [], fake_iomgr, None, first_target, target_factory=fake_factory)
+    session.config_server(5)
+    session._lol = mocker.Mock(spec=LogOutputLimiter)
+    fake_server.return_value.serve_testcase.return_value = (SERVED_ALL, ["a.html"])
+    session.run(1)
+    # initial launch is not performed in the background
+    assert first_target.launch.call_count == 1
+    assert len(targets) == 2
+    assert session._standby is not None
+    assert fake_adapter.pre_launch.call_count == 2
+    first_target.closed = True
+    session.run(2)
+    # standby target is now active
+    assert session.target is targets[1]
+    assert first_target.cleanup.call_count == 1
+    assert targets[1].launch.call_count == 1
+    assert fake_adapter.monitor == targets[1].monitor
+    assert session._launches == 2
+    session.close()
+    assert session._standby is None
+    assert targets[2].cleanup.call_count == 1
+
+def test_session_10(tmp_path, mocker):
+    """test Session.use_standby() launch failures"""
+    Status.PATH = str(tmp_path)
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
+    fake_adapter.TEST_DURATION = 10
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.harness = None
+    fake_iomgr.tests = []
+    fake_iomgr.working_path = str(tmp_path)
+    fake_iomgr.landing_page.return_value = "x"
+    fake_reporter = mocker.Mock(spec=Reporter)
+    fake_target = mocker.Mock(spec=Target)
+    fake_target.closed = True
+    session = Session(fake_adapter, False, [], fake_iomgr, fake_reporter, fake_target)
+    session.server = mocker.Mock(spec=Sapphire)
+    # launch error
+    standby = mocker.Mock(spec=StandbyTarget)
+    standby.error = TargetLaunchError("test")
+    standby.launch_time = 1.0
+    standby.target = mocker.Mock(spec=Target)
+    standby.wait.return_value = 0.0
+    session._standby = standby
+    with pytest.raises(TargetLaunchError):
+        session.use_standby()
+    assert session.target is standby.target
+    assert session.status.results == 1
+    assert standby.target.save_logs.call_count == 1
+    # launch timeout
+    session.launch_target = mocker.Mock()
+    standby.error = TargetLaunchTimeout("test")
+    session._standby = standby
+    session.use_standby()
+    assert session.launch_target.call_count == 1
+    session.close()
+
+def test_session_11(tmp_path, mocker):
+    """test Session.save_checkpoint() and Session.load_checkpoint()"""
+    Status.PATH = str(tmp_path)
+    checkpoint = tmp_path / "checkpoint.json"
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
+    fake_adapter.NAME = "fake"
+    fake_adapter.ROTATION_PERIOD = 0
+    fake_adapter.fuzz = {"seed": 1}
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.save_state.return_value = {"active_input": "a.txt", "generated": 3}
+    session = Session(fake_adapter, False, [], fake_iomgr, None, None, checkpoint=str(checkpoint))
+    try:
+        assert not session.load_checkpoint()
+        # frequency limited
+        assert not session.save_checkpoint()
+        assert not checkpoint.is_file()
+        session.status.iteration = 10
+        session.status.results = 2
+        session.status.ignored = 1
+        assert session.save_checkpoint(force=True)
+        assert checkpoint.is_file()
+        # adapter state cannot be serialized
+        fake_adapter.fuzz = {"obj": object()}
+        assert session.save_checkpoint(force=True)
+    finally:
+        session.close()
+    fake_adapter.fuzz = {}
+    session = Session(fake_adapter, False, [], fake_iomgr, None, None, checkpoint=str(checkpoint))
+    try:
+        assert session.load_checkpoint()
+        assert session.status.iteration == 10
+        assert session.status.results == 2
+        assert session.status.ignored == 1
+        assert fake_iomgr.load_state.call_count == 1
+        assert fake_iomgr.load_state.call_args[0][0]["active_input"] == "a.txt"
+        assert not fake_adapter.fuzz
+        # mismatched adapter
+        fake_adapter.NAME = "other"
+        assert not session.load_checkpoint()
+        # invalid data
+        checkpoint.write_text(u"{bad")
+        assert not session.load_checkpoint()
+        session.clear_checkpoint()
+        assert not checkpoint.is_file()
+    finally:
+        session.close()
+
+def test_session_12(tmp_path, mocker):
+    """test Session.run() checkpoints"""
+    Status.PATH = str(tmp_path)
+    mocker.patch("sapphire.Sapphire", autospec=True)
+    checkpoint = tmp_path / "checkpoint.json"
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
+    fake_adapter.NAME = "fake"
+    fake_adapter.ROTATION_PERIOD = 10
+    fake_adapter.TEST_DURATION = 10
+    fake_adapter.fuzz = {}
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.server_map = mocker.Mock(spec=ServerMap)
+    fake_iomgr.active_input = None
+    fake_iomgr.harness = None
+    fake_iomgr.input_files = []
+    fake_iomgr.tests = []
+    fake_iomgr.working_path = str(tmp_path)
+    fake_iomgr.landing_page.return_value = "x"
+    fake_iomgr.save_state.return_value = {"active_input": None, "generated": 0}
+    fake_target = mocker.Mock(spec=Target)
+    fake_target.closed = False
+    fake_target.prefs = None
+    fake_target.log_size.return_value = 0
+    fake_target.rl_countdown = 100
+    session = Session(fake_adapter, False, [], fake_iomgr, None, fake_target, checkpoint=str(checkpoint))
+    session.config_server(5)
+    session.server.serve_testcase.return_value = (SERVED_ALL, ["x"])
+    try:
+        session.run(iteration_limit=2)
+        assert checkpoint.is_file()
+        # single pass complete
+        fake_adapter.ROTATION_PERIOD = 0
+        fake_iomgr.active_input = mocker.Mock(spec=InputFile)
+        fake_iomgr.active_input.file_name = "input.txt"
+        session.run(iteration_limit=5)
+        assert not checkpoint.is_file()
+    finally:
+        session.close()
+
+def test_session_13(tmp_path, mocker):
+    """test Session.run() serving batches"""
+    Status.PATH = str(tmp_path)
+    mocker.patch("sapphire.Sapphire", autospec=True)
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 3
+    fake_adapter.IGNORE_UNSERVED = True
+    fake_adapter.ROTATION_PERIOD = 0
+    fake_adapter.TEST_DURATION = 10
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.active_input = mocker.Mock(spec=InputFile)
+    fake_iomgr.active_input.file_name = "input.txt"
+    fake_iomgr.harness = mocker.Mock(spec=TestFile)
+    fake_iomgr.harness.file_name = "harness.html"
+    fake_iomgr.input_files = ["a", "b", "c", "d"]
+    fake_iomgr.landing_page.return_value = "harness.html"
+    fake_iomgr.server_map = ServerMap()
+    fake_iomgr.tests = []
+    fake_iomgr.working_path = str(tmp_path)
+    def fake_create(*_, **__):
+        fake_iomgr.input_files.pop()
+        test = mocker.Mock(spec=TestCase, duration=None, input_fname=None, landing_page="a.html")
+        test.contents = ["harness.html"]
+        test.optional = ["harness.html"]
+        return test
+    fake_iomgr.create_testcase.side_effect = fake_create
+    fake_iomgr.inputs_exhausted.side_effect = lambda: not fake_iomgr.input_files
+    fake_target = mocker.Mock(spec=Target)
+    fake_target.closed = False
+    fake_target.forced_close = True
+    fake_target.log_size.return_value = 0
+    fake_target.prefs = None
+    fake_target.rl_countdown = 10
+    fake_target.rl_reset = 10
+    fake_summary = mocker.Mock(spec=ReplaySummary)
+    session = Session(fake_adapter, False, [], fake_iomgr, None, fake_target, summary=fake_summary)
+    session.config_server(5)
+    assert session.server is not None
+    assert "&batch=3&close_after=30" in session.location
+    session.server.serve_path.return_value = (SERVED_ALL, ["a.html"])
+    session.server.serve_testcase.return_value = (SERVED_ALL, ["b.html"])
+    session.run()
+    # a batch of 3 and a batch of 1 (inputs exhausted)
+    assert session.status.iteration == 4
+    assert fake_iomgr.create_testcase.call_count == 4
+    assert [x[1]["batch_index"] for x in fake_iomgr.create_testcase.call_args_list] == [0, 1, 2, 0]
+    fake_iomgr.end_batch.assert_called_once_with(1)
+    assert fake_summary.record.call_count == 4
+    assert session.server.serve_path.call_count == 1
+    assert session.server.serve_path.call_args[1]["optional_files"] == ("harness.html",)
+    assert session.server.serve_testcase.call_count == 1
+    assert fake_adapter.on_served.call_count == 4
+    session.close()
+
+def test_session_14(tmp_path, mocker):
+    """test Session.report_result() records the signature once submitted"""
+    Status.PATH = str(tmp_path)
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 1
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.working_path = str(tmp_path)
+    fake_iomgr.tests = [mocker.Mock(spec=TestCase, input_fname="a.html")]
+    fake_reporter = mocker.Mock(spec=Reporter)
+    fake_summary = mocker.Mock(spec=ReplaySummary)
+    fake_target = mocker.Mock(spec=Target)
+    session = Session(fake_adapter, False, [], fake_iomgr, fake_reporter, fake_target, summary=fake_summary)
+    session.report_result()
+    assert fake_reporter.submit.call_count == 1
+    assert fake_summary.add_signature.call_count == 0
+    fake_reporter.submit.call_args[1]["callback"]("sig")
+    fake_summary.add_signature.assert_called_once_with("a.html", "sig")
+    # without a summary
+    fake_reporter.reset_mock()
+    session = Session(fake_adapter, False, [], fake_iomgr, fake_reporter, fake_target)
+    session.report_result()
+    assert fake_reporter.submit.call_args[1]["callback"] is None
+    session.close()
+
+def test_session_15(tmp_path, mocker):
+    """test Session.run() results of a partially served batch"""
+    Status.PATH = str(tmp_path)
+    mocker.patch("sapphire.Sapphire", autospec=True)
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 3
+    fake_adapter.IGNORE_UNSERVED = True
+    fake_adapter.ROTATION_PERIOD = 0
+    fake_adapter.TEST_DURATION = 10
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.active_input = mocker.Mock(spec=InputFile)
+    fake_iomgr.active_input.file_name = "input.txt"
+    fake_iomgr.harness = mocker.Mock(spec=TestFile)
+    fake_iomgr.input_files = ["c.html", "b.html", "a.html"]
+    fake_iomgr.landing_page.return_value = "harness.html"
+    fake_iomgr.server_map = ServerMap()
+    fake_iomgr.tests = []
+    fake_iomgr.working_path = str(tmp_path)
+    def fake_create(*_, **kwargs):
+        test = mocker.Mock(
+            spec=TestCase,
+            duration=None,
+            input_fname=fake_iomgr.input_files.pop(),
+            landing_page="test_%d.html" % (kwargs["batch_index"],))
+        test.contents = [test.landing_page]
+        test.optional = []
+        fake_iomgr.tests.append(test)
+        return test
+    fake_iomgr.create_testcase.side_effect = fake_create
+    fake_iomgr.inputs_exhausted.side_effect = lambda: not fake_iomgr.input_files
+    fake_target = mocker.Mock(spec=Target)
+    fake_target.closed = False
+    fake_target.detect_failure.return_value = fake_target.RESULT_FAILURE
+    fake_target.log_size.return_value = 0
+    fake_target.prefs = None
+    fake_target.rl_countdown = 10
+    fake_target.rl_reset = 10
+    fake_summary = mocker.Mock(spec=ReplaySummary)
+    session = Session(fake_adapter, False, [], fake_iomgr, None, fake_target, summary=fake_summary)
+    session.report_result = mocker.Mock()
+    session.config_server(5)
+    # the third test case in the batch is not served
+    session.server.serve_path.return_value = (SERVED_TIMEOUT, ["test_0.html", "test_1.html"])
+    session.run()
+    assert session.status.results == 1
+    # the unserved test case is removed
+    assert [x.input_fname for x in fake_iomgr.tests] == ["a.html", "b.html"]
+    # the result is attributed to the last test case that was served
+    session.report_result.assert_called_once_with(input_fname="b.html")
+    failures = [x[0][0] for x in fake_summary.record.call_args_list if x[1]["failure"]]
+    assert failures == ["b.html"]
+    failures = [x[0][0] for x in fake_iomgr.record_result.call_args_list if x[1]["failure"]]
+    assert failures == ["b.html"]
+    session.close()
+
+def test_session_16(tmp_path, mocker):
+    """test Session.serve_batch() with file name collisions"""
+    Status.PATH = str(tmp_path)
+    mocker.patch("sapphire.Sapphire", autospec=True)
+    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter.BATCH_SIZE = 3
+    fake_iomgr = mocker.Mock(spec=IOManager)
+    fake_iomgr.harness = mocker.Mock(spec=TestFile)
+    fake_iomgr.harness.file_name = "harness.html"
+    fake_iomgr.server_map = ServerMap()
+    fake_iomgr.server_map.set_redirect("first_test", "test_0.html", required=False)
+    fake_iomgr.server_map.set_redirect("batch_test_1", "test_1.html", required=False)
+    fake_iomgr.server_map.set_redirect("batch_test_2", "test_2.html", required=False)
+    fake_iomgr.server_map.set_redirect("next_test", "test_3.html")
+    fake_iomgr.working_path = str(tmp_path)
+    batch = list()
+    for index, contents in enumerate((["a.js"], ["a.js"], [])):
+        test = mocker.Mock(spec=TestCase, duration=None)
+        test.contents = ["harness.html", "test_%d.html" % (index,)] + contents
+        test.optional = ["harness.html"]
+        batch.append(test)
+    fake_target = mocker.Mock(spec=Target)
+    session = Session(fake_adapter, False, [], fake_iomgr, None, fake_target)
+    session.config_server(5)
+    required = list()
+    def fake_serve(*_, **kwargs):
+        redirects = kwargs["server_map"].redirect
+        required.append(sorted(x for x in redirects if redirects[x].required))
+        return (SERVED_ALL, ["test_%d.html" % (len(required) - 1,)])
+    session.server.serve_path.side_effect = fake_serve
+    # the second test case is served separately, "batch_test_1" ends the first group
+    server_status, files_served = session.serve_batch(batch)
+    assert server_status == SERVED_ALL
+    assert files_served == ["test_0.html", "test_1.html"]
+    assert required == [["batch_test_1"], ["next_test"]]
+    assert batch[0].dump.call_count == 1
+    assert all(x.duration is not None for x in batch)
+    # no collisions
+    required = list()
+    batch[1].contents = ["harness.html", "test_1.html"]
+    session.serve_batch(batch)
+    assert required == [["next_test"]]
+    assert fake_iomgr.server_map.redirect["next_test"].required
+    assert not fake_iomgr.server_map.redirect["batch_test_1"].required
+    # incomplete group
+    required = list()
+    batch[1].contents = ["harness.html", "test_1.html", "a.js"]
+    session.server.serve_path.side_effect = None
+    session.server.serve_path.return_value = (SERVED_TIMEOUT, [])
+    assert session.serve_batch(batch) == (SERVED_TIMEOUT, [])
+    assert fake_iomgr.server_map.redirect["next_test"].required
+    session.close()
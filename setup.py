@@ -36,6 +36,7 @@ if __name__ == '__main__':
         entry_points={
             'console_scripts': [
                 'grizzly = grizzly.main:console_main',
+                'grizzly.benchmark = grizzly.benchmark:main',
                 'grizzly.status = grizzly.common.status_reporter:main',
             ],
             'grizzly_targets': [